@@ -78,6 +78,7 @@ function show_hide() {
 show_hide dump1090_messages-messages_978.rrd dump978
 show_hide airspy_rssi-max.rrd airspy
 show_hide dump1090_misc-gain_db.rrd dump1090-misc
+show_hide dump1090_msgrate-median.rrd dump1090-msgrate
 
 
 if ! chk_enabled "$HIDE_SYSTEM"; then
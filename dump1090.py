@@ -1,12 +1,39 @@
 import collectd, sys
 import json, math
+import codecs, mmap, random, struct
+from array import array
 from contextlib import closing
 try:
     from urllib2 import urlopen, URLError
+    from urllib import url2pathname
+    from urlparse import urlsplit
+    import httplib
 except ImportError:
-    from urllib.request import urlopen, URLError
+    from urllib.request import urlopen, URLError, url2pathname
+    from urllib.parse import urlsplit
+    import http.client as httplib
+import os
 import time
-import subprocess
+import socket
+import threading
+import zlib
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from compression import zstd
+    zstd_decompress = zstd.decompress
+except ImportError:
+    try:
+        import zstandard
+        zstd_decompress = lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    except ImportError:
+        zstd_decompress = None
 
 if (sys.version_info > (3, 0)):
     def has_key(book, key):
@@ -15,6 +42,489 @@ else:
     def has_key(book, key):
         return book.has_key(key)
 
+# Concurrent fetching
+#
+# All JSON sources of one read cycle are fetched in parallel on a small shared
+# pool of worker threads.  The read callback waits for them until a single
+# deadline and carries on with whatever arrived; fetches still running at that
+# point are abandoned and end on their own urlopen timeout.
+
+FETCH_THREADS = 6
+FETCH_TIMEOUT = 5.0
+FETCH_DEADLINE = 10.0
+
+fetch_queue = Queue()
+fetch_workers = []
+fetch_lock = threading.Lock()
+
+class FetchJob(object):
+    def __init__(self, url, timeout, loader):
+        self.url = url
+        self.timeout = timeout
+        self.loader = loader
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.start = None
+        self.elapsed = None
+
+    def run(self):
+        self.start = time.time()
+        try:
+            self.result = self.loader(self.url, self.timeout)
+        except Exception as error:
+            self.error = error
+        self.elapsed = time.time() - self.start
+        self.done.set()
+
+# Keep-alive HTTP
+#
+# http:// sources are fetched over persistent HTTP/1.1 connections kept in a
+# per-host pool.  Requests advertise gzip and carry the ETag / Last-Modified
+# validators of the previous response, so an unchanged file costs a 304 and
+# the previously decoded JSON is returned without parsing anything.
+
+HTTP_POOL_SIZE = 2
+
+http_pool = {}
+http_validators = {}
+http_lock = threading.Lock()
+
+def load_json(url, timeout):
+    if url.startswith('http://') or url.startswith('https://'):
+        return http_get(url, timeout, decode_json)
+    with closing(urlopen(url, None, timeout)) as f:
+        return json.load(f)
+
+def decode_json(body):
+    return json.loads(body.decode('utf-8'))
+
+def http_connection(key, timeout):
+    with http_lock:
+        idle = http_pool.get(key)
+        if idle:
+            conn = idle.pop()
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+    scheme, netloc = key
+    if scheme == 'https':
+        return httplib.HTTPSConnection(netloc, timeout=timeout), False
+    return httplib.HTTPConnection(netloc, timeout=timeout), False
+
+def http_release(key, conn):
+    with http_lock:
+        idle = http_pool.setdefault(key, [])
+        if len(idle) < HTTP_POOL_SIZE:
+            idle.append(conn)
+            return
+    conn.close()
+
+def http_get(url, timeout, decode):
+    """GET url and decode the body, an unchanged body is decoded only once."""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    headers = {'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'}
+    cached = http_validators.get(url)
+    if cached is not None:
+        etag, last_modified, data = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    conn, reused = http_connection(key, timeout)
+    try:
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except socket.timeout:
+            raise
+        except (httplib.HTTPException, IOError):
+            # the server may have dropped an idle connection, retry once on a fresh one
+            conn.close()
+            if not reused:
+                raise
+            conn, reused = http_connection(key, timeout)
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        body = response.read()
+    except:
+        conn.close()
+        raise
+
+    if response.will_close:
+        conn.close()
+    else:
+        http_release(key, conn)
+
+    if response.status == 304 and cached is not None:
+        return cached[2]
+    if response.status != 200:
+        raise URLError('HTTP %d %s for %s' % (response.status, response.reason, url))
+
+    if response.getheader('Content-Encoding', '') == 'gzip':
+        body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    data = decode(body)
+
+    etag = response.getheader('ETag')
+    last_modified = response.getheader('Last-Modified')
+    if etag or last_modified:
+        http_validators[url] = (etag, last_modified, data)
+    else:
+        http_validators.pop(url, None)
+    return data
+
+# Change-aware cache
+#
+# receiver.json and similar slow-changing sources are kept decoded in memory,
+# keyed by URL.  A file:// entry is reused while the file's mtime and size are
+# unchanged, an http:// entry is reused without a request until it is older
+# than the TTL and then revalidated with a conditional request.  Every entry
+# is reloaded at least once per TTL.
+
+CACHE_TTL = 3600.0
+
+class JsonCache(object):
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def load(self, url, timeout):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(url)
+
+        try:
+            if url.startswith('file://'):
+                st = os.stat(url2pathname(urlsplit(url).path))
+                stamp = (st.st_mtime, st.st_size)
+                hit = entry is not None and entry[1] == stamp and now - entry[2] < self.ttl
+                data = entry[0] if hit else load_json(url, timeout)
+                loaded = entry[2] if hit else now
+            else:
+                stamp = None
+                if entry is not None and now - entry[2] < self.ttl:
+                    hit, data, loaded = True, entry[0], entry[2]
+                else:
+                    # http sources revalidate, a 304 hands back the same object
+                    data = load_json(url, timeout)
+                    hit = entry is not None and data is entry[0]
+                    loaded = now
+        except:
+            self.evict(url)
+            raise
+
+        with self.lock:
+            self.entries[url] = (data, stamp, loaded)
+            counters = self.counters.setdefault(url, [0, 0])
+            counters[0 if hit else 1] += 1
+        return data
+
+    def evict(self, url=None):
+        with self.lock:
+            if url is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(url, None)
+
+    def stats(self, url):
+        """(hits, misses) for url since the plugin was loaded."""
+        with self.lock:
+            return tuple(self.counters.get(url, (0, 0)))
+
+json_cache = JsonCache()
+
+def dispatch_cache_stats(data, name, cache_url):
+    instance_name,host,url = data
+    hits, misses = json_cache.stats(cache_url)
+    now = time.time()
+    V.dispatch(plugin_instance = instance_name,
+               host = host,
+               type = 'dump1090_cache',
+               type_instance = name + '_hits',
+               time = now,
+               values = [hits],
+               interval = 60)
+    V.dispatch(plugin_instance = instance_name,
+               host = host,
+               type = 'dump1090_cache',
+               type_instance = name + '_misses',
+               time = now,
+               values = [misses],
+               interval = 60)
+
+# Projecting aircraft.json parser
+#
+# json.load builds a dict for every aircraft with dozens of fields that are
+# never read, and keeps all of them alive until the list is complete.  Here
+# every aircraft object is handed to an object_hook as soon as it has been
+# decoded, its few used fields are copied into the columns of an
+# AircraftTable and the dict is dropped, leaving None in the aircraft list.
+# file:// sources are decoded straight from a memory map, so the file is
+# held once, as text.  tests/bench_parse.py compares this with json.load.
+
+def decode_aircraft(text):
+    """aircraft.json text decoded with the aircraft list replaced by an AircraftTable."""
+    add, finish = aircraft_builder()
+
+    def project(obj):
+        # nested objects like lastPosition have no address
+        if 'hex' in obj and 'seen' in obj:
+            add(obj)
+            return None
+        return obj
+
+    aircraft_data = json.loads(text, object_hook=project)
+    if not has_key(aircraft_data, 'aircraft'):
+        raise ValueError('no aircraft list')
+    del aircraft_data['aircraft']
+    aircraft_data['table'] = finish()
+    return aircraft_data
+
+def decode_aircraft_body(body):
+    return decode_aircraft(body.decode('utf-8'))
+
+def parse_aircraft_file(path):
+    """Parse an aircraft.json file, the aircraft end up in an AircraftTable."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError('empty file ' + path)
+        with closing(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)) as mm:
+            text = codecs.utf_8_decode(mm, 'strict', True)[0]
+    return decode_aircraft(text)
+
+# binCraft URLs that failed, served from aircraft.json until BINCRAFT_RETRY has passed
+BINCRAFT_RETRY = 3600.0
+bincraft_failed = {}
+
+def load_aircraft(url, timeout):
+    """aircraft.json or .binCraft with the aircraft list replaced by an AircraftTable."""
+    if '.binCraft' in url:
+        if time.time() - bincraft_failed.get(url, 0) > BINCRAFT_RETRY:
+            try:
+                return load_bincraft(url, timeout)
+            except Exception as error:
+                collectd.warning('%s, using aircraft.json instead' % error)
+                bincraft_failed[url] = time.time()
+        url = endpoint(url) + '/aircraft.json'
+    if url.startswith('file://'):
+        return parse_aircraft_file(url2pathname(urlsplit(url).path))
+    if url.startswith('http://') or url.startswith('https://'):
+        # an unchanged file hands back the cached document, callers get their own copy
+        return dict(http_get(url, timeout, decode_aircraft_body))
+    with closing(urlopen(url, None, timeout)) as f:
+        return decode_aircraft_body(f.read())
+
+def fetch_worker():
+    while True:
+        job = fetch_queue.get()
+        job.run()
+
+def start_fetch_workers():
+    with fetch_lock:
+        while len(fetch_workers) < FETCH_THREADS:
+            t = threading.Thread(target=fetch_worker, name='dump1090-fetch')
+            t.daemon = True
+            t.start()
+            fetch_workers.append(t)
+
+# Circuit breaker
+#
+# Every endpoint (the directory a source file lives in) has a Breaker.  After
+# BREAKER_FAILURES cycles in a row in which none of its files could be
+# fetched, the endpoint is left alone for an exponentially growing, jittered
+# backoff.  Once that has passed a single file is fetched as a probe with a
+# short timeout; only if it succeeds are the endpoint's other files fetched
+# and the breaker closed again.
+
+BREAKER_FAILURES = 3
+BACKOFF_MIN = 60.0
+BACKOFF_MAX = 1800.0
+PROBE_TIMEOUT = 2.0
+
+CLOSED, OPEN, HALF_OPEN = range(3)
+
+class CircuitOpen(URLError):
+    pass
+
+class Breaker(object):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0
+        self.retry_at = 0
+
+    def allow(self):
+        """CLOSED to fetch everything, HALF_OPEN to probe, OPEN to skip."""
+        with self.lock:
+            if self.state == OPEN and time.time() >= self.retry_at:
+                self.state = HALF_OPEN
+                return HALF_OPEN
+            if self.state == HALF_OPEN:
+                # another cycle is probing right now
+                return OPEN
+            return self.state
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                if self.state != CLOSED:
+                    collectd.info('dump1090: %s is back up' % self.endpoint)
+                self.state = CLOSED
+                self.failures = 0
+                self.backoff = 0
+                return
+
+            self.failures += 1
+            if self.state == CLOSED and self.failures < BREAKER_FAILURES:
+                return
+            if self.state == CLOSED:
+                collectd.info('dump1090: %s is down, backing off' % self.endpoint)
+            self.state = OPEN
+            self.backoff = min(max(2 * self.backoff, BACKOFF_MIN), BACKOFF_MAX)
+            self.retry_at = time.time() + self.backoff * random.uniform(0.5, 1.0)
+
+    def up(self):
+        return self.state == CLOSED
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+def endpoint(url):
+    return url.rsplit('/', 1)[0]
+
+def breaker(url):
+    key = endpoint(url)
+    with breakers_lock:
+        if not has_key(breakers, key):
+            breakers[key] = Breaker(key)
+        return breakers[key]
+
+def dispatch_source_up(data, url, type_instance):
+    instance_name,host,_ = data
+    V.dispatch(plugin_instance = instance_name,
+               host = host,
+               type = 'dump1090_misc',
+               type_instance = type_instance,
+               time = time.time(),
+               values = [1 if breaker(url).up() else 0],
+               interval = 60)
+
+def fetch_sources(sources, deadline=FETCH_DEADLINE, cached=(), aircraft=()):
+    """Fetch and decode the {name: url} sources concurrently.
+
+    Sources named in cached are served through json_cache, the ones named in
+    aircraft are loaded with load_aircraft.  Returns (results, errors,
+    timings), all keyed by name.  Sources that did not finish before the
+    deadline show up in errors and their timing is the time waited for them;
+    sources that failed outright have no timing.  Sources of an endpoint
+    whose breaker is open fail with CircuitOpen.
+    """
+    start_fetch_workers()
+
+    start = time.time()
+    results = {}
+    errors = {}
+    timings = {}
+
+    def submit(name, timeout):
+        url = sources[name]
+        if name in cached:
+            loader = json_cache.load
+        elif name in aircraft:
+            loader = load_aircraft
+        else:
+            loader = load_json
+        job = FetchJob(url, min(timeout, deadline), loader)
+        fetch_queue.put(job)
+        return job
+
+    def wait(jobs):
+        for name, job in jobs.items():
+            if not job.done.wait(max(0, start + deadline - time.time())):
+                errors[name] = URLError('deadline exceeded for ' + job.url)
+                timings[name] = time.time() - start
+            elif job.error is not None:
+                errors[name] = job.error
+            else:
+                results[name] = job.result
+                timings[name] = job.elapsed
+
+    # the breaker only learns from real requests, cached sources sort last and
+    # the small uncached ones (stats.json) first, the first one is the probe
+    endpoints = {}
+    for name in sorted(sources, key=lambda name: (name in cached, name in aircraft, name)):
+        endpoints.setdefault(endpoint(sources[name]), []).append(name)
+
+    jobs = {}
+    states = {}
+    for key, names in endpoints.items():
+        state = states[key] = breaker(sources[names[0]]).allow()
+        if state == CLOSED:
+            for name in names:
+                jobs[name] = submit(name, FETCH_TIMEOUT)
+        elif state == HALF_OPEN:
+            jobs[names[0]] = submit(names[0], PROBE_TIMEOUT)
+        else:
+            for name in names:
+                errors[name] = CircuitOpen('backing off from ' + key)
+    wait(jobs)
+
+    probed = {}
+    for key, names in endpoints.items():
+        if states[key] == OPEN:
+            continue
+        # a cache hit says nothing about the endpoint
+        fetched = [name for name in names if name not in cached] or names
+        ok = any(has_key(results, name) for name in fetched)
+        breaker(sources[names[0]]).record(ok)
+        if states[key] == HALF_OPEN:
+            for name in names[1:]:
+                if ok:
+                    probed[name] = submit(name, FETCH_TIMEOUT)
+                else:
+                    errors[name] = CircuitOpen('backing off from ' + key)
+    wait(probed)
+
+    return results, errors, timings
+
+def dispatch_fetch_times(data, timings, suffix=''):
+    instance_name,host,url = data
+    now = time.time()
+    for name, elapsed in timings.items():
+        V.dispatch(plugin_instance = instance_name,
+                   host = host,
+                   type = 'dump1090_fetch',
+                   type_instance = name + suffix,
+                   time = now,
+                   values = [elapsed],
+                   interval = 60)
+
+def receiver_position(receiver):
+    if receiver is not None and has_key(receiver,'lat'):
+        return float(receiver['lat']), float(receiver['lon'])
+    return None, None
+
+# threads of the prefetchers and stream collectors, run between init and shutdown
+background = []
+
+def start_background():
+    for worker in background:
+        worker.start()
+
+def stop_background():
+    for worker in background:
+        worker.stop()
 
 def handle_config(root):
     for child in root.children:
@@ -26,6 +536,16 @@ def handle_config(root):
             url_978 = None
             url_airspy = 'file:///run/airspy_adsb'
             url_signal = None
+            services = SERVICES
+            sample_interval = 0
+            prefetch_lead = 0
+            aircraft_file = AIRCRAFT_FILES['json']
+            beast_address = None
+            coverage_path = None
+            coverage_export = None
+            heatmap_path = None
+            heatmap_export = None
+            prefetch_max_age = PREFETCH_MAX_AGE
             for ch2 in child.children:
                 if ch2.key == 'URL':
                     url = ch2.values[0]
@@ -35,17 +555,85 @@ def handle_config(root):
                     url_airspy = ch2.values[0]
                 if ch2.key == 'URL_1090_SIGNAL':
                     url_signal = ch2.values[0]
+                if ch2.key == 'SERVICES':
+                    services = ch2.values
+                if ch2.key == 'SAMPLE_INTERVAL':
+                    sample_interval = int(ch2.values[0])
+                if ch2.key == 'AIRCRAFT_FORMAT':
+                    if ch2.values[0] in AIRCRAFT_FILES:
+                        aircraft_file = AIRCRAFT_FILES[ch2.values[0]]
+                    else:
+                        collectd.warning('Unknown AIRCRAFT_FORMAT %s, using json' % ch2.values[0])
+                if ch2.key == 'COVERAGE':
+                    coverage_path = ch2.values[0]
+                if ch2.key == 'COVERAGE_JSON':
+                    coverage_export = ch2.values[0]
+                if ch2.key == 'HEATMAP':
+                    heatmap_path = ch2.values[0]
+                if ch2.key == 'HEATMAP_JSON':
+                    heatmap_export = ch2.values[0]
+                if ch2.key == 'BEAST':
+                    beast_address = ch2.values[0]
+                if ch2.key == 'PREFETCH':
+                    prefetch_lead = float(ch2.values[0])
+                if ch2.key == 'PREFETCH_MAX_AGE':
+                    prefetch_max_age = float(ch2.values[0])
             if url:
+                index = AircraftIndex()
+                coverage = None
+                if coverage_path:
+                    try:
+                        coverage = Coverage(coverage_path, coverage_export or
+                                            '/run/graphs1090/dump1090-%s-coverage.json' % instance_name)
+                        background.append(coverage)
+                    except (IOError, OSError, ValueError) as error:
+                        collectd.warning('No coverage for %s: %s' % (instance_name, error))
+                heatmap = None
+                if heatmap_path:
+                    try:
+                        heatmap = Heatmap(heatmap_path, heatmap_export or
+                                          '/run/graphs1090/dump1090-%s-heatmap.json' % instance_name)
+                        background.append(heatmap)
+                    except (IOError, OSError, ValueError) as error:
+                        collectd.warning('No heatmap for %s: %s' % (instance_name, error))
+                highres = None
+                if sample_interval > 0:
+                    highres = HighResSampler()
+                    collectd.register_read(callback=sample_1090,
+                                           data=(instance_name, 'localhost', url, url_signal, aircraft_file, highres),
+                                           name='dump1090.sample.' + instance_name,
+                                           interval=sample_interval)
+                prefetch = None
+                if prefetch_lead > 0:
+                    prefetch = Prefetcher('dump1090.prefetch.' + instance_name, collect_1090,
+                                          (instance_name, 'localhost', url, url_airspy, url_signal, aircraft_file, index,
+                                           coverage, heatmap),
+                                          60, prefetch_lead, prefetch_max_age)
+                    background.append(prefetch)
+                beast = None
+                if beast_address:
+                    host, _, port = beast_address.partition(':')
+                    beast = BeastCollector('dump1090.beast.' + instance_name, host, int(port or BEAST_PORT))
+                    background.append(beast)
                 collectd.register_read(callback=read_1090,
-                                       data=(instance_name, 'localhost', url, url_airspy, url_signal),
+                                       data=(instance_name, 'localhost', url, url_airspy, url_signal, aircraft_file, index,
+                                             coverage, heatmap, MetricSet(METRICS_1090, instance_name, 'localhost'),
+                                             ProcessSampler(services), highres, prefetch, beast),
                                        name='dump1090.' + instance_name,
                                        interval=60)
             else:
                 collectd.warning('No dump1090 URL defined in /etc/collectd/collectd.conf for ' + instance_name)
 
             if url_978:
+                prefetch = None
+                if prefetch_lead > 0:
+                    prefetch = Prefetcher('dump978.prefetch.' + instance_name, collect_978,
+                                          (instance_name, 'localhost', url_978),
+                                          60, prefetch_lead, prefetch_max_age)
+                    background.append(prefetch)
                 collectd.register_read(callback=read_978,
-                                       data=(instance_name, 'localhost', url_978),
+                                       data=(instance_name, 'localhost', url_978,
+                                             MetricSet(METRICS_978, instance_name, 'localhost'), prefetch),
                                        name='dump978.' + instance_name,
                                        interval=60)
             else:
@@ -59,266 +647,866 @@ def handle_config(root):
 
 V=collectd.Values(host='', plugin='dump1090', time=0)
 
-def dispatch_df(data, stats, name):
-    if not has_key(stats, name):
-        return
-    if not has_key(stats, 'now'):
-        return
-    instance_name,host,url = data
-
-    now = stats['now']
-    df_counts = stats[name]
-
-    for df in [0, 4, 5, 11, 16, 17, 18, 19, 20, 21]:
-        V.dispatch(plugin_instance = instance_name,
-                host = host,
-                type = 'df_count_minute',
-                type_instance = str(df),
-                time = now,
-                values = [df_counts[df]],
-                interval = 60)
-
-def dispatch_misc(now, data, stats, name, dispatch_type):
-    if not has_key(stats, name):
-        return
-    instance_name,host,url = data
-
-    subject = stats[name]
-
-    V.dispatch(plugin_instance = instance_name,
-            host = host,
-            type = dispatch_type ,
-            type_instance = name,
-            time = now,
-            values = [subject],
-            interval = 60)
-
-def dispatch_quartiles(data, stats, name):
-    if not has_key(stats, name):
-        return
-    if not has_key(stats, 'now'):
-        return
-
-    now = stats['now']
-    quart = stats[name]
-
-    instance_name,host,url = data
-    for index in ['min', 'p5', 'q1', 'median', 'q3', 'p95', 'max']:
-        if has_key(quart, index):
-            #collectd.warning(index + str(quart[index]))
-            V.dispatch(plugin_instance = instance_name,
-                    host = host,
-                    type = 'airspy_' + name,
-                    type_instance = index,
-                    time = now,
-                    values = [quart[index]],
-                    interval = 60)
-
-def read_airspy(data):
-    instance_name, host, url, url_airspy = data
-    data = (instance_name, host, url)
-
-
+# Metric schema
+#
+# Every value taken from a decoder JSON document is described by one row:
+#
+#   (source, type, type_instance, kind, value, time)
+#
+# source names the document the row reads from, value and time are dotted
+# paths into it.  kind says how the value is formed:
+#
+#   VALUE   the number at the path
+#   VALUES  a tuple of paths, dispatched together as a multi-value type
+#   SUM     the sum of the list at the path
+#   EACH    one value per list index / dict key, type_instance is a format
+#   FIRST   a tuple of (value path, time path) pairs, the first pair whose
+#           value is present wins and is stamped with its own time; the
+#           row's time is None
+#   FUNC    value is a function computing the number from the document
+#
+# Rows whose value or time is missing from the document are skipped.  The
+# tables are compiled per instance in handle_config into MetricSet objects
+# holding ready collectd.Values templates.
+
+VALUE, VALUES, SUM, EACH, FIRST, FUNC = range(6)
+
+def remote_accepted(stats):
+    remote = stats['total']['remote']
+    remote_total = sum(remote['accepted'])
+    if has_key(remote, 'basestation'):
+        remote_total += remote['basestation']
+    return remote_total
+
+def position_count(stats):
+    posCount = stats['total']['cpr']['global_ok'] + stats['total']['cpr']['local_ok']
+    if posCount == 0 and has_key(stats['total'],'position_count_total'):
+        posCount = stats['total']['position_count_total']
+    return posCount
+
+# quartile tuples from reduce_aircraft are (min, q1, median, q3, max)
+def quartile_rows(source, dispatch_type, path, names, suffix=''):
+    return [(source, dispatch_type, name + suffix, VALUE, '%s.%d' % (path, i), 'now')
+            for i, name in enumerate(names) if name is not None]
+
+# downlink formats with a df_counts graph
+DF_GRAPHED = (0, 4, 5, 11, 16, 17, 18, 19, 20, 21)
+
+AIRSPY_METRICS = (
+    [('airspy', 'airspy_' + name, index, VALUE, name + '.' + index, 'now')
+        for name in ('rssi', 'snr', 'noise')
+        for index in ('min', 'p5', 'q1', 'median', 'q3', 'p95', 'max')] +
+    [('airspy', 'airspy_misc', 'preamble_filter', VALUE, 'preamble_filter', 'now'),
+     ('airspy', 'airspy_misc', 'samplerate', VALUE, 'samplerate', 'now'),
+     ('airspy', 'airspy_misc', 'gain', VALUE, 'gain', 'now'),
+     ('airspy', 'airspy_lost', 'lost_buffers', VALUE, 'lost_buffers', 'now'),
+     ('airspy', 'airspy_aircraft', 'max_aircraft_count', VALUE, 'max_aircraft_count', 'now')] +
+    [('airspy', 'df_count_minute', str(df), VALUE, 'df_counts.%d' % df, 'now')
+        for df in DF_GRAPHED]
+)
+
+# from the Beast stream, df counts only when there are none from airspy
+BEAST_METRICS = (
+    [('beast', 'df_count_minute', str(df), VALUE, 'df_counts.%d' % df, 'now')
+        for df in DF_GRAPHED] +
+    [('beast', 'dump1090_messages', 'beast', VALUE, 'messages', 'now'),
+     ('beast', 'dump1090_misc', 'beast_aircraft', VALUE, 'aircraft', 'now')] +
+    quartile_rows('beast', 'dump1090_dbfs', 'signals', ('min_signal', 'quart1', 'median', 'quart3', 'peak_signal'), '_beast')
+)
+
+METRICS_1090 = AIRSPY_METRICS + BEAST_METRICS + [
+    # signal stats.json, from URL_1090_SIGNAL when configured
+    ('signal_stats', 'dump1090_misc', 'gain_db', FIRST,
+        (('last1min.adaptive.gain_db', 'last1min.end'), ('last1min.gain_db', 'last1min.end'),
+         ('gain_db', 'now'), ('last1min.local.gain_db', 'last1min.end')), None),
+    ('signal_stats', 'dump1090_dbfs', 'signal', VALUE, 'last1min.local.signal', 'last1min.end'),
+    ('signal_stats', 'dump1090_dbfs', 'noise', VALUE, 'last1min.local.noise', 'last1min.end'),
+    ('signal_stats', 'dump1090_messages', 'strong_signals', VALUE, 'total.local.strong_signals', 'total.end'),
+
+    # stats.json
+    ('stats', 'dump1090_messages', 'local_accepted', SUM, 'total.local.accepted', 'total.end'),
+    ('stats', 'dump1090_messages', 'local_accepted_%d', EACH, 'total.local.accepted', 'total.end'),
+    ('stats', 'dump1090_messages', 'remote_accepted', FUNC, remote_accepted, 'total.end'),
+    ('stats', 'dump1090_messages', 'remote_accepted_%d', EACH, 'total.remote.accepted', 'total.end'),
+    ('stats', 'dump1090_messages', 'positions', FUNC, position_count, 'total.end'),
+    ('stats', 'dump1090_tracks', 'all', VALUE, 'total.tracks.all', 'total.end'),
+    ('stats', 'dump1090_tracks', 'single_message', VALUE, 'total.tracks.single_message', 'total.end'),
+    ('stats', 'dump1090_cpu', '%s', EACH, 'total.cpu', 'total.end'),
+
+    # aircraft.json summary
+    ('aircraft', 'dump1090_range', 'max_range', VALUE, 'max_range', 'now'),
+    ('aircraft', 'dump1090_aircraft', 'recent', VALUES, ('total', 'with_pos'), 'now'),
+    ('aircraft', 'dump1090_mlat', 'recent', VALUE, 'mlat', 'now'),
+    ('aircraft', 'dump1090_tisb', 'recent', VALUE, 'tisb', 'now'),
+    ('aircraft', 'dump1090_gps', 'recent', VALUE, 'gps', 'now'),
+    ('aircraft', 'dump1090_msgrate', 'median', VALUE, 'msgrate.0', 'now'),
+    ('aircraft', 'dump1090_msgrate', 'p90', VALUE, 'msgrate.1', 'now'),
+] + quartile_rows('aircraft', 'dump1090_range', 'ranges', ('minimum', 'quart1', 'median', 'quart3', None)) \
+  + quartile_rows('signal_aircraft', 'dump1090_dbfs', 'signals', ('min_signal', 'quart1', 'median', 'quart3', 'peak_signal'))
+
+METRICS_978 = [
+    ('aircraft', 'dump1090_aircraft', 'recent_978', VALUES, ('total', 'with_pos'), 'now'),
+    ('aircraft', 'dump1090_tisb', 'recent_978', VALUE, 'tisb', 'now'),
+    ('aircraft', 'dump1090_gps', 'recent_978', VALUE, 'gps', 'now'),
+    ('aircraft', 'dump1090_messages', 'messages_978', VALUE, 'messages', 'now'),
+    ('aircraft', 'dump1090_range', 'max_range_978', VALUE, 'max_range', 'now'),
+] + quartile_rows('aircraft', 'dump1090_range', 'ranges', ('minimum', 'quart1', 'median', 'quart3', None), '_978') \
+  + quartile_rows('aircraft', 'dump1090_dbfs', 'signals', ('min_signal', 'quart1', 'median', 'quart3', 'peak_signal'), '_978')
+
+def compile_path(path):
+    return tuple(int(key) if key.isdigit() else key for key in path.split('.'))
+
+def lookup(doc, path):
     try:
-        #airspy cpu usage
-        cmdString = "PID=$(systemctl show -p MainPID airspy_adsb | cut -f 2 -d=); cat /proc/$PID/task/*/stat | cut -d ' ' -f 14,15 && getconf CLK_TCK"
-        if (sys.version_info > (3, 0)):
-            p = subprocess.Popen(cmdString, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
+        for key in path:
+            doc = doc[key]
+    except (KeyError, IndexError, TypeError):
+        return None
+    return doc
+
+class Metric(object):
+    __slots__ = ('source', 'kind', 'value', 'time', 'type_instance', 'template', 'templates')
+
+    def __init__(self, row, instance_name, host):
+        source, dispatch_type, type_instance, kind, value, time_path = row
+        self.source = source
+        self.kind = kind
+        if kind == VALUES:
+            self.value = tuple(compile_path(p) for p in value)
+        elif kind == FIRST:
+            self.value = tuple((compile_path(p), compile_path(t)) for p, t in value)
+        elif kind == FUNC:
+            self.value = value
         else:
-            p = subprocess.Popen(cmdString, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-
-        out, err = p.communicate()
-
-        ptime=0
-
-        if p.returncode == 0 :
-            out, clk_tck, _ = out.rsplit('\n', 2)
-            out = out.split('\n')
-            biggest = 0
-            cycles = []
-            firstLine = out[0]
-            otherLines = out[1:]
-            for i in firstLine.split(' '):
-                cycles.append(int(i))
-            for line in otherLines:
-                inc = 0
-                for i in line.split(' '):
-                    cycles[inc] += int(i)
-                    inc += 1
-
-            times = [int(i*1000/int(clk_tck)) for i in cycles]
-            ptime = sum(times)
-            utime = times[0]
-            stime = times[1]
-
-            V.dispatch(plugin_instance = instance_name,
-                       host=host,
-                       type='dump1090_cpu',
-                       type_instance='airspy',
-                       time=time.time(),
-                       values = [ptime])
-    except Exception as error:
-        #collectd.warning(str(error))
-        pass
-
-    try:
-        with closing(urlopen(url_airspy + '/stats.json', None, 5.0)) as stats_file:
-            stats = json.load(stats_file)
-    except Exception as error:
-        #collectd.warning(str(error))
-        return
-
-    dispatch_quartiles(data, stats, 'rssi')
-    dispatch_quartiles(data, stats, 'snr')
-    dispatch_quartiles(data, stats, 'noise')
-
-    if has_key(stats,'now'):
-        now = stats['now']
-        dispatch_misc(now, data, stats, 'preamble_filter', 'airspy_misc')
-        dispatch_misc(now, data, stats, 'samplerate', 'airspy_misc')
-        dispatch_misc(now, data, stats, 'gain', 'airspy_misc')
-        dispatch_misc(now, data, stats, 'lost_buffers', 'airspy_lost')
-        dispatch_misc(now, data, stats, 'max_aircraft_count', 'airspy_aircraft')
+            self.value = compile_path(value)
+        self.time = None if time_path is None else compile_path(time_path)
+        self.type_instance = type_instance
+        self.template = collectd.Values(plugin='dump1090', plugin_instance=instance_name, host=host,
+                type=dispatch_type, type_instance=type_instance, interval=60)
+        # EACH rows get one template per concrete type_instance, made on first use
+        self.templates = {}
+
+    def dispatch(self, doc):
+        kind = self.kind
+        if kind == FIRST:
+            self.dispatch_first(doc)
+            return
+        now = lookup(doc, self.time)
+        if now is None:
+            return
 
-    dispatch_df(data, stats, 'df_counts')
+        if kind == VALUE:
+            value = lookup(doc, self.value)
+        elif kind == EACH:
+            self.dispatch_each(now, lookup(doc, self.value))
+            return
+        elif kind == VALUES:
+            values = [lookup(doc, p) for p in self.value]
+            if None not in values:
+                self.template.dispatch(time=now, values=values)
+            return
+        elif kind == SUM:
+            value = lookup(doc, self.value)
+            value = None if value is None else sum(value)
+        else:
+            try:
+                value = self.value(doc)
+            except (KeyError, IndexError, TypeError):
+                value = None
+
+        if value is not None:
+            self.template.dispatch(time=now, values=[value])
+
+    def dispatch_first(self, doc):
+        for path, time_path in self.value:
+            value = lookup(doc, path)
+            if value is not None:
+                now = lookup(doc, time_path)
+                if now is not None:
+                    self.template.dispatch(time=now, values=[value])
+                return
+
+    def dispatch_each(self, now, items):
+        if items is None:
+            return
+        if isinstance(items, dict):
+            items = items.items()
+        else:
+            items = enumerate(items)
+        for key, value in items:
+            template = self.templates.get(key)
+            if template is None:
+                template = self.templates[key] = collectd.Values(
+                        plugin=self.template.plugin, plugin_instance=self.template.plugin_instance,
+                        host=self.template.host, type=self.template.type,
+                        type_instance=self.type_instance % key, interval=60)
+            template.dispatch(time=now, values=[value])
+
+class MetricSet(object):
+    def __init__(self, rows, instance_name, host):
+        self.metrics = [Metric(row, instance_name, host) for row in rows]
+
+    def dispatch(self, docs):
+        """Dispatch every metric whose source document is in docs."""
+        for metric in self.metrics:
+            doc = docs.get(metric.source)
+            if doc is not None:
+                metric.dispatch(doc)
+
+def aircraft_summary(aircraft_data, reduced):
+    """The reducer output plus the aircraft.json top-level values, as one document."""
+    summary = dict(reduced)
+    for key, value in aircraft_data.items():
+        if key != 'table':
+            summary.setdefault(key, value)
+    # max range is always dispatched, even if zero
+    summary['max_range'] = reduced['ranges'][4] if reduced['ranges'] else 0
+    return summary
+
+# Process sampler
+#
+# CPU time, memory and context switches of the decoder services are read
+# straight from /proc.  The main PID of each service is found once by its
+# systemd cgroup and cached together with its start time, so it is only looked
+# up again when the process has restarted.  The per-thread stat/status files
+# stay open between cycles and are re-read from offset 0.
+
+SERVICES = ('airspy_adsb', 'readsb', 'mlat-client', 'piaware', 'fr24feed')
+# how often services that are not running are searched for again, the wait
+# doubles each time one is not found, up to RESOLVE_INTERVAL_MAX
+RESOLVE_INTERVAL = 300
+RESOLVE_INTERVAL_MAX = 6 * 3600
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def read_fd(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    return os.read(fd, 4096).decode('ascii', 'replace')
+
+def stat_fields(stat):
+    # the command name may contain spaces and parentheses, the fields start after the last ')'
+    return stat[stat.rindex(')') + 2:].split(' ')
+
+class ProcessSampler(object):
+    def __init__(self, services=SERVICES):
+        self.services = tuple(services)
+        self.pids = {}
+        self.fds = {}
+        # service -> (time of the next search, wait after that one)
+        self.retry = {}
+
+    def open(self, path):
+        fd = self.fds.get(path)
+        if fd is None:
+            fd = self.fds[path] = os.open(path, os.O_RDONLY)
+        return fd
+
+    def forget(self, pid):
+        prefix = '/proc/%d/' % pid
+        for path in [p for p in self.fds if p.startswith(prefix)]:
+            os.close(self.fds.pop(path))
+
+    def resolve(self):
+        """Find the main PID of every service that has none cached yet and is due to be searched for."""
+        now = time.time()
+        missing = [service for service in self.services
+                   if not has_key(self.pids, service) and self.retry.get(service, (0, 0))[0] <= now]
+        if not missing:
+            return
 
+        members = dict((service, {}) for service in missing)
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/%s/cgroup' % entry) as f:
+                    cgroup = f.read()
+                with open('/proc/%s/stat' % entry) as f:
+                    fields = stat_fields(f.read())
+            except (IOError, OSError):
+                continue
+            for service in missing:
+                if '/' + service + '.service\n' in cgroup:
+                    # pid -> (parent pid, start time)
+                    members[service][int(entry)] = (int(fields[1]), fields[19])
+
+        for service, procs in members.items():
+            # the main process is the one whose parent is outside the service
+            main = [pid for pid, (ppid, start) in procs.items() if ppid not in procs]
+            if main:
+                pid = min(main)
+                self.pids[service] = (pid, procs[pid][1])
+                self.retry.pop(service, None)
+            else:
+                wait = self.retry.get(service, (0, RESOLVE_INTERVAL))[1]
+                self.retry[service] = (now + wait, min(2 * wait, RESOLVE_INTERVAL_MAX))
+
+    def sample_process(self, pid, starttime):
+        """utime, stime, rss and context switches summed over all threads, None once the process is gone."""
+        try:
+            fields = stat_fields(read_fd(self.open('/proc/%d/stat' % pid)))
+            if fields[19] != starttime:
+                return None
+            rss = int(fields[21]) * PAGE_SIZE
+
+            utime = stime = voluntary = involuntary = 0
+            tasks = os.listdir('/proc/%d/task' % pid)
+        except (IOError, OSError):
+            return None
+
+        live = set()
+        for tid in tasks:
+            stat_path = '/proc/%d/task/%s/stat' % (pid, tid)
+            status_path = '/proc/%d/task/%s/status' % (pid, tid)
+            live.add(stat_path)
+            live.add(status_path)
+            try:
+                fields = stat_fields(read_fd(self.open(stat_path)))
+                status = read_fd(self.open(status_path))
+            except (IOError, OSError):
+                # thread exited between listdir and read
+                continue
+            utime += int(fields[11])
+            stime += int(fields[12])
+            for line in status.splitlines():
+                if line.startswith('voluntary_ctxt_switches:'):
+                    voluntary += int(line.split()[1])
+                elif line.startswith('nonvoluntary_ctxt_switches:'):
+                    involuntary += int(line.split()[1])
+
+        # close the files of threads that have exited
+        prefix = '/proc/%d/task/' % pid
+        for path in [p for p in self.fds if p.startswith(prefix) and p not in live]:
+            os.close(self.fds.pop(path))
+
+        return (utime * 1000 // CLK_TCK, stime * 1000 // CLK_TCK, rss, voluntary, involuntary)
+
+    def sample(self):
+        """{service: (utime ms, stime ms, rss bytes, voluntary, involuntary)} for the running services."""
+        self.resolve()
+        samples = {}
+        for service, (pid, starttime) in list(self.pids.items()):
+            sample = self.sample_process(pid, starttime)
+            if sample is None:
+                # exited or restarted, look it up again on the next cycle
+                self.forget(pid)
+                del self.pids[service]
+                self.retry.pop(service, None)
+            else:
+                samples[service] = sample
+        return samples
 
-def handle_signal_stuff(data, stats, aircraft_data):
+def read_processes(data, sampler):
     instance_name, host, url = data
 
     try:
-        if has_key(stats['last1min'],'adaptive'):
-            stuff = stats['last1min']['adaptive']
-            dispatch_misc(stats['last1min']['end'], data, stuff, 'gain_db', 'dump1090_misc')
-        elif has_key(stats['last1min'],'gain_db'):
-            stuff = stats['last1min']
-            dispatch_misc(stats['last1min']['end'], data, stuff, 'gain_db', 'dump1090_misc')
-        elif has_key(stats, 'gain_db') and has_key(stats, 'now'):
-            dispatch_misc(stats['now'], data, stats, 'gain_db', 'dump1090_misc')
-        elif has_key(stats['last1min'],'local') and has_key(stats['last1min']['local'],'gain_db'):
-            stuff = stats['last1min']['local']
-            dispatch_misc(stats['last1min']['end'], data, stuff, 'gain_db', 'dump1090_misc')
-    except:
+        samples = sampler.sample()
+    except Exception as error:
         collectd.warning(str(error))
-        pass
-
-    # Signal measurements - from the 1 min bucket
-    if has_key(stats['last1min'],'local'):
-        if has_key(stats['last1min']['local'],'signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='signal',
-                   time=stats['last1min']['end'],
-                   values = [stats['last1min']['local']['signal']],
-                   interval = 60)
-
-        if False and has_key(stats['last1min']['local'],'peak_signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='peak_signal',
-                   time=stats['last1min']['end'],
-                   values = [stats['last1min']['local']['peak_signal']],
-                   interval = 60)
-
-        if False and has_key(stats['last1min']['local'],'min_signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='min_signal',
-                   time=stats['last1min']['end'],
-                   values = [stats['last1min']['local']['min_signal']],
-                   interval = 60)
-
-        if has_key(stats['last1min']['local'],'noise'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='noise',
-                   time=stats['last1min']['end'],
-                   values = [stats['last1min']['local']['noise']],
-                   interval = 60)
-
-    #Signal measurements from the aircraft table
-
-    signals = []
-
-    for a in aircraft_data['aircraft']:
-        if has_key(a,'rssi') and a['messages'] > 4 and a['seen'] < 30 :
-            rssi = a['rssi']
-            source = a.get('type',"")
-            if (
-                rssi > -49.4
-                and not source.startswith('tisb')
-                and not source.startswith('adsr')
-            ):
-                signals.append(rssi)
-
-    signals.sort()
-
-    if len(signals) > 0 :
-        minimum = signals[0]
-        quart1 = perc(0.25, signals)
-        median = perc(0.50, signals)
-        quart3 = perc(0.75, signals)
-        maximum = signals[-1]
-
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='quart1',
-               time=aircraft_data['now'],
-               values = [quart1],
-               interval = 60)
-
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='median',
-               time=aircraft_data['now'],
-               values = [median],
-               interval = 60)
-
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='quart3',
-               time=aircraft_data['now'],
-               values = [quart3],
-               interval = 60)
-
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='peak_signal',
-               time=aircraft_data['now'],
-               values = [maximum],
-               interval = 60)
-
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='min_signal',
-               time=aircraft_data['now'],
-               values = [minimum],
-               interval = 60)
-
+        return
 
-    if has_key(stats['total'],'local'):
-        if has_key(stats['total']['local'],'strong_signals'):
+    now = time.time()
+    for service, (utime, stime, rss, voluntary, involuntary) in samples.items():
+        if service == 'airspy_adsb':
+            # the dump1090 CPU graph shows the airspy decoder from this one
             V.dispatch(plugin_instance = instance_name,
                        host=host,
-                       type='dump1090_messages',
-                       type_instance='strong_signals',
-                       time=stats['total']['end'],
-                       values = [stats['total']['local']['strong_signals']],
-                       interval = 60)
-
-
+                       type='dump1090_cpu',
+                       type_instance='airspy',
+                       time=now,
+                       values = [utime + stime])
+        V.dispatch(plugin_instance = instance_name, host = host,
+                   type = 'dump1090_proc_cpu', type_instance = service,
+                   time = now, values = [utime, stime], interval = 60)
+        V.dispatch(plugin_instance = instance_name, host = host,
+                   type = 'dump1090_proc_rss', type_instance = service,
+                   time = now, values = [rss], interval = 60)
+        V.dispatch(plugin_instance = instance_name, host = host,
+                   type = 'dump1090_proc_ctxsw', type_instance = service,
+                   time = now, values = [voluntary, involuntary], interval = 60)
+
+# High resolution sampling
+#
+# With SAMPLE_INTERVAL set, aircraft.json is additionally polled every few
+# seconds and all ranges and signal levels seen during the minute are fed into
+# quantile sketches.  The once-a-minute read then dispatches the range and
+# signal quartiles from the sketches instead of from its single snapshot.
+
+SKETCH_K = 200
+
+class QuantileSketch(object):
+    """Mergeable KLL-style quantile sketch with bounded memory.
+
+    Level h holds items standing for 2**h inputs each.  When a level fills
+    up, it is sorted and every other item (from a random offset) moves up a
+    level.  Upper levels get capacity k, lower levels shrink geometrically,
+    so memory stays around 3k items however much is added.  Until the first
+    compaction every value is kept and quantiles are exact, using the same
+    interpolation as perc().
+    """
+    def __init__(self, k=SKETCH_K):
+        self.k = k
+        self.levels = [[]]
+        self.n = 0
+        self.min = None
+        self.max = None
+        self.random = random.Random()
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(self.k * (2.0 / 3.0) ** depth))
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.n += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if len(self.levels[0]) >= self.capacity(0):
+            self.compress()
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.n += other.n
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) >= self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                items.sort()
+                # an odd item out stays on this level
+                keep = [items.pop()] if len(items) % 2 else []
+                self.levels[level + 1].extend(items[self.random.randint(0, 1)::2])
+                self.levels[level] = keep
+            level += 1
+
+    def quantile(self, p):
+        if self.n == 0:
+            return None
+        if len(self.levels) == 1:
+            return perc(p, sorted(self.levels[0]))
+        weighted = sorted((value, 1 << level)
+                for level, items in enumerate(self.levels) for value in items)
+        rank = p * (sum(w for v, w in weighted) - 1)
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen > rank:
+                return value
+        return weighted[-1][0]
+
+    def quartiles(self):
+        """(min, q1, median, q3, max) like quartiles(), None when empty."""
+        if self.n == 0:
+            return None
+        return (self.min, self.quantile(0.25), self.quantile(0.50), self.quantile(0.75), self.max)
+
+class HighResSampler(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.ranges = QuantileSketch()
+        self.signals = QuantileSketch()
+
+    def add(self, reduced=None, reduced_signal=None):
+        with self.lock:
+            if reduced is not None:
+                self.ranges.extend(reduced['range_values'])
+            if reduced_signal is not None:
+                self.signals.extend(reduced_signal['signal_values'])
+
+    def collect(self):
+        """Quartiles gathered since the last collect, sketches start over."""
+        with self.lock:
+            ranges, signals = self.ranges.quartiles(), self.signals.quartiles()
+            self.reset()
+        return ranges, signals
+
+def sample_1090(data):
+    instance_name, host, url, url_signal, aircraft_file, highres = data
+
+    sources = {
+        'receiver': url + '/data/receiver.json',
+        'aircraft': url + '/data/' + aircraft_file,
+    }
+    if url_signal:
+        sources['aircraft_signal'] = url_signal + '/data/' + aircraft_file
+    results, errors, timings = fetch_sources(sources, cached=('receiver',),
+            aircraft=('aircraft', 'aircraft_signal'))
+
+    reduced = None
+    if has_key(results, 'aircraft') and has_key(results, 'receiver'):
+        rlat, rlon = receiver_position(results['receiver'])
+        reduced = reduce_aircraft(results['aircraft']['table'], rlat, rlon)
+
+    signal_source = 'aircraft_signal' if url_signal else 'aircraft'
+    if has_key(results, signal_source):
+        reduced_signal = reduce_aircraft(results[signal_source]['table'], None, None)
+    else:
+        reduced_signal = None
+
+    highres.add(reduced, reduced_signal)
+
+# Beast stream collector
+#
+# With BEAST set, a thread keeps a TCP connection to the decoder's Beast
+# output (port 30005) and counts every frame as it arrives: per downlink
+# format, per ICAO address for DF11/17/18, and in a histogram over the 256
+# possible signal bytes.  Received data goes into a fixed buffer; complete
+# frames are parsed out of it and a trailing partial frame is moved to the
+# front to be completed by the next read.  read_1090 collects and resets the
+# counters once per minute.
+
+BEAST_PORT = 30005
+BEAST_BUFFER = 64 * 1024
+BEAST_TIMEOUT = 5.0
+BEAST_BACKOFF_MAX = 60.0
+
+BEAST_ESCAPE = 0x1a
+# payload length per frame type: Mode A/C, Mode S short, Mode S long
+BEAST_PAYLOAD = {0x31: 2, 0x32: 7, 0x33: 14}
+# frames carry a 6 byte MLAT timestamp and a signal byte ahead of the payload
+BEAST_HEADER = 7
+
+# dBFS of each signal byte, sqrt of the signal level scaled to 0..255
+BEAST_DBFS = [None] + [20 * math.log10(v / 255.0) for v in range(1, 256)]
+
+class BeastCollector(object):
+    def __init__(self, name, host, port):
+        self.name = name
+        self.address = (host, port)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.sock = None
+        self.buf = bytearray(BEAST_BUFFER)
+        self.end = 0
+        # message total since start, dump1090_messages is a DERIVE
+        self.messages = 0
+        self.reset()
+
+    def reset(self):
+        self.df_counts = [0] * 25
+        self.icao_counts = {}
+        self.signal_counts = [0] * 256
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=BEAST_TIMEOUT):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        backoff = 1.0
+        while not self.stopping.is_set():
+            try:
+                sock = socket.create_connection(self.address, BEAST_TIMEOUT)
+            except (socket.error, IOError) as error:
+                if backoff == 1.0:
+                    collectd.warning('%s: %s' % (self.name, error))
+            else:
+                backoff = 1.0
+                try:
+                    # short timeout, so stop() is noticed while the stream is quiet
+                    sock.settimeout(1.0)
+                    self.receive(sock)
+                except (socket.error, IOError) as error:
+                    if not self.stopping.is_set():
+                        collectd.warning('%s: %s' % (self.name, error))
+                finally:
+                    sock.close()
+            self.stopping.wait(backoff)
+            backoff = min(2 * backoff, BEAST_BACKOFF_MAX)
+
+    def receive(self, sock):
+        buf = self.buf
+        view = memoryview(buf)
+        self.end = 0
+        while not self.stopping.is_set():
+            try:
+                n = sock.recv_into(view[self.end:])
+            except socket.timeout:
+                continue
+            if n == 0:
+                raise IOError('connection closed by ' + '%s:%d' % self.address)
+            self.end += n
+
+            done = self.parse(self.end)
+            left = self.end - done
+            buf[:left] = buf[done:self.end]
+            # a full buffer without a single frame in it is garbage
+            self.end = left if left < len(buf) else 0
+
+    def parse(self, end):
+        """Count the complete frames in buf[:end], returns where the rest starts."""
+        buf = self.buf
+        pos = 0
+        with self.lock:
+            while True:
+                pos = buf.find(b'\x1a', pos, end)
+                if pos < 0 or pos + 2 > end:
+                    return end if pos < 0 else pos
+                length = BEAST_PAYLOAD.get(buf[pos + 1])
+                if length is None:
+                    # other frame types or garbage, skip escaped 0x1a as a pair so
+                    # its second byte does not start a frame
+                    pos += 2 if buf[pos + 1] == BEAST_ESCAPE else 1
+                    continue
+                start = pos + 2
+                stop = start + BEAST_HEADER + length
+                if stop > end:
+                    return pos
+                frame = buf[start:stop]
+                if BEAST_ESCAPE in frame:
+                    frame, stop = self.unescape(start, end, BEAST_HEADER + length)
+                    if stop < 0:
+                        return pos
+                    if frame is None:
+                        pos = stop
+                        continue
+                self.count(frame)
+                pos = stop
+
+    def unescape(self, start, end, length):
+        """(frame, next position), next position is -1 if the frame is incomplete."""
+        buf = self.buf
+        frame = bytearray()
+        i = start
+        while len(frame) < length:
+            if i >= end:
+                return None, -1
+            b = buf[i]
+            if b == BEAST_ESCAPE:
+                if i + 1 >= end:
+                    return None, -1
+                if buf[i + 1] != BEAST_ESCAPE:
+                    # a lone 0x1a starts the next frame, this one is broken
+                    return None, i
+                i += 1
+            frame.append(b)
+            i += 1
+        return frame, i
+
+    def count(self, frame):
+        self.messages += 1
+        self.signal_counts[frame[6]] += 1
+        if len(frame) == BEAST_HEADER + 2:
+            # Mode A/C, no downlink format
+            return
+        df = frame[7] >> 3
+        if df > 24:
+            # DF24 only uses the top two bits
+            df = 24
+        self.df_counts[df] += 1
+        if df == 11 or df == 17 or df == 18:
+            icao = frame[8] << 16 | frame[9] << 8 | frame[10]
+            self.icao_counts[icao] = self.icao_counts.get(icao, 0) + 1
+
+    def collect(self):
+        """The counts since the last collect as a metrics document."""
+        with self.lock:
+            df_counts, icao_counts, signal_counts = self.df_counts, self.icao_counts, self.signal_counts
+            messages = self.messages
+            self.reset()
+        return {
+            'now': time.time(),
+            'messages': messages,
+            'df_counts': df_counts,
+            'aircraft': len(icao_counts),
+            'icao_counts': icao_counts,
+            'signals': histogram_quartiles(signal_counts, BEAST_DBFS),
+        }
+
+def histogram_quartiles(counts, levels):
+    """quartiles() of a histogram, counts[i] values at levels[i]; None levels are left out."""
+    bins = [(level, n) for level, n in zip(levels, counts) if n and level is not None]
+    total = sum(n for level, n in bins)
+    if total == 0:
+        return None
+
+    def at_rank(rank):
+        for level, n in bins:
+            if rank < n:
+                return level
+            rank -= n
+
+    res = []
+    for p in QUARTILES:
+        x = p * (total - 1)
+        d = x - int(x)
+        x = int(x)
+        value = at_rank(x)
+        if x + 1 < total:
+            value += d * (at_rank(x + 1) - value)
+        res.append(value)
+    return tuple(res)
+
+# Prefetching
+#
+# With PREFETCH set, an instance's fetching and reduction run on a thread of
+# their own that starts PREFETCH seconds ahead of each read tick.  The read
+# callback then only dispatches the latest completed cycle, and nothing at
+# all if that cycle is older than PREFETCH_MAX_AGE seconds or has already
+# been dispatched.  The threads are started in register_init and stopped in
+# register_shutdown; the first read tick collects its own cycle, the thread
+# only starts prefetching ahead of the ticks after it.
+
+PREFETCH_MAX_AGE = 30.0
+
+class Prefetcher(object):
+    def __init__(self, name, collect, data, interval, lead, max_age):
+        self.name = name
+        self.collect = collect
+        self.data = data
+        self.interval = interval
+        self.lead = lead
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+        self.thread = None
+        self.cycle = None
+        self.cycle_time = 0
+        # None until the first read tick, which the later cycles are aligned to
+        self.next_run = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=FETCH_DEADLINE):
+        with self.lock:
+            self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopped:
+                    return
+                delay = None if self.next_run is None else self.next_run - time.time()
+            if delay is None or delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+
+            start = time.time()
+            try:
+                cycle = self.collect(self.data)
+            except Exception as error:
+                collectd.error('%s: %s' % (self.name, error))
+                cycle = None
+            with self.lock:
+                if cycle is not None:
+                    self.cycle = cycle
+                    self.cycle_time = time.time()
+                if self.next_run <= start:
+                    # no read tick since this cycle began
+                    self.next_run = start + self.interval
+
+    def take(self):
+        """The latest cycle, or None if it is stale or was taken before.
+
+        The first call collects the cycle itself, nothing has been prefetched yet.
+        """
+        now = time.time()
+        with self.lock:
+            first = self.next_run is None
+            self.next_run = now + self.interval - self.lead
+            cycle, age = self.cycle, now - self.cycle_time
+            self.cycle = None
+        if first:
+            try:
+                cycle, age = self.collect(self.data), 0
+            except Exception as error:
+                collectd.error('%s: %s' % (self.name, error))
+                return None
+        self.wakeup.set()
+        if cycle is None or age > self.max_age:
+            collectd.warning('%s: no data newer than %d seconds' % (self.name, self.max_age))
+            return None
+        return cycle
+
+def collect_1090(data):
+    instance_name, host, url, url_airspy, url_signal, aircraft_file, index, coverage, heatmap = data
+
+    sources = {
+        'stats': url + '/data/stats.json',
+        'receiver': url + '/data/receiver.json',
+        'aircraft': url + '/data/' + aircraft_file,
+        'airspy': url_airspy + '/stats.json',
+    }
+    if url_signal:
+        sources['stats_signal'] = url_signal + '/data/stats.json'
+        sources['aircraft_signal'] = url_signal + '/data/' + aircraft_file
+
+    results, errors, timings = fetch_sources(sources, cached=('receiver',),
+            aircraft=('aircraft', 'aircraft_signal'))
+
+    rlat, rlon = receiver_position(results.get('receiver'))
+    aircraft_data = results.get('aircraft')
+
+    reduced = reduced_signal = None
+    if aircraft_data is not None:
+        reduced = reduced_signal = reduce_aircraft(aircraft_data['table'], rlat, rlon)
+        if not has_key(results, 'receiver'):
+            # no receiver position this cycle, the distances are meaningless
+            reduced['ranges'] = None
+            reduced['range_values'] = []
+        reduced['msgrate'] = quantiles(index.update(aircraft_data['table'], aircraft_data['now']),
+                                       MSGRATE_PERCENTILES)
+        for positions in (coverage, heatmap):
+            if positions is not None and rlat is not None:
+                positions.add(aircraft_data['table'], rlat, rlon, aircraft_data['now'])
+                try:
+                    positions.export(aircraft_data['now'])
+                    positions.export_error = None
+                except (IOError, OSError) as error:
+                    if str(error) != positions.export_error:
+                        collectd.warning('Could not write %s: %s' % (positions.export_path, error))
+                    positions.export_error = str(error)
+
+    if has_key(results, 'stats_signal') and has_key(results, 'aircraft_signal'):
+        reduced_signal = reduce_aircraft(results['aircraft_signal']['table'], None, None)
+
+    return {
+        'sources': sources,
+        'results': results,
+        'errors': errors,
+        'timings': timings,
+        'reduced': reduced,
+        'reduced_signal': reduced_signal,
+    }
 
 def read_1090(data):
-    instance_name, host, url, url_airspy, url_signal = data
+    (instance_name, host, url, url_airspy, url_signal, aircraft_file, index, coverage, heatmap,
+     metrics, sampler, highres, prefetch, beast) = data
+    collect_data = data[:9]
     data = (instance_name, host, url)
 
     #NaN rrd
@@ -329,418 +1517,1159 @@ def read_1090(data):
                time=time.time(),
                values = [1])
 
-    try:
-        read_airspy((instance_name, host, url, url_airspy))
-    except Exception as error:
-        collectd.warning(str(error))
-        pass
+    read_processes(data, sampler)
 
-    try:
-        with closing(urlopen(url + '/data/stats.json', None, 5.0)) as stats_file:
-            stats = json.load(stats_file)
+    beast_doc = beast.collect() if beast is not None else None
 
-        with closing(urlopen(url + '/data/receiver.json', None, 5.0)) as receiver_file:
-            receiver = json.load(receiver_file)
+    dispatch_source_up(data, url + '/data/aircraft.json', 'source_up')
+    if url_signal:
+        dispatch_source_up(data, url_signal + '/data/aircraft.json', 'source_up_signal')
 
-        if has_key(receiver,'lat'):
-            rlat = float(receiver['lat'])
-            rlon = float(receiver['lon'])
-        else:
-            rlat = rlon = None
+    if prefetch is not None:
+        cycle = prefetch.take()
+        if cycle is None:
+            metrics.dispatch({'beast': beast_doc})
+            return
+    else:
+        cycle = collect_1090(collect_data)
+
+    results, errors = cycle['results'], cycle['errors']
+    dispatch_fetch_times(data, cycle['timings'])
+    dispatch_cache_stats(data, 'receiver', cycle['sources']['receiver'])
+
+    for name in ('stats', 'receiver', 'aircraft'):
+        if has_key(errors, name) and not isinstance(errors[name], CircuitOpen):
+            collectd.warning(str(errors[name]))
+    if any(has_key(errors, name) and not isinstance(errors[name], CircuitOpen)
+           for name in ('stats_signal', 'aircraft_signal')):
+        collectd.warning("Could not get data from " + url_signal)
+
+    stats = results.get('stats')
+    aircraft_data = results.get('aircraft')
+    reduced = cycle['reduced']
+    reduced_signal = cycle['reduced_signal']
+
+    docs = {
+        'airspy': results.get('airspy'),
+        'stats': stats,
+        'signal_stats': stats,
+        'beast': beast_doc,
+    }
+    if beast_doc is not None and docs['airspy'] is not None:
+        del beast_doc['df_counts']
+
+    if has_key(results, 'stats_signal') and has_key(results, 'aircraft_signal'):
+        aircraft_data_signal = results['aircraft_signal']
+        docs['signal_stats'] = results['stats_signal']
+    else:
+        aircraft_data_signal = aircraft_data
+
+    if highres is not None:
+        # this snapshot counts towards the minute as well
+        highres.add(reduced, reduced_signal)
+        ranges, signals = highres.collect()
+        if reduced is not None and ranges is not None:
+            reduced['ranges'] = ranges
+        if reduced_signal is not None and signals is not None:
+            reduced_signal['signals'] = signals
+
+    if reduced is not None:
+        docs['aircraft'] = aircraft_summary(aircraft_data, reduced)
+        if stats is not None and has_key(stats['last1min'],'max_distance'):
+            docs['aircraft']['max_range'] = stats['last1min']['max_distance']
+    if reduced_signal is not None:
+        docs['signal_aircraft'] = aircraft_summary(aircraft_data_signal, reduced_signal)
+
+    metrics.dispatch(docs)
+
+def collect_978(data):
+    instance_name, host, url = data
 
-        with closing(urlopen(url + '/data/aircraft.json', None, 5.0)) as aircraft_file:
-            aircraft_data = json.load(aircraft_file)
+    sources = {
+        'receiver': url + '/data/receiver.json',
+        'aircraft': url + '/data/aircraft.json',
+    }
+    results, errors, timings = fetch_sources(sources, cached=('receiver',), aircraft=('aircraft',))
+
+    reduced = None
+    aircraft_data = results.get('aircraft')
+    if aircraft_data is not None:
+        rlat, rlon = receiver_position(results.get('receiver'))
+        reduced = reduce_aircraft(aircraft_data['table'], rlat, rlon, uat=True)
+        if not has_key(results, 'receiver'):
+            # no receiver position this cycle, the distances are meaningless
+            reduced['ranges'] = None
+
+    return {
+        'sources': sources,
+        'results': results,
+        'errors': errors,
+        'timings': timings,
+        'reduced': reduced,
+    }
 
-        stats_signal = None
-        aircraft_data_signal = None
-        if url_signal:
-            try:
-                with closing(urlopen(url_signal + '/data/stats.json', None, 5.0)) as stats_file:
-                    stats_signal = json.load(stats_file)
-                with closing(urlopen(url_signal + '/data/aircraft.json', None, 5.0)) as aircraft_file:
-                    aircraft_data_signal = json.load(aircraft_file)
-            except:
-                collectd.warning("Could not get data from " + url_signal)
-                pass
+def read_978(data):
+    instance_name, host, url, metrics, prefetch = data
+    data = (instance_name, host, url)
 
-    except Exception as error:
-        collectd.warning(str(error))
-        return
+    dispatch_source_up(data, url + '/data/aircraft.json', 'source_up_978')
 
-    if stats_signal and aircraft_data_signal:
-        handle_signal_stuff(data, stats_signal, aircraft_data_signal)
+    if prefetch is not None:
+        cycle = prefetch.take()
+        if cycle is None:
+            return
     else:
-        handle_signal_stuff(data, stats, aircraft_data)
+        cycle = collect_978(data)
 
-    # Local message counts
-    if has_key(stats['total'],'local'):
-        counts = stats['total']['local']['accepted']
+    dispatch_fetch_times(data, cycle['timings'], '_978')
+    dispatch_cache_stats(data, 'receiver_978', cycle['sources']['receiver'])
 
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_messages',
-                   type_instance='local_accepted',
-                   time=stats['total']['end'],
-                   values = [sum(counts)])
+    for error in cycle['errors'].values():
+        if not isinstance(error, URLError):
+            collectd.warning(str(error))
 
-        for i in range(len(counts)):
-            V.dispatch(plugin_instance = instance_name,
-                       host=host,
-                       type='dump1090_messages',
-                       type_instance='local_accepted_%d' % i,
-                       time=stats['total']['end'],
-                       values = [counts[i]])
-
-    # Remote message counts
-    if has_key(stats['total'],'remote'):
-        counts = stats['total']['remote']['accepted']
-        remote_total = sum(counts)
-        if has_key(stats['total']['remote'],'basestation'):
-            remote_total += stats['total']['remote']['basestation']
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_messages',
-                   type_instance='remote_accepted',
-                   time=stats['total']['end'],
-                   values = [remote_total])
-        for i in range(len(counts)):
-            V.dispatch(plugin_instance = instance_name,
-                       host=host,
-                       type='dump1090_messages',
-                       type_instance='remote_accepted_%d' % i,
-                       time=stats['total']['end'],
-                       values = [counts[i]])
+    reduced = cycle['reduced']
+    if reduced is None:
+        return
 
-    # Position counts
-    posCount = stats['total']['cpr']['global_ok'] + stats['total']['cpr']['local_ok']
-    if posCount == 0 and has_key(stats['total'],'position_count_total'):
-        posCount = stats['total']['position_count_total']
+    metrics.dispatch({'aircraft': aircraft_summary(cycle['results']['aircraft'], reduced)})
+
+# Aircraft table reducer
+#
+# Every aircraft is visited exactly once by aircraft_builder(), which copies
+# the handful of fields graphs1090 uses into the typed columns of an
+# AircraftTable.  Counts, range and signal quartiles for both the 1090 and the
+# 978 path are then computed from that table by reduce_aircraft().
+
+# a['type'] prefixes that are excluded from the 1090 signal statistics
+SOURCE_OTHER = 0
+SOURCE_TISB = 1
+SOURCE_ADSR = 2
+
+# position source flags, taken from the 'mlat' / 'tisb' field lists
+FLAG_MLAT = 1
+FLAG_TISB = 2
+
+NO_RSSI = float('nan')
+NO_POS = float('inf')
+NO_ALT = float('nan')
+
+# set in addr for addresses that are not ICAO addresses, as readsb does
+NON_ICAO = 1 << 24
+
+def source_type(type_string):
+    if type_string.startswith('tisb'):
+        return SOURCE_TISB
+    if type_string.startswith('adsr'):
+        return SOURCE_ADSR
+    return SOURCE_OTHER
+
+# only a handful of distinct a['type'] strings exist, classify each once
+source_types = {}
+
+class AircraftTable(object):
+    """One row per aircraft, stored column-wise in typed arrays.
+
+    seen_pos is NO_POS and lat/lon are 0 for aircraft without a position,
+    rssi is NO_RSSI when unknown.  source is one of the SOURCE_ values, flags
+    a combination of the FLAG_ bits.  addr is the 24 bit address, plus
+    NON_ICAO for '~' addresses.  alt is the barometric altitude in feet, 0 on
+    the ground and NO_ALT when unknown.  Decoders fill it through append() or
+    by extending the columns directly.
+    """
+    __slots__ = ('seen', 'seen_pos', 'lat', 'lon', 'rssi', 'messages', 'source', 'flags', 'addr', 'alt')
+
+    def __init__(self, seen=(), seen_pos=(), lat=(), lon=(), rssi=(), messages=(), source=(), flags=(), addr=(),
+                 alt=()):
+        self.seen = array('d', seen)
+        self.seen_pos = array('d', seen_pos)
+        self.lat = array('d', lat)
+        self.lon = array('d', lon)
+        self.rssi = array('d', rssi)
+        self.messages = array('i', messages)
+        self.source = array('b', source)
+        self.flags = array('b', flags)
+        self.addr = array('i', addr)
+        self.alt = array('d', alt)
+
+    def __len__(self):
+        return len(self.seen)
+
+    def append(self, seen, seen_pos, lat, lon, rssi, messages, source, flags, addr, alt):
+        self.seen.append(seen)
+        self.seen_pos.append(seen_pos)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.rssi.append(rssi)
+        self.messages.append(messages)
+        self.source.append(source)
+        self.flags.append(flags)
+        self.addr.append(addr)
+        self.alt.append(alt)
+
+    def rows(self):
+        return zip(self.seen, self.seen_pos, self.lat, self.lon,
+                   self.rssi, self.messages, self.source, self.flags)
+
+def aircraft_builder():
+    """(add, finish): add(a) copies one aircraft.json aircraft into the columns, finish() makes the table."""
+    # filling lists and converting them once is faster than array.append
+    seen = []
+    seen_pos = []
+    lat = []
+    lon = []
+    rssi = []
+    messages = []
+    source = []
+    flags = []
+    addr = []
+    alt = []
+
+    # bound methods hoisted out of add, it runs for every aircraft
+    add_seen, add_seen_pos, add_lat, add_lon = seen.append, seen_pos.append, lat.append, lon.append
+    add_rssi, add_messages, add_source, add_flags = rssi.append, messages.append, source.append, flags.append
+    add_addr, add_alt = addr.append, alt.append
+
+    def add(a):
+        get = a.get
+        add_seen(a['seen'])
+        h = a['hex']
+        if h[0] == '~':
+            add_addr(int(h[1:], 16) | NON_ICAO)
+        else:
+            add_addr(int(h, 16))
+
+        # alt_baro from readsb / dump1090-fa, altitude from older decoders
+        b = get('alt_baro')
+        if b is None:
+            b = get('altitude', NO_ALT)
+        add_alt(0.0 if b == 'ground' else b)
+        add_messages(get('messages', 0))
+        add_rssi(get('rssi', NO_RSSI))
+
+        t = get('type', "")
+        s = source_types.get(t)
+        if s is None:
+            s = source_types[t] = source_type(t)
+        add_source(s)
+
+        p = get('seen_pos')
+        if p is not None:
+            add_seen_pos(p)
+            add_lat(get('lat', 0.0))
+            add_lon(get('lon', 0.0))
+        else:
+            add_seen_pos(NO_POS)
+            add_lat(0.0)
+            add_lon(0.0)
+
+        f = 0
+        if 'lat' in get('mlat', ()):
+            f = FLAG_MLAT
+        if 'lat' in get('tisb', ()):
+            f |= FLAG_TISB
+        add_flags(f)
+
+    def finish():
+        return AircraftTable(seen, seen_pos, lat, lon, rssi, messages, source, flags, addr, alt)
+
+    return add, finish
+
+def aircraft_table(aircraft):
+    add, finish = aircraft_builder()
+    for a in aircraft:
+        add(a)
+    return finish()
+
+# binCraft decoder
+#
+# readsb can write the aircraft list as aircraft.binCraft, optionally zstd
+# compressed, next to aircraft.json.  It is one fixed size record per
+# aircraft, preceded by a header of the same size.  The fields graphs1090
+# uses are read at fixed offsets straight into an AircraftTable, with numpy
+# for the whole file at once or with struct record by record.  The layout is
+# the one tar1090 decodes for BINCRAFT_VERSION and later; any other version,
+# a missing file or a missing zstd module makes load_aircraft fall back to
+# aircraft.json.
+
+AIRCRAFT_FILES = {
+    'json': 'aircraft.json',
+    'binCraft': 'aircraft.binCraft',
+    'zstd': 'aircraft.binCraft.zst',
+}
+
+BINCRAFT_VERSION = 20240218
+
+# now (ms, low and high word), record size, ..., messages, receiver lat / lon, version
+BINCRAFT_HEADER = struct.Struct('<IIIIIIIIiiI')
+
+# (name, offset, struct code, numpy type)
+BINCRAFT_FIELDS = (
+    ('addr', 0, 'I', '<u4'),        # address, NON_ICAO bit, more flags above
+    ('seen_pos', 4, 'i', '<i4'),    # 1/10 s
+    ('seen', 8, 'i', '<i4'),        # 1/10 s
+    ('lon', 12, 'i', '<i4'),        # 1e-6 degrees, 0 without position
+    ('lat', 16, 'i', '<i4'),
+    ('alt', 24, 'h', '<i2'),        # barometric, 25 ft
+    ('messages', 66, 'H', '<u2'),   # wraps at 65536
+    ('addrtype', 71, 'B', 'u1'),    # address type in the high nibble
+    ('rssi', 105, 'B', 'u1'),       # sqrt of the linear signal level, 0..255
+)
+BINCRAFT_MIN_SIZE = 106
+
+def bincraft_struct(size):
+    fmt = '<'
+    end = 0
+    for name, offset, code, dtype in BINCRAFT_FIELDS:
+        fmt += '%dx%s' % (offset - end, code)
+        end = offset + struct.calcsize('<' + code)
+    return struct.Struct(fmt + '%dx' % (size - end))
+
+# readsb's address types, in the order of its addrtype enum
+BINCRAFT_TYPES = ('adsb_icao', 'adsb_icao_nt', 'adsr_icao', 'tisb_icao', 'adsc', 'mlat', 'other', 'mode_s',
+                  'adsb_other', 'adsr_other', 'tisb_trackfile', 'tisb_other', 'mode_ac', 'unknown')
+BINCRAFT_SOURCE = array('b', [source_type(t) for t in BINCRAFT_TYPES] + [SOURCE_OTHER] * (16 - len(BINCRAFT_TYPES)))
+BINCRAFT_FLAGS = array('b', [FLAG_MLAT if t == 'mlat' else FLAG_TISB if t.startswith('tisb') else 0
+                             for t in BINCRAFT_TYPES] + [0] * (16 - len(BINCRAFT_TYPES)))
+# dBFS for each rssi byte, 0 comes out below the signal filter's cut-off
+BINCRAFT_RSSI = array('d', [10 * math.log10(v * v / 65025.0 + 1.125e-5) for v in range(256)])
+
+bincraft_structs = {}
+
+def decode_bincraft(body):
+    if len(body) < BINCRAFT_HEADER.size:
+        raise ValueError('short binCraft header')
+    now_lo, now_hi, size, _, _, _, _, messages, _, _, version = BINCRAFT_HEADER.unpack_from(body)
+    if version < BINCRAFT_VERSION or size < BINCRAFT_MIN_SIZE:
+        raise ValueError('unsupported binCraft version %d' % version)
+    count = len(body) // size - 1
+    if count < 0:
+        raise ValueError('short binCraft file')
+    if numpy is not None:
+        table = decode_bincraft_numpy(body, size, count)
+    else:
+        table = decode_bincraft_records(body, size, count)
+    return {'now': now_lo / 1000.0 + now_hi * 4294967.296, 'messages': messages, 'table': table}
+
+def decode_bincraft_records(body, size, count):
+    record = bincraft_structs.get(size)
+    if record is None:
+        record = bincraft_structs[size] = bincraft_struct(size)
+    unpack = record.unpack_from
+
+    seen = []
+    seen_pos = []
+    lats = []
+    lons = []
+    rssi = []
+    messages = []
+    source = []
+    flags = []
+    addrs = []
+    alts = []
+    for offset in range(size, size * (count + 1), size):
+        addr, pos, s, lon, lat, alt, m, addrtype, r = unpack(body, offset)
+        addrs.append(addr & (NON_ICAO | 0xffffff))
+        alts.append(alt * 25.0)
+        seen.append(s / 10.0)
+        if lat or lon:
+            seen_pos.append(pos / 10.0)
+            lats.append(lat / 1e6)
+            lons.append(lon / 1e6)
+        else:
+            seen_pos.append(NO_POS)
+            lats.append(0.0)
+            lons.append(0.0)
+        rssi.append(BINCRAFT_RSSI[r])
+        messages.append(m)
+        source.append(BINCRAFT_SOURCE[addrtype >> 4])
+        flags.append(BINCRAFT_FLAGS[addrtype >> 4])
+    return AircraftTable(seen, seen_pos, lats, lons, rssi, messages, source, flags, addrs, alts)
+
+def decode_bincraft_numpy(body, size, count):
+    names, offsets, formats = [], [], []
+    for name, offset, code, dtype in BINCRAFT_FIELDS:
+        names.append(name)
+        offsets.append(offset)
+        formats.append(dtype)
+    records = numpy.frombuffer(body, numpy.dtype({'names': names, 'offsets': offsets,
+            'formats': formats, 'itemsize': size}), count, size)
+
+    lat = records['lat'] / 1e6
+    lon = records['lon'] / 1e6
+    seen_pos = numpy.where((records['lat'] != 0) | (records['lon'] != 0), records['seen_pos'] / 10.0, NO_POS)
+    addrtype = records['addrtype'] >> 4
+
+    # array() takes the raw bytes as they are
+    return AircraftTable((records['seen'] / 10.0).tobytes(), seen_pos.tobytes(), lat.tobytes(), lon.tobytes(),
+            numpy.frombuffer(BINCRAFT_RSSI, dtype=numpy.float64)[records['rssi']].tobytes(),
+            records['messages'].astype(numpy.intc).tobytes(),
+            numpy.frombuffer(BINCRAFT_SOURCE, dtype=numpy.int8)[addrtype].tobytes(),
+            numpy.frombuffer(BINCRAFT_FLAGS, dtype=numpy.int8)[addrtype].tobytes(),
+            (records['addr'] & (NON_ICAO | 0xffffff)).astype(numpy.intc).tobytes(),
+            (records['alt'] * 25.0).tobytes())
+
+def decode_bincraft_zstd(body):
+    return decode_bincraft(zstd_decompress(body))
+
+def load_bincraft(url, timeout):
+    if url.endswith('.zst'):
+        if zstd_decompress is None:
+            raise ValueError('no zstd module for ' + url)
+        decode = decode_bincraft_zstd
+    else:
+        decode = decode_bincraft
+    if url.startswith('http://') or url.startswith('https://'):
+        return http_get(url, timeout, decode)
+    with closing(urlopen(url, None, timeout)) as f:
+        return decode(f.read())
 
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_messages',
-               type_instance='positions',
-               time=stats['total']['end'],
-               values = [posCount])
+# from about this many aircraft on numpy's whole-column operations beat the
+# plain loop, below it their fixed cost per call dominates (tests/bench_reduce.py)
+REDUCE_NUMPY_MIN = 64
 
-    # Tracks
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tracks',
-               type_instance='all',
-               time=stats['total']['end'],
-               values = [stats['total']['tracks']['all']])
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tracks',
-               type_instance='single_message',
-               time=stats['total']['end'],
-               values = [stats['total']['tracks']['single_message']])
+def reduce_aircraft(table, rlat, rlon, uat=False):
+    """Counts plus (min, q1, median, q3, max) tuples for ranges and signals.
 
-    # CPU
-    for k in stats['total']['cpu'].keys():
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_cpu',
-                   type_instance=k,
-                   time=stats['total']['end'],
-                   values = [stats['total']['cpu'][k]])
+    The values behind the tuples are returned as range_values and
+    signal_values.
 
+    uat selects the dump978 rules: mlat positions are not split out, ranges
+    beyond 350 nmi are dropped and the signal filter is looser.
+    """
+    if numpy is not None and len(table) >= REDUCE_NUMPY_MIN:
+        return reduce_aircraft_numpy(table, rlat, rlon, uat)
 
     total = 0
     with_pos = 0
-    max_range = 0
     mlat = 0
     tisb = 0
     gps = 0
-
     ranges = []
+    signals = []
 
-    for a in aircraft_data['aircraft']:
-        if a['seen'] < 60: total += 1
-        if has_key(a,'seen_pos') and a['seen_pos'] < 60:
-            with_pos += 1
-            if rlat is not None:
-                distance = greatcircle(rlat, rlon, a['lat'], a['lon'])
-            else:
-                distance = 0
+    if uat:
+        min_messages, max_seen = 2, 60
+    else:
+        min_messages, max_seen = 4, 30
 
-            if 'lat' in a.get('mlat', ()):
+    for seen, seen_pos, lat, lon, rssi, messages, source, flags in table.rows():
+        if seen < 60: total += 1
+        if seen_pos < 60:
+            with_pos += 1
+            if not uat and flags & FLAG_MLAT:
                 mlat += 1
-            elif 'lat' in a.get('tisb', ()):
+            elif flags & FLAG_TISB:
                 tisb += 1
             # GPS position, include in range statistics
             else:
                 gps += 1
-                ranges.append(distance)
-
-    ranges.sort()
-
-    if len(ranges) > 0:
-        minimum = ranges[0]
-        quart1 = perc(0.25, ranges)
-        median = perc(0.50, ranges)
-        quart3 = perc(0.75, ranges)
-        max_range = ranges[-1]
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='quart1',
-                   time=aircraft_data['now'],
-                   values = [quart1])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='median',
-                   time=aircraft_data['now'],
-                   values = [median])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='quart3',
-                   time=aircraft_data['now'],
-                   values = [quart3])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='minimum',
-                   time=aircraft_data['now'],
-                   values = [minimum])
-
-    if has_key(stats['last1min'],'max_distance'):
-        max_range = stats['last1min']['max_distance'];
-    # max range is always dispatched, even if zero
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_range',
-               type_instance='max_range',
-               time=aircraft_data['now'],
-               values = [max_range])
-
-    # Aircraft numbers
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_aircraft',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [total, with_pos])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_mlat',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [mlat])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tisb',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [tisb])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_gps',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [gps])
-
-def read_978(data):
-    instance_name,host,url = data
-    try:
-        with closing(urlopen(url + '/data/receiver.json', None, 5.0)) as receiver_file:
-            receiver = json.load(receiver_file)
-
-        if has_key(receiver,'lat'):
-            rlat = float(receiver['lat'])
-            rlon = float(receiver['lon'])
-        else:
-            rlat = rlon = None
-
-        with closing(urlopen(url + '/data/aircraft.json', None, 5.0)) as aircraft_file:
-            aircraft_data = json.load(aircraft_file)
-
-    except URLError as error:
-        #collectd.warning(str(error))
-        return
-    except Exception as error:
-        collectd.warning(str(error))
-        return
-
-    total = 0
-    with_pos = 0
-    max_range = 0
-    tisb = 0
-    gps = 0
-
-    ranges = []
-
-    for a in aircraft_data['aircraft']:
-        if a['seen'] < 60: total += 1
-        if has_key(a,'seen_pos') and a['seen_pos'] < 60:
-            with_pos += 1
-            if rlat is not None:
-                distance = greatcircle(rlat, rlon, a['lat'], a['lon'])
-            else:
-                distance = 0
+                if rlat is not None:
+                    ranges.append(greatcircle(rlat, rlon, lat, lon))
+                else:
+                    ranges.append(0)
+
+        # rssi is NaN when missing, which fails the comparison
+        if messages > min_messages and seen < max_seen and rssi > -49.4:
+            if uat:
+                if not flags & FLAG_TISB:
+                    # clamp rssi to 0
+                    signals.append(min(rssi, 0.0))
+            elif source == SOURCE_OTHER:
+                signals.append(rssi)
 
-            if 'lat' in a.get('tisb', ()):
-                tisb += 1
-            # GPS position, include in range statistics
+    if uat:
+        # limit 978 data collection to 350 nmi (1 nmi = 1852 m)
+        ranges = [r for r in ranges if r < 350 * 1852]
+
+    return {
+        'total': total,
+        'with_pos': with_pos,
+        'mlat': mlat,
+        'tisb': tisb,
+        'gps': gps,
+        'ranges': quartiles(ranges),
+        'signals': quartiles(signals),
+        'range_values': ranges,
+        'signal_values': signals,
+    }
+
+def reduce_aircraft_numpy(table, rlat, rlon, uat):
+    # views on the table's arrays, nothing is copied
+    seen = numpy.frombuffer(table.seen, dtype=numpy.float64)
+    seen_pos = numpy.frombuffer(table.seen_pos, dtype=numpy.float64)
+    rssi = numpy.frombuffer(table.rssi, dtype=numpy.float64)
+    messages = numpy.frombuffer(table.messages, dtype=numpy.intc)
+    source = numpy.frombuffer(table.source, dtype=numpy.int8)
+    flags = numpy.frombuffer(table.flags, dtype=numpy.int8)
+
+    with_pos = seen_pos < 60
+    if uat:
+        is_mlat = numpy.zeros(len(flags), dtype=bool)
+    else:
+        is_mlat = with_pos & ((flags & FLAG_MLAT) != 0)
+    is_tisb = with_pos & ~is_mlat & ((flags & FLAG_TISB) != 0)
+    is_gps = with_pos & ~is_mlat & ~is_tisb
+
+    if rlat is not None:
+        ranges = haversine_numpy(rlat, rlon,
+                numpy.frombuffer(table.lat, dtype=numpy.float64)[is_gps],
+                numpy.frombuffer(table.lon, dtype=numpy.float64)[is_gps])
+    else:
+        ranges = numpy.zeros(int(is_gps.sum()))
+
+    if uat:
+        # limit 978 data collection to 350 nmi (1 nmi = 1852 m)
+        ranges = ranges[ranges < 350 * 1852]
+        # NaN rssi fails the comparison
+        good = (messages > 2) & (seen < 60) & (rssi > -49.4) & ((flags & FLAG_TISB) == 0)
+        # clamp rssi to 0
+        signals = numpy.minimum(rssi[good], 0)
+    else:
+        good = (messages > 4) & (seen < 30) & (rssi > -49.4) & (source == SOURCE_OTHER)
+        signals = rssi[good]
+
+    return {
+        'total': int((seen < 60).sum()),
+        'with_pos': int(with_pos.sum()),
+        'mlat': int(is_mlat.sum()),
+        'tisb': int(is_tisb.sum()),
+        'gps': int(is_gps.sum()),
+        'ranges': quartiles(ranges),
+        'signals': quartiles(signals),
+        'range_values': ranges.tolist(),
+        'signal_values': signals.tolist(),
+    }
+
+# Per-aircraft index
+#
+# The messages count of every aircraft is remembered from one poll to the
+# next, so each aircraft's message rate between polls can be worked out.  The
+# index is a dict from address to a slot in fixed size arrays.  An aircraft
+# keeps its slot until it has not been heard for INDEX_MAX_AGE seconds; when
+# all slots are taken, the quarter heard from least recently is freed.
+
+INDEX_SIZE = 4096
+INDEX_MAX_AGE = 600.0
+
+MSGRATE_PERCENTILES = (0.5, 0.9)
+
+class AircraftIndex(object):
+    def __init__(self, size=INDEX_SIZE):
+        self.slots = {}
+        self.free = list(range(size - 1, -1, -1))
+        self.messages = array('d', [0]) * size
+        # time of the last message, now - seen
+        self.time = array('d', [0]) * size
+
+    def __len__(self):
+        return len(self.slots)
+
+    def update(self, table, now):
+        """Store the table's counts, returns the rates of aircraft heard since the last update."""
+        slots = self.slots
+        last_messages = self.messages
+        last_time = self.time
+        rates = []
+        for addr, seen, messages in zip(table.addr, table.seen, table.messages):
+            t = now - seen
+            slot = slots.get(addr)
+            if slot is None:
+                if not self.free:
+                    self.evict_oldest()
+                slot = slots[addr] = self.free.pop()
             else:
-                gps += 1
-                # limit 978 data collection to 350 nmi (1 nmi = 1852 m)
-                if distance < 350 * 1852:
-                    ranges.append(distance)
-
-    # Aircraft numbers
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_aircraft',
-               type_instance='recent_978',
-               time=aircraft_data['now'],
-               values = [total, with_pos])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tisb',
-               type_instance='recent_978',
-               time=aircraft_data['now'],
-               values = [tisb])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_gps',
-               type_instance='recent_978',
-               time=aircraft_data['now'],
-               values = [gps])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_messages',
-               type_instance='messages_978',
-               time=aircraft_data['now'],
-               values = [aircraft_data['messages']])
-
-    # Range statistics
-    ranges.sort()
-
-    if len(ranges) > 0:
-        minimum = ranges[0]
-        quart1 = perc(0.25, ranges)
-        median = perc(0.50, ranges)
-        quart3 = perc(0.75, ranges)
-        max_range = ranges[-1]
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='quart1_978',
-                   time=aircraft_data['now'],
-                   values = [quart1])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='median_978',
-                   time=aircraft_data['now'],
-                   values = [median])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='quart3_978',
-                   time=aircraft_data['now'],
-                   values = [quart3])
-
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='minimum_978',
-                   time=aircraft_data['now'],
-                   values = [minimum])
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_range',
-               type_instance='max_range_978',
-               time=aircraft_data['now'],
-               values = [max_range])
-
-    # Signal Statistics
-
-    signals = []
-
-    for a in aircraft_data['aircraft']:
-        if has_key(a,'rssi') and a['messages'] > 2 and a['seen'] < 60 :
-            rssi = a['rssi']
-            if rssi > -49.4 and not 'lat' in a.get('tisb', ()):
-                # clamp rssi to 0
-                if rssi > 0:
-                    rssi = 0
-                signals.append(rssi)
+                dt = t - last_time[slot]
+                if dt <= 0:
+                    continue
+                dm = messages - last_messages[slot]
+                # a count going backwards is a decoder restart or a wrapped counter
+                if dm >= 0:
+                    rates.append(dm / dt)
+            last_messages[slot] = messages
+            last_time[slot] = t
+        self.evict(now - INDEX_MAX_AGE)
+        return rates
+
+    def evict(self, before):
+        last_time = self.time
+        for addr, slot in list(self.slots.items()):
+            if last_time[slot] < before:
+                del self.slots[addr]
+                self.free.append(slot)
+
+    def evict_oldest(self):
+        by_age = sorted(self.slots.items(), key=lambda item: self.time[item[1]])
+        for addr, slot in by_age[:max(1, len(by_age) // 4)]:
+            del self.slots[addr]
+            self.free.append(slot)
+
+# Polar coverage
+#
+# With COVERAGE set, the range of every fresh ADS-B position is binned by
+# bearing from the receiver (COVERAGE_SECTORS sectors) and altitude band.
+# Each bin keeps its maximum range and a histogram of ranges in
+# COVERAGE_BUCKET steps.  Bins live in one slot per hour, COVERAGE_SLOTS of
+# them, in a memory-mapped file, so nothing is lost when collectd restarts;
+# placed next to the rrd files it is written back to disk along with them.
+# The rolling window is made of all slots, the daily one of today's.  Both
+# are exported as JSON for the polar graph, as rrdtool cannot draw one.
+
+COVERAGE_SECTORS = 72
+# upper limits of the altitude bands in feet, the last band is open
+COVERAGE_BANDS = (10000, 20000, 30000)
+COVERAGE_BUCKET = 10000
+COVERAGE_BUCKETS = 50
+COVERAGE_SLOTS = 24
+COVERAGE_PERCENTILE = 0.9
+
+# magic, sectors, bands, buckets, bucket size, slots
+COVERAGE_HEADER = struct.Struct('<4sIIIII')
+COVERAGE_MAGIC = b'GCOV'
+
+class Coverage(object):
+    def __init__(self, path, export_path):
+        self.path = path
+        self.export_path = export_path
+        self.export_error = None
+        self.bins = COVERAGE_SECTORS * (len(COVERAGE_BANDS) + 1)
+        header = COVERAGE_HEADER.pack(COVERAGE_MAGIC, COVERAGE_SECTORS, len(COVERAGE_BANDS) + 1,
+                                      COVERAGE_BUCKETS, COVERAGE_BUCKET, COVERAGE_SLOTS)
+        stamps_size = 8 * COVERAGE_SLOTS
+        maxima_size = 8 * COVERAGE_SLOTS * self.bins
+        counts_size = 4 * COVERAGE_SLOTS * self.bins * COVERAGE_BUCKETS
+        size = COVERAGE_HEADER.size + stamps_size + maxima_size + counts_size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size or os.read(fd, len(header)) != header:
+                # new file or another layout, start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, header)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        view = memoryview(self.mm)
+        offset = COVERAGE_HEADER.size
+        self.stamps = view[offset:offset + stamps_size].cast('q')
+        offset += stamps_size
+        self.maxima = view[offset:offset + maxima_size].cast('d')
+        offset += maxima_size
+        self.counts = view[offset:offset + counts_size].cast('I')
+
+    def start(self):
+        pass
 
-    signals.sort()
+    def stop(self):
+        self.mm.flush()
+
+    def slot(self, now):
+        hour = int(now // 3600)
+        slot = hour % COVERAGE_SLOTS
+        if self.stamps[slot] != hour:
+            n = self.bins
+            self.maxima[slot * n:(slot + 1) * n] = array('d', [0]) * n
+            n *= COVERAGE_BUCKETS
+            self.counts[slot * n:(slot + 1) * n] = array('I', [0]) * n
+            self.stamps[slot] = hour
+        return slot
+
+    def add(self, table, rlat, rlon, now):
+        """Bin the table's fresh ADS-B positions with a known altitude."""
+        lats = []
+        lons = []
+        alts = []
+        for seen_pos, lat, lon, flags, alt in zip(table.seen_pos, table.lat, table.lon, table.flags, table.alt):
+            # NaN altitudes fail the comparison
+            if seen_pos < 60 and not flags and alt >= -2000:
+                lats.append(lat)
+                lons.append(lon)
+                alts.append(alt)
+        if not lats:
+            return
 
-    if len(signals) > 0 :
-        minimum = signals[0]
-        quart1 = perc(0.25, signals)
-        median = perc(0.50, signals)
-        quart3 = perc(0.75, signals)
-        maximum = signals[-1]
+        base = self.slot(now) * self.bins
+        maxima = self.maxima
+        counts = self.counts
+        sector_size = 360.0 / COVERAGE_SECTORS
+        for r, b, alt in zip(greatcircle_batch(rlat, rlon, lats, lons), bearing_batch(rlat, rlon, lats, lons), alts):
+            band = 0
+            while band < len(COVERAGE_BANDS) and alt >= COVERAGE_BANDS[band]:
+                band += 1
+            i = base + band * COVERAGE_SECTORS + int(b / sector_size) % COVERAGE_SECTORS
+            if r > maxima[i]:
+                maxima[i] = r
+            counts[i * COVERAGE_BUCKETS + min(int(r / COVERAGE_BUCKET), COVERAGE_BUCKETS - 1)] += 1
+
+    def window(self, slots):
+        """Per band (and all bands last), max range and COVERAGE_PERCENTILE range for each sector."""
+        n = self.bins
+        maxima = [0.0] * n
+        counts = [0] * (n * COVERAGE_BUCKETS)
+        for slot in slots:
+            maxima = [max(a, b) for a, b in zip(maxima, self.maxima[slot * n:(slot + 1) * n])]
+            m = n * COVERAGE_BUCKETS
+            counts = [a + b for a, b in zip(counts, self.counts[slot * m:(slot + 1) * m])]
+
+        bands = len(COVERAGE_BANDS) + 1
+        result = {'max': [], 'percentile': []}
+        all_max = [0.0] * COVERAGE_SECTORS
+        all_counts = [[0] * COVERAGE_BUCKETS for sector in range(COVERAGE_SECTORS)]
+        for band in range(bands):
+            band_max = maxima[band * COVERAGE_SECTORS:(band + 1) * COVERAGE_SECTORS]
+            band_percentile = []
+            for sector in range(COVERAGE_SECTORS):
+                i = (band * COVERAGE_SECTORS + sector) * COVERAGE_BUCKETS
+                hist = counts[i:i + COVERAGE_BUCKETS]
+                band_percentile.append(histogram_percentile(hist, band_max[sector]))
+                all_max[sector] = max(all_max[sector], band_max[sector])
+                all_counts[sector] = [a + b for a, b in zip(all_counts[sector], hist)]
+            result['max'].append([round(r) for r in band_max])
+            result['percentile'].append(band_percentile)
+        result['max'].append([round(r) for r in all_max])
+        result['percentile'].append([histogram_percentile(hist, r) for hist, r in zip(all_counts, all_max)])
+        return result
+
+    def export(self, now):
+        hour = int(now // 3600)
+        today = time.localtime(now)
+        midnight = time.mktime(today[:3] + (0, 0, 0) + today[6:8] + (-1,))
+        rolling = [slot for slot in range(COVERAGE_SLOTS) if hour - COVERAGE_SLOTS < self.stamps[slot] <= hour]
+        daily = [slot for slot in rolling if self.stamps[slot] * 3600 + 3600 > midnight]
+        doc = {
+            'now': now,
+            'sectors': COVERAGE_SECTORS,
+            'bands': list(COVERAGE_BANDS),
+            'percentile': COVERAGE_PERCENTILE,
+            'rolling': self.window(rolling),
+            'daily': self.window(daily),
+        }
+        write_atomic(self.export_path, json.dumps(doc, separators=(',', ':')))
+
+def write_atomic(path, data):
+    """Replace path with data, readers never see a partial file."""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data.encode('utf-8') if not isinstance(data, bytes) else data)
+    os.rename(tmp, path)
+
+def histogram_percentile(hist, maximum):
+    """COVERAGE_PERCENTILE range from a COVERAGE_BUCKET histogram, bucket middles, at most maximum."""
+    total = sum(hist)
+    if total == 0:
+        return 0
+    wanted = COVERAGE_PERCENTILE * total
+    seen = 0
+    for bucket, n in enumerate(hist):
+        seen += n
+        if seen >= wanted:
+            break
+    return round(min((bucket + 0.5) * COVERAGE_BUCKET, maximum))
+
+# Position heatmap
+#
+# With HEATMAP set, every fresh position is counted in a square grid of
+# HEATMAP_CELL cells centred on the receiver.  Positions are projected with
+# the Lambert azimuthal equal-area projection, so all cells cover the same
+# area.  The last HEATMAP_DAYS days (local time) are kept at full
+# resolution, one grid per day; when a day drops out it is compacted into
+# HEATMAP_TILE times coarser tiles and kept for HEATMAP_ARCHIVE days.  Like
+# the coverage bins the grids live in a memory-mapped file.  Every
+# HEATMAP_RENDER seconds the full resolution days and, after a compaction,
+# the archive are rendered as PNG, with a JSON summary next to them.
+
+HEATMAP_CELL = 1000
+HEATMAP_SIZE = 600
+HEATMAP_DAYS = 3
+HEATMAP_TILE = 5
+HEATMAP_ARCHIVE = 90
+HEATMAP_RENDER = 300
+# a receiver moving further than this starts a new map
+HEATMAP_MOVE = 1000
+
+# magic, size, cell size, days, tile, archive days; then the centre
+HEATMAP_HEADER = struct.Struct('<4sIIIII')
+HEATMAP_CENTRE = struct.Struct('<dd')
+HEATMAP_MAGIC = b'GHEA'
+
+class Heatmap(object):
+    def __init__(self, path, export_path):
+        self.path = path
+        self.export_path = export_path
+        self.export_error = None
+        self.rendered = 0
+        self.archive_rendered = False
+        self.cells = HEATMAP_SIZE * HEATMAP_SIZE
+        self.tiles = (HEATMAP_SIZE // HEATMAP_TILE) ** 2
+        header = HEATMAP_HEADER.pack(HEATMAP_MAGIC, HEATMAP_SIZE, HEATMAP_CELL,
+                                     HEATMAP_DAYS, HEATMAP_TILE, HEATMAP_ARCHIVE)
+        sizes = (8 * HEATMAP_DAYS, 4 * HEATMAP_DAYS * self.cells,
+                 8 * HEATMAP_ARCHIVE, 4 * HEATMAP_ARCHIVE * self.tiles)
+        start = HEATMAP_HEADER.size + HEATMAP_CENTRE.size
+        size = start + sum(sizes)
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size or os.read(fd, len(header)) != header:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, header + HEATMAP_CENTRE.pack(float('nan'), float('nan')))
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        view = memoryview(self.mm)
+        offsets = [start]
+        for n in sizes:
+            offsets.append(offsets[-1] + n)
+        self.stamps = view[offsets[0]:offsets[1]].cast('q')
+        self.counts = view[offsets[1]:offsets[2]].cast('I')
+        self.archive_stamps = view[offsets[2]:offsets[3]].cast('q')
+        self.archive = view[offsets[3]:offsets[4]].cast('I')
+        if numpy is not None:
+            self.counts_np = numpy.frombuffer(self.mm, numpy.uint32, HEATMAP_DAYS * self.cells, offsets[1])
+            self.archive_np = numpy.frombuffer(self.mm, numpy.uint32, HEATMAP_ARCHIVE * self.tiles, offsets[3])
+
+    def start(self):
+        pass
 
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='quart1_978',
-               time=aircraft_data['now'],
-               values = [quart1],
-               interval = 60)
+    def stop(self):
+        self.mm.flush()
 
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='median_978',
-               time=aircraft_data['now'],
-               values = [median],
-               interval = 60)
+    def centre(self, rlat, rlon):
+        """Make (rlat, rlon) the centre of the map, dropping all counts if it moved."""
+        lat, lon = HEATMAP_CENTRE.unpack_from(self.mm, HEATMAP_HEADER.size)
+        if lat == lat and greatcircle_batch(lat, lon, [rlat], [rlon])[0] < HEATMAP_MOVE:
+            return
+        if lat == lat:
+            collectd.info('Receiver moved, starting a new heatmap in %s' % self.path)
+        for stamps in (self.stamps, self.archive_stamps):
+            stamps[:] = array('q', [0]) * len(stamps)
+        self.counts[:] = array('I', [0]) * len(self.counts)
+        self.archive[:] = array('I', [0]) * len(self.archive)
+        HEATMAP_CENTRE.pack_into(self.mm, HEATMAP_HEADER.size, rlat, rlon)
+
+    def slot(self, now):
+        day = local_day(now)
+        slot = day % HEATMAP_DAYS
+        stamp = self.stamps[slot]
+        if stamp != day:
+            if stamp and day - stamp < HEATMAP_DAYS + HEATMAP_ARCHIVE:
+                self.compact(slot, stamp)
+            n = self.cells
+            self.counts[slot * n:(slot + 1) * n] = array('I', [0]) * n
+            self.stamps[slot] = day
+        return slot
+
+    def compact(self, slot, day):
+        """Sum the day in slot into its archive tiles."""
+        n = self.cells
+        side = HEATMAP_SIZE // HEATMAP_TILE
+        a = day % HEATMAP_ARCHIVE
+        if numpy is not None:
+            grid = self.counts_np[slot * n:(slot + 1) * n].reshape(side, HEATMAP_TILE, side, HEATMAP_TILE)
+            self.archive_np[a * self.tiles:(a + 1) * self.tiles] = grid.sum(axis=(1, 3), dtype=numpy.uint32).ravel()
+        else:
+            tiles = [0] * self.tiles
+            counts = self.counts
+            for cell in range(slot * n, (slot + 1) * n):
+                c = counts[cell]
+                if c:
+                    row, col = divmod(cell - slot * n, HEATMAP_SIZE)
+                    tiles[row // HEATMAP_TILE * side + col // HEATMAP_TILE] += c
+            self.archive[a * self.tiles:(a + 1) * self.tiles] = array('I', tiles)
+        self.archive_stamps[a] = day
+        self.archive_rendered = False
+
+    def add(self, table, rlat, rlon, now):
+        """Count the table's fresh positions, TIS-B excluded."""
+        self.centre(rlat, rlon)
+        base = self.slot(now) * self.cells
+        half = HEATMAP_SIZE // 2
+        if numpy is not None:
+            seen_pos = numpy.frombuffer(table.seen_pos, numpy.float64)
+            flags = numpy.frombuffer(table.flags, numpy.int8)
+            fresh = (seen_pos < 60) & ((flags & FLAG_TISB) == 0)
+            x, y = equal_area_numpy(rlat, rlon, numpy.frombuffer(table.lat, numpy.float64)[fresh],
+                                    numpy.frombuffer(table.lon, numpy.float64)[fresh])
+            col = numpy.floor(x / HEATMAP_CELL).astype(numpy.int64) + half
+            row = half - 1 - numpy.floor(y / HEATMAP_CELL).astype(numpy.int64)
+            inside = (col >= 0) & (col < HEATMAP_SIZE) & (row >= 0) & (row < HEATMAP_SIZE)
+            # add.at counts repeated cells once per position
+            numpy.add.at(self.counts_np, base + row[inside] * HEATMAP_SIZE + col[inside], 1)
+            return
 
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='quart3_978',
-               time=aircraft_data['now'],
-               values = [quart3],
-               interval = 60)
+        lats = []
+        lons = []
+        for seen_pos, lat, lon, flags in zip(table.seen_pos, table.lat, table.lon, table.flags):
+            if seen_pos < 60 and not flags & FLAG_TISB:
+                lats.append(lat)
+                lons.append(lon)
+        counts = self.counts
+        for x, y in zip(*equal_area_batch(rlat, rlon, lats, lons)):
+            col = int(math.floor(x / HEATMAP_CELL)) + half
+            row = half - 1 - int(math.floor(y / HEATMAP_CELL))
+            if 0 <= col < HEATMAP_SIZE and 0 <= row < HEATMAP_SIZE:
+                counts[base + row * HEATMAP_SIZE + col] += 1
+
+    def export(self, now):
+        if now - self.rendered < HEATMAP_RENDER:
+            return
+        self.rendered = now
+        base = self.export_path[:-5] if self.export_path.endswith('.json') else self.export_path
+        lat, lon = HEATMAP_CENTRE.unpack_from(self.mm, HEATMAP_HEADER.size)
+        day = local_day(now)
+        days = [slot for slot in range(HEATMAP_DAYS) if day - HEATMAP_DAYS < self.stamps[slot] <= day]
+        archived = [a for a in range(HEATMAP_ARCHIVE) if self.archive_stamps[a]]
+
+        if numpy is not None:
+            counts, archive = self.counts_np, self.archive_np
+        else:
+            counts, archive = self.counts, self.archive
+        grid, top = heatmap_sum(counts, self.cells, days)
+        write_atomic(base + '.png', heatmap_png(grid, top, HEATMAP_SIZE))
+        if not self.archive_rendered:
+            tiles, tiles_top = heatmap_sum(archive, self.tiles, archived)
+            write_atomic(base + '-archive.png', heatmap_png(tiles, tiles_top, HEATMAP_SIZE // HEATMAP_TILE))
+            self.archive_rendered = True
+
+        doc = {
+            'now': now,
+            'lat': lat,
+            'lon': lon,
+            'cell': HEATMAP_CELL,
+            'size': HEATMAP_SIZE,
+            'tile': HEATMAP_TILE,
+            'max': top,
+            # [local date, positions counted]
+            'days': sorted([day_name(self.stamps[slot]), heatmap_total(counts, self.cells, slot)]
+                           for slot in days),
+            'archive': sorted([day_name(self.archive_stamps[a]), heatmap_total(archive, self.tiles, a)]
+                              for a in archived),
+        }
+        write_atomic(self.export_path, json.dumps(doc, separators=(',', ':')))
+
+def local_day(t):
+    """Days since the epoch, counted in local time."""
+    local = time.localtime(t)
+    offset = -time.altzone if local.tm_isdst > 0 else -time.timezone
+    return int((t + offset) // 86400)
+
+def day_name(day):
+    return time.strftime('%Y-%m-%d', time.gmtime(day * 86400))
+
+def heatmap_palette():
+    """Palette PNG colours: 0 transparent, then dark blue through cyan and yellow to red."""
+    stops = ((0, 0, 128), (0, 160, 255), (0, 255, 160), (255, 255, 0), (255, 0, 0))
+    colors = [(0, 0, 0)]
+    for i in range(255):
+        x = i / 254.0 * (len(stops) - 1)
+        k = min(int(x), len(stops) - 2)
+        f = x - k
+        colors.append(tuple(int(a + (b - a) * f) for a, b in zip(stops[k], stops[k + 1])))
+    return b''.join(struct.pack('BBB', *c) for c in colors)
+
+HEATMAP_PALETTE = heatmap_palette()
+
+def heatmap_sum(counts, n, slots):
+    """Cell by cell sum of the n cell grids in slots of counts, and its largest cell."""
+    if numpy is not None:
+        grid = numpy.zeros(n, numpy.uint32)
+        for slot in slots:
+            grid += counts[slot * n:(slot + 1) * n]
+        return grid, int(grid.max())
+    grid = [0] * n
+    for slot in slots:
+        grid = [a + b for a, b in zip(grid, counts[slot * n:(slot + 1) * n])]
+    return grid, max(grid)
+
+def heatmap_total(counts, n, slot):
+    cells = counts[slot * n:(slot + 1) * n]
+    return int(cells.sum()) if numpy is not None else sum(cells)
+
+def heatmap_png(grid, top, side):
+    """Palette PNG of a side x side grid of counts, log scaled to top, zero cells transparent."""
+    scale = 254 / math.log1p(top) if top else 0
+    if numpy is not None:
+        levels = numpy.zeros(len(grid), numpy.uint8)
+        hit = grid > 0
+        levels[hit] = 1 + (numpy.log1p(grid[hit]) * scale).astype(numpy.uint8)
+        rows = numpy.zeros((side, side + 1), numpy.uint8)
+        rows[:, 1:] = levels.reshape(side, side)
+        raw = rows.tobytes()
+    else:
+        log1p = math.log1p
+        raw = bytearray()
+        for start in range(0, side * side, side):
+            raw.append(0)
+            raw.extend(1 + int(log1p(c) * scale) if c else 0 for c in grid[start:start + side])
+        raw = bytes(raw)
+
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 3, 0, 0, 0)) +
+            chunk(b'PLTE', HEATMAP_PALETTE) +
+            chunk(b'tRNS', b'\x00') +
+            chunk(b'IDAT', zlib.compress(raw, 6)) +
+            chunk(b'IEND', b''))
+
+QUARTILES = (0, 0.25, 0.50, 0.75, 1)
+
+def quartiles(values):
+    """(min, q1, median, q3, max) of values, None if there are none."""
+    return quantiles(values, QUARTILES)
+
+# measured with tests/bench_quantiles.py: below this many values in a list
+# sorted() beats converting them for numpy.sort
+SORT_NUMPY_MIN = 500
+# and below this many numpy.sort beats selecting the ranks by partitioning
+SELECT_MIN = 50000
+
+def quantiles(values, ps):
+    """perc(p, sorted(values)) for every p in ps.
+
+    For large inputs the order statistics perc() needs (rank int(p * (n-1))
+    and the one after it) are selected by partitioning with numpy, O(n)
+    overall.  Smaller inputs are sorted, short lists with sorted() and the
+    rest with numpy.  Without numpy the values are always sorted: a
+    selection written in Python lost to the C sort at every size up to a
+    million values.
+    """
+    n = len(values)
+    if n == 0:
+        return None
+    if numpy is None or (n < SORT_NUMPY_MIN and isinstance(values, list)):
+        values = sorted(values)
+        return tuple(perc(p, values) for p in ps)
+
+    if n < SELECT_MIN:
+        stats = numpy.sort(numpy.asarray(values, dtype=numpy.float64))
+    else:
+        ranks = set()
+        for p in ps:
+            x = int(p * (n - 1))
+            ranks.add(x)
+            if x + 1 < n:
+                ranks.add(x + 1)
+        # partitioned in place, so always work on a copy
+        stats = select_ranks(numpy.array(values, dtype=numpy.float64), sorted(ranks))
+
+    # same arithmetic as perc()
+    res = []
+    for p in ps:
+        x = p * (n - 1)
+        d = x - int(x)
+        x = int(x)
+        if x + 1 < n:
+            res.append(float(stats[x] + d * (stats[x + 1] - stats[x])))
+        else:
+            res.append(float(stats[x]))
+    return tuple(res)
+
+def select_ranks(arr, ranks):
+    """{rank: value} for the sorted ranks, partitioning the numpy array arr in place.
+
+    Each step partitions only the segment between two already placed ranks
+    around a single rank; numpy's multi-kth partition is slower than a full
+    sort for the handful of ranks needed here.
+    """
+    result = {}
+    stack = [(0, len(arr), ranks)]
+    while stack:
+        lo, hi, wanted = stack.pop()
+        mid = len(wanted) // 2
+        k = wanted[mid]
+        arr[lo:hi].partition(k - lo)
+        result[k] = arr[k]
+        if mid > 0:
+            stack.append((lo, k, wanted[:mid]))
+        if mid + 1 < len(wanted):
+            stack.append((k + 1, hi, wanted[mid + 1:]))
+    return result
+
+def greatcircle_batch(lat0, lon0, lats, lons):
+    """Haversine distance in meters from (lat0, lon0) to every (lats[i], lons[i])."""
+    if numpy is not None:
+        return haversine_numpy(lat0, lon0,
+                numpy.asarray(lats, dtype=numpy.float64),
+                numpy.asarray(lons, dtype=numpy.float64)).tolist()
+
+    rad = math.pi / 180.0
+    lat0 = lat0 * rad
+    cos_lat0 = math.cos(lat0)
+    sin, cos, asin, sqrt = math.sin, math.cos, math.asin, math.sqrt
+    res = []
+    for lat1, lon1 in zip(lats, lons):
+        lat1 = lat1 * rad
+        h = sin((lat1 - lat0) / 2) ** 2 + cos_lat0 * cos(lat1) * sin((lon1 - lon0) * rad / 2) ** 2
+        res.append(2 * 6371e3 * asin(sqrt(min(h, 1.0))))
+    return res
 
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='peak_signal_978',
-               time=aircraft_data['now'],
-               values = [maximum],
-               interval = 60)
+def bearing_batch(lat0, lon0, lats, lons):
+    """Initial bearing in degrees, 0 to 360, from (lat0, lon0) to every (lats[i], lons[i])."""
+    rad = math.pi / 180.0
+    lat0 = lat0 * rad
+    sin_lat0, cos_lat0 = math.sin(lat0), math.cos(lat0)
+    sin, cos, atan2 = math.sin, math.cos, math.atan2
+    res = []
+    for lat1, lon1 in zip(lats, lons):
+        lat1 = lat1 * rad
+        dlon = (lon1 - lon0) * rad
+        b = atan2(sin(dlon) * cos(lat1), cos_lat0 * sin(lat1) - sin_lat0 * cos(lat1) * cos(dlon))
+        res.append((b / rad) % 360.0)
+    return res
 
-        V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_dbfs',
-               type_instance='min_signal_978',
-               time=aircraft_data['now'],
-               values = [minimum],
-               interval = 60)
+def equal_area_batch(lat0, lon0, lats, lons):
+    """Lambert azimuthal equal-area (x, y) in meters, centred on (lat0, lon0), as two lists."""
+    if numpy is not None:
+        x, y = equal_area_numpy(lat0, lon0,
+                numpy.asarray(lats, dtype=numpy.float64),
+                numpy.asarray(lons, dtype=numpy.float64))
+        return x.tolist(), y.tolist()
+
+    rad = math.pi / 180.0
+    lat0 = lat0 * rad
+    sin_lat0, cos_lat0 = math.sin(lat0), math.cos(lat0)
+    sin, cos, sqrt = math.sin, math.cos, math.sqrt
+    xs = []
+    ys = []
+    for lat1, lon1 in zip(lats, lons):
+        lat1 = lat1 * rad
+        dlon = (lon1 - lon0) * rad
+        sin_lat1, cos_lat1, cos_dlon = sin(lat1), cos(lat1), cos(dlon)
+        k = 6371e3 * sqrt(2 / max(1 + sin_lat0 * sin_lat1 + cos_lat0 * cos_lat1 * cos_dlon, 1e-12))
+        xs.append(k * cos_lat1 * sin(dlon))
+        ys.append(k * (cos_lat0 * sin_lat1 - sin_lat0 * cos_lat1 * cos_dlon))
+    return xs, ys
+
+def equal_area_numpy(lat0, lon0, lat1, lon1):
+    lat0 = math.radians(lat0)
+    lat1 = numpy.radians(lat1)
+    dlon = numpy.radians(lon1 - lon0)
+    sin_lat1, cos_lat1, cos_dlon = numpy.sin(lat1), numpy.cos(lat1), numpy.cos(dlon)
+    k = 6371e3 * numpy.sqrt(2 / numpy.maximum(1 + math.sin(lat0) * sin_lat1 + math.cos(lat0) * cos_lat1 * cos_dlon, 1e-12))
+    return k * cos_lat1 * numpy.sin(dlon), k * (math.cos(lat0) * sin_lat1 - math.sin(lat0) * cos_lat1 * cos_dlon)
+
+def haversine_numpy(lat0, lon0, lat1, lon1):
+    lat0 = math.radians(lat0)
+    lat1 = numpy.radians(lat1)
+    dlon = numpy.radians(lon1 - lon0)
+    h = numpy.sin((lat1 - lat0) / 2) ** 2 + math.cos(lat0) * numpy.cos(lat1) * numpy.sin(dlon / 2) ** 2
+    return 2 * 6371e3 * numpy.arcsin(numpy.sqrt(numpy.minimum(h, 1.0)))
 
 def greatcircle(lat0, lon0, lat1, lon1):
     lat0 = lat0 * math.pi / 180.0;
     lon0 = lon0 * math.pi / 180.0;
     lat1 = lat1 * math.pi / 180.0;
     lon1 = lon1 * math.pi / 180.0;
-    return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
+    # rounding can take the cosine of a zero distance just past 1
+    return 6371e3 * math.acos(min(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)), 1.0))
 
 def T(provisional):
     now = time.time()
@@ -759,3 +2688,5 @@ def perc(p, values):
     return res
 
 collectd.register_config(callback=handle_config, name='dump1090')
+collectd.register_init(start_background)
+collectd.register_shutdown(stop_background)
@@ -295,6 +295,30 @@ aircraft_message_rate_graph() {
 	mv "$1.tmp" "$1"
 	}
 
+aircraft_msgrate_graph() {
+	if [[ -n "$ul_msgrate" ]]; then upper="--rigid --upper-limit $ul_msgrate"; else upper=""; fi
+	$pre
+	rrdtool graph \
+		"$1.tmp" \
+		--end "$END_TIME" \
+		--start end-$4 \
+		$small \
+		--title "$3 Message Rate per Aircraft" \
+		--vertical-label "Messages/Second" \
+		--lower-limit 0 \
+		$upper \
+		--units-exponent 0 \
+		"TEXTALIGN:center" \
+		"DEF:median=$(check $2/dump1090_msgrate-median.rrd):value:AVERAGE" \
+		"DEF:p90=$(check $2/dump1090_msgrate-p90.rrd):value:AVERAGE" \
+		"AREA:p90#$GREEN:90th Percentile" \
+		"GPRINT:p90:AVERAGE:%3.1lf" \
+		"LINE1:median#$BLUE:Median" \
+		"GPRINT:median:AVERAGE:%3.1lf\c" \
+		--watermark "Drawn: $nowlit";
+	mv "$1.tmp" "$1"
+	}
+
 cpu_graph_dump1090() {
 	if [[ -n $ul_adsb_cpu ]]; then upper="--rigid --upper-limit $ul_adsb_cpu"; else upper=""; fi
 	if [[ -f $2/dump1090_cpu-airspy.rrd ]]; then
@@ -574,6 +598,46 @@ memory_graph() {
 	}
 
 
+pressure_graph() {
+	$pre
+	rrdtool graph \
+		"$1.tmp" \
+		--end "$END_TIME" \
+		--start end-$4 \
+		$small \
+		--lower-limit 0 \
+		--title "Pressure Stall (PSI)" \
+		--vertical-label "% Time Stalled" \
+		--right-axis 1:0 \
+		--units-exponent 0 \
+		"TEXTALIGN:center" \
+		"DEF:cpu=$(check $2/system_psi-cpu.rrd):some:AVERAGE" \
+		"DEF:mem=$(check $2/system_psi-memory.rrd):some:AVERAGE" \
+		"DEF:memfull=$(check $2/system_psi-memory.rrd):full:AVERAGE" \
+		"DEF:io=$(check $2/system_psi-io.rrd):some:AVERAGE" \
+		"DEF:iofull=$(check $2/system_psi-io.rrd):full:AVERAGE" \
+		"CDEF:cpup=cpu,10000,/" \
+		"CDEF:memp=mem,10000,/" \
+		"CDEF:memfullp=memfull,10000,/" \
+		"CDEF:iop=io,10000,/" \
+		"CDEF:iofullp=iofull,10000,/" \
+		"LINE1:cpup#$GREEN:CPU" \
+		"GPRINT:cpup:MAX:Max\:%5.1lf%%" \
+		"GPRINT:cpup:AVERAGE:Avg\:%5.1lf%%\c" \
+		"LINE1:memp#$ABLUE:Memory" \
+		"GPRINT:memp:MAX:Max\:%5.1lf%%" \
+		"GPRINT:memp:AVERAGE:Avg\:%5.1lf%%" \
+		"LINE1:memfullp#$DBLUE:Full:dashes" \
+		"GPRINT:memfullp:MAX:Max\:%5.1lf%%\c" \
+		"LINE1:iop#$RED:IO" \
+		"GPRINT:iop:MAX:Max\:%5.1lf%%" \
+		"GPRINT:iop:AVERAGE:Avg\:%5.1lf%%" \
+		"LINE1:iofullp#$DRED:Full:dashes" \
+		"GPRINT:iofullp:MAX:Max\:%5.1lf%%\c" \
+		--watermark "Drawn: $nowlit";
+	mv "$1.tmp" "$1"
+	}
+
 network_graph() {
 	$pre
 	if [[ $(ls ${DB}/localhost | grep -v 'interface-lo' | grep interface -c) < 2 ]]
@@ -1246,6 +1310,33 @@ latency_graph() {
     local time_range="$4"
     local label="$5"
 
+    # p50 to p95 band and p99 of the continuous pings, once they have been recorded
+    local bands=()
+    local target color name
+    for target in fr24:BE8264:Flightradar24 fa:00417D:FlightAware; do
+        IFS=: read -r target color name <<< "$target"
+        local dir=/run/collectd/localhost/network_monitor-$target
+        if [[ -f $dir/gauge-rtt_p50_$target.rrd ]]; then
+            bands+=(
+                "DEF:${target}_p50=$dir/gauge-rtt_p50_$target.rrd:value:AVERAGE"
+                "DEF:${target}_p95=$(check $dir/gauge-rtt_p95_$target.rrd):value:AVERAGE"
+                "DEF:${target}_p99=$(check $dir/gauge-rtt_p99_$target.rrd):value:AVERAGE"
+                "DEF:${target}_jitter=$(check $dir/gauge-jitter_$target.rrd):value:AVERAGE"
+                "DEF:${target}_loss=$(check $dir/gauge-loss_$target.rrd):value:AVERAGE"
+                "CDEF:${target}_spread=${target}_p95,${target}_p50,-"
+                "AREA:${target}_p50#00000000:"
+                "AREA:${target}_spread#${color}40::STACK"
+                "LINE1:${target}_p99#${color}::dashes"
+                "VDEF:${target}_jitter_avg=${target}_jitter,AVERAGE"
+                "VDEF:${target}_loss_avg=${target}_loss,AVERAGE"
+                "VDEF:${target}_loss_max=${target}_loss,MAXIMUM"
+                "GPRINT:${target}_jitter_avg:${name} ping p50-p95, p99\\: Jitter %5.1lf ms"
+                "GPRINT:${target}_loss_avg: / Loss Avg %5.1lf%%"
+                "GPRINT:${target}_loss_max: / Max %5.1lf%%\\c"
+            )
+        fi
+    done
+
 rrdtool graph \
     "${out_png}.tmp" \
     --end now \
@@ -1289,6 +1380,7 @@ rrdtool graph \
     "LINE1:fr24_alert#BE1EC8:Alert (>1s)                  " \
     "LINE1:fa_latency#00417D:Latency\\:FlightAware" \
     "LINE1:fa_alert#FF0000:Alert (>1s)\\c" \
+    "${bands[@]}" \
     "COMMENT:                             " \
     "COMMENT:Connected SSID\\: " \
     "LINE1:0#CFFFA0:[Tenda_Misshka] " \
@@ -1367,6 +1459,10 @@ function show_graph() {
 dump1090_graphs() {
 	aircraft_graph ${DOCUMENTROOT}/dump1090-$2-aircraft-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5"
 	aircraft_message_rate_graph ${DOCUMENTROOT}/dump1090-$2-aircraft_message_rate-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5"
+	if [[ -f ${DB}/$1/dump1090-$2/dump1090_msgrate-median.rrd ]]; then
+		show_graph dump1090-msgrate
+		aircraft_msgrate_graph ${DOCUMENTROOT}/dump1090-$2-msgrate-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5"
+	fi
 	cpu_graph_dump1090 ${DOCUMENTROOT}/dump1090-$2-cpu-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5"
 	tracks_graph ${DOCUMENTROOT}/dump1090-$2-tracks-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5" 
 	local_rate_graph ${DOCUMENTROOT}/dump1090-$2-local_rate-$4.png ${DB}/$1/dump1090-$2 "$3" "$4" "$5"
@@ -1405,6 +1501,10 @@ system_graphs() {
 	disk_io_iops_graph ${DOCUMENTROOT}/system-$2-disk_io_iops-$4.png ${DB}/$1/$disk "$3" "$4" "$5"
 	disk_io_octets_graph ${DOCUMENTROOT}/system-$2-disk_io_octets-$4.png ${DB}/$1/$disk "$3" "$4" "$5"
 	memory_graph ${DOCUMENTROOT}/system-$2-memory-$4.png ${DB}/$1/system_stats "$3" "$4" "$5"
+	if [[ -f ${DB}/$1/system_stats/system_psi-cpu.rrd ]]; then
+		show_graph system-pressure
+		pressure_graph ${DOCUMENTROOT}/system-$2-pressure-$4.png ${DB}/$1/system_stats "$3" "$4" "$5"
+	fi
 	network_graph ${DOCUMENTROOT}/system-$2-network_bandwidth-$4.png ${DB}/$1 "$3" "$4" "$5"
 	latency_graph ${DOCUMENTROOT}/system-$2-latency-$4.png ${DB}/$2/network_monitor "Latency to FR24 & FA" "$4" "$2"
 	if [[ $farenheit == 1 ]]
@@ -89,6 +89,12 @@ function switchView(newTimeFrame) {
     $("#dump1090-aircraft_message_rate-image").attr("src", "graphs/dump1090-" + hostName + "-aircraft_message_rate-" + timeFrame + ".png?time=" + $timestamp);
     $("#dump1090-aircraft_message_rate-link").attr("href", "graphs/dump1090-" + hostName + "-aircraft_message_rate-" + timeFrame + ".png?time=" + $timestamp);
 
+    $("#dump1090-msgrate-image").attr("src", "graphs/dump1090-" + hostName + "-msgrate-" + timeFrame + ".png?time=" + $timestamp);
+    $("#dump1090-msgrate-link").attr("href", "graphs/dump1090-" + hostName + "-msgrate-" + timeFrame + ".png?time=" + $timestamp);
+
+    loadCoverage();
+    loadHeatmap();
+
     $("#dump1090-aircraft-image").attr("src", "graphs/dump1090-" + hostName + "-aircraft-" + timeFrame + ".png?time=" + $timestamp);
     $("#dump1090-aircraft-link").attr("href", "graphs/dump1090-" + hostName + "-aircraft-" + timeFrame + ".png?time=" + $timestamp);
 
@@ -171,6 +177,9 @@ function switchView(newTimeFrame) {
         $("#system-memory-image").attr("src", "graphs/system-" + hostName + "-memory-" + timeFrame + ".png?time=" + $timestamp);
         $("#system-memory-link").attr("href", "graphs/system-" + hostName + "-memory-" + timeFrame + ".png?time=" + $timestamp);
 
+        $("#system-pressure-image").attr("src", "graphs/system-" + hostName + "-pressure-" + timeFrame + ".png?time=" + $timestamp);
+        $("#system-pressure-link").attr("href", "graphs/system-" + hostName + "-pressure-" + timeFrame + ".png?time=" + $timestamp);
+
         element =  document.getElementById('system-temperature_imperial-image');
         if (typeof(element) != 'undefined' && element != null) {
             $("#system-temperature_imperial-image").attr("src", "graphs/system-" + hostName + "-temperature_imperial-" + timeFrame + ".png?time=" + $timestamp);
@@ -217,6 +226,117 @@ function switchView(newTimeFrame) {
     window.history.replaceState("object or string", "Title", url);
 }
 
+let coverage = null;
+let coverageView = 'rolling';
+const coverageColors = ["#1f77b4", "#2ca02c", "#ff7f0e", "#d62728", "#000000"];
+
+function loadCoverage() {
+    $.getJSON("graphs/dump1090-" + hostName + "-coverage.json?time=" + $timestamp)
+        .done(function(data) {
+            coverage = data;
+            $("#panel_coverage").show();
+            drawCoverage();
+        })
+        .fail(function() {
+            $("#panel_coverage").hide();
+        });
+}
+
+function coverageWindow(view) {
+    coverageView = view;
+    $("#btn-coverage-rolling").removeClass('active');
+    $("#btn-coverage-daily").removeClass('active');
+    $("#btn-coverage-" + view).addClass('active');
+    drawCoverage();
+}
+
+// max range per sector as a solid outline, the percentile range dashed, one colour per altitude band
+function drawCoverage() {
+    if (!coverage)
+        return;
+    let canvas = document.getElementById('coverage-canvas');
+    let ctx = canvas.getContext('2d');
+    let view = coverage[coverageView];
+    let cx = canvas.width / 2;
+    let cy = canvas.height / 2;
+    let radius = Math.min(cx, cy) - 20;
+    let sectors = coverage.sectors;
+    let all = view.max[view.max.length - 1];
+    let range = Math.max(100000, ...all);
+    let step = range > 400000 ? 100000 : 50000;
+    range = Math.ceil(range / step) * step;
+    let scale = radius / range;
+
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.font = "12px sans-serif";
+    ctx.strokeStyle = "#cccccc";
+    ctx.fillStyle = "#888888";
+    ctx.setLineDash([]);
+    for (let r = step; r <= range; r += step) {
+        ctx.beginPath();
+        ctx.arc(cx, cy, r * scale, 0, 2 * Math.PI);
+        ctx.stroke();
+        ctx.fillText(Math.round(r / 1852) + " NM", cx + 3, cy - r * scale - 3);
+    }
+
+    function outline(ranges, color, dashed) {
+        ctx.strokeStyle = color;
+        ctx.setLineDash(dashed ? [4, 4] : []);
+        ctx.beginPath();
+        for (let s = 0; s <= sectors; s++) {
+            let i = s % sectors;
+            let angle = (i + 0.5) * 2 * Math.PI / sectors;
+            let x = cx + ranges[i] * scale * Math.sin(angle);
+            let y = cy - ranges[i] * scale * Math.cos(angle);
+            if (s == 0)
+                ctx.moveTo(x, y);
+            else
+                ctx.lineTo(x, y);
+        }
+        ctx.stroke();
+    }
+
+    let labels = [];
+    let lower = 0;
+    for (let band of coverage.bands) {
+        labels.push(lower + "-" + band + " ft");
+        lower = band;
+    }
+    labels.push("> " + lower + " ft");
+    labels.push("all");
+
+    for (let b = 0; b < view.max.length; b++) {
+        let color = coverageColors[b % coverageColors.length];
+        outline(view.max[b], color, false);
+        outline(view.percentile[b], color, true);
+        ctx.fillStyle = color;
+        ctx.fillText(labels[b], 5, 15 + 15 * b);
+    }
+    ctx.fillStyle = "#888888";
+    ctx.fillText("dashed: " + Math.round(coverage.percentile * 100) + "th percentile", 5, canvas.height - 5);
+}
+
+function loadHeatmap() {
+    $.getJSON("graphs/dump1090-" + hostName + "-heatmap.json?time=" + $timestamp)
+        .done(function(data) {
+            let png = "graphs/dump1090-" + hostName + "-heatmap.png?time=" + $timestamp;
+            let archive = "graphs/dump1090-" + hostName + "-heatmap-archive.png?time=" + $timestamp;
+            $("#dump1090-heatmap-image").attr("src", png);
+            $("#dump1090-heatmap-link").attr("href", png);
+            $("#dump1090-heatmap_archive-image").attr("src", archive);
+            $("#dump1090-heatmap_archive-link").attr("href", archive);
+            let span = function(days) {
+                return days.length ? days[0][0] + " to " + days[days.length - 1][0] : "no data yet";
+            };
+            $("#dump1090-heatmap-caption").text(span(data.days) + ", " + data.cell / 1000 + " km cells");
+            $("#dump1090-heatmap_archive-caption").text(span(data.archive) + ", " + data.cell * data.tile / 1000 + " km cells");
+            $("#panel_heatmap").show();
+        })
+        .fail(function() {
+            $("#panel_heatmap").hide();
+        });
+}
+
 let verbose = true;
 let refreshTimer = null;
 let timersActive = false;
@@ -1,9 +1,17 @@
 #!/usr/bin/env python # Changed from python3, although collectd itself dictates version
 import collectd
+import ctypes
+import ctypes.util
+import errno
+import select
+import struct
 import subprocess
 import json
+import math
 import os
 import re
+import socket
+import threading
 import time
 import sys # Import sys for version check in logs
 
@@ -12,10 +20,20 @@ PING_TARGETS = {
     "fr24": "feed.flightradar24.com",
     "fa": "piaware.flightaware.com"
 }
+# TCP ports the feeders connect to, timed with a plain connect every
+# TCP_INTERVAL seconds.  Off unless set in the config, e.g.
+#   TCP_TARGET "fr24" "feed.flightradar24.com" 8099
+#   TCP_TARGET "fa" "piaware.flightaware.com" 1200
+TCP_TARGETS = {}
+TCP_INTERVAL = 600
 FPING_COUNT = 3
 FPING_TIMEOUT = 1000
 FPING_INTERVAL = 1000
+TCP_TIMEOUT = 5.0
 SSID_STATE_FILE = "/var/lib/wifi_failover/script_state.json"
+# how often the state file is checked without inotify, and with it just in case
+STATE_POLL = 5
+STATE_POLL_INOTIFY = 300
 
 # Map SSIDs to numerical values for RRD storage
 SSID_MAPPING = {
@@ -28,6 +46,14 @@ SSID_MAPPING = {
 PLUGIN_NAME = 'network_monitor'
 INTERVAL = 120
 
+# Between the rounds every PING_TARGETS host is also sent a single ping every
+# PROBE_INTERVAL seconds; the last RING_SIZE results per target give the
+# RTT percentiles, jitter and loss of each INTERVAL.
+PROBE_INTERVAL = 5
+PROBE_TIMEOUT = 2000
+RING_SIZE = 2 * INTERVAL // PROBE_INTERVAL
+RTT_PERCENTILES = ((50, 0.50), (95, 0.95), (99, 0.99))
+
 # Python 2 compatible logging functions
 def log_verbose(msg):
     collectd.debug("{}: {}".format(PLUGIN_NAME, msg))
@@ -44,109 +70,412 @@ def log_error(msg, exc_info=False):
     else:
         collectd.error("{}: {}".format(PLUGIN_NAME, msg))
 
-def get_latency_fping(target):
+FPING_LINE = re.compile(r'^(\S+)\s*:\s*xmt/rcv/%loss = \d+/\d+/\d+%(?:, min/avg/max = [\d.]+/([\d.]+)/[\d.]+)?')
+
+def get_latency_fping(targets, count=FPING_COUNT, timeout=FPING_TIMEOUT):
+    """Average ping latency in ms for each of targets, None for the unreachable ones.
+
+    One fping run pings all targets in parallel, FPING_INTERVAL apart per target.
+    """
     command = [
-        'fping', '-q', '-c', str(FPING_COUNT), '-t', str(FPING_TIMEOUT),
-        '-i', str(FPING_INTERVAL), target
-    ]
+        'fping', '-q', '-c', str(count), '-t', str(timeout),
+        '-p', str(FPING_INTERVAL), '-i', '10'
+    ] + list(targets)
     log_verbose("Running fping command: {}".format(' '.join(command)))
+    latencies = dict((target, None) for target in targets)
     try:
-        # subprocess.run is Python 3.5+. For Python 2.x, use subprocess.Popen and communicate.
-        # However, collectd's Python binding usually backports some features or we have to use Popen.
-        # Let's try Popen for Python 2 compatibility.
         process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout_data, stderr_data = process.communicate()
-        stdout = stdout_data.strip()
-        stderr = stderr_data.strip()
-        log_verbose("fping output for {}: stdout={}, stderr={}".format(target, stdout, stderr))
-
-        if process.returncode == 0 or process.returncode == 1:
-            output_to_parse = stderr if stderr else stdout
-            match = re.search(r'min/avg/max = [\d.]+/([\d.]+)/[\d.]+', output_to_parse)
-            if match:
-                avg_latency = float(match.group(1))
-                log_info("Latency to {}: {:.1f}ms".format(target, avg_latency))
-                return avg_latency
-            else:
-                log_warning("Could not parse fping output for {}: {}".format(target, output_to_parse))
+        stdout = stdout_data.decode('utf-8', 'replace').strip()
+        stderr = stderr_data.decode('utf-8', 'replace').strip()
+        log_verbose("fping output: stdout={}, stderr={}".format(stdout, stderr))
+
+        # 1 is some targets unreachable, 2 is a name that didn't resolve
+        if process.returncode in (0, 1, 2):
+            for line in (stderr or stdout).splitlines():
+                match = FPING_LINE.match(line)
+                if match and match.group(1) in latencies and match.group(2):
+                    latencies[match.group(1)] = float(match.group(2))
         else:
-            log_error("fping command failed for {} with exit code {}. Output: stdout={}, stderr={}".format(target, process.returncode, stdout, stderr))
+            log_error("fping command failed with exit code {}. Output: stdout={}, stderr={}".format(process.returncode, stdout, stderr))
     except Exception as e:
-        log_error("Error running fping for {}: {}".format(target, e), exc_info=True)
-    return None
+        log_error("Error running fping: {}".format(e), exc_info=True)
+    return latencies
 
-def get_current_ssid_status():
-    if not os.path.exists(SSID_STATE_FILE):
-        log_warning("SSID state file not found: {}".format(SSID_STATE_FILE))
-        return SSID_MAPPING.get("UNKNOWN")
+def get_latency_tcp(host, port, timeout=TCP_TIMEOUT):
+    """Time in ms to complete a TCP connect to host:port, None if it failed.
 
+    The name is resolved first so that only the handshake is timed.
+    """
     try:
-        with open(SSID_STATE_FILE, 'r') as f:
-            state_data = json.load(f)
-            current_mode = state_data.get('current_mode')
-            ssid_from_mode = None
-            if current_mode == "MODE_ON_MISSHKAWIFI":
-                ssid_from_mode = "Tenda_Misshka"
-            elif current_mode == "MODE_ON_MISSKATEL":
-                ssid_from_mode = "MisshkaTel"
-            elif current_mode in ["MODE_ON_SEN147W_MASTER_OVERRIDE", "MODE_ON_SEN147W_ACTING_PRIMARY"]:
-                ssid_from_mode = "SEN147w"
-
-            if ssid_from_mode:
-                ssid_value = SSID_MAPPING.get(ssid_from_mode, SSID_MAPPING.get("UNKNOWN"))
-                log_info("Current SSID from state file: {} (Value: {})".format(ssid_from_mode, ssid_value))
-                return ssid_value
-            else:
-                log_warning("Could not determine SSID from current_mode: {} in {}".format(current_mode, SSID_STATE_FILE))
-                return SSID_MAPPING.get("UNKNOWN")
-
-    except (ValueError, IOError) as e: # ValueError for json.JSONDecodeError in Python 2
-        log_error("Error reading or parsing SSID state file {}: {}".format(SSID_STATE_FILE, e), exc_info=True)
-        return SSID_MAPPING.get("UNKNOWN")
-    except Exception as e:
-        log_error("Unexpected error in get_current_ssid_status: {}".format(e), exc_info=True)
+        return connect_time(socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0], timeout)
+    except (socket.error, socket.timeout) as e:
+        log_verbose("TCP connect to {}:{} failed: {}".format(host, port, e))
+        return None
+
+def connect_time(addrinfo, timeout):
+    family, socktype, proto, _, address = addrinfo
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.settimeout(timeout)
+        start = time.time()
+        sock.connect(address)
+        return (time.time() - start) * 1000.0
+    finally:
+        sock.close()
+
+class RttRing(object):
+    """The last RING_SIZE probe results of one target, lost probes as None."""
+    def __init__(self):
+        self.times = [0.0] * RING_SIZE
+        self.rtts = [None] * RING_SIZE
+        self.next = 0
+
+    def add(self, t, rtt):
+        self.times[self.next] = t
+        self.rtts[self.next] = rtt
+        self.next = (self.next + 1) % RING_SIZE
+
+    def window(self, since):
+        """Results of the probes sent after since, oldest first."""
+        order = [i % RING_SIZE for i in range(self.next, self.next + RING_SIZE)]
+        return [self.rtts[i] for i in order if self.times[i] > since]
+
+def rtt_stats(rtts):
+    """{name: value} of RTT percentiles, jitter and loss % over a window of probe results.
+
+    Jitter is the mean difference between consecutive answered probes as
+    in RFC 3550, without its smoothing.  Names without a value are left out.
+    """
+    if not rtts:
+        return {}
+    answered = [rtt for rtt in rtts if rtt is not None]
+    stats = {'loss': 100.0 * (len(rtts) - len(answered)) / len(rtts)}
+    if answered:
+        ordered = sorted(answered)
+        for name, p in RTT_PERCENTILES:
+            # nearest rank
+            stats['rtt_p{}'.format(name)] = ordered[max(0, int(math.ceil(p * len(ordered))) - 1)]
+    if len(answered) > 1:
+        stats['jitter'] = sum(abs(b - a) for a, b in zip(answered, answered[1:])) / (len(answered) - 1)
+    return stats
+
+class RttProber(object):
+    """Pings every target once every PROBE_INTERVAL seconds in its own thread."""
+    def __init__(self, targets):
+        self.targets = targets
+        self.rings = dict((key, RttRing()) for key in targets)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.wakeup.clear()
+        self.thread = threading.Thread(target=self.run, name=PLUGIN_NAME + '.rtt')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.wakeup.is_set():
+            started = time.time()
+            by_host = get_latency_fping(self.targets.values(), count=1, timeout=PROBE_TIMEOUT)
+            with self.lock:
+                for key, target in self.targets.items():
+                    self.rings[key].add(started, by_host.get(target))
+            self.wakeup.wait(max(0, PROBE_INTERVAL - (time.time() - started)))
+
+    def stats(self, since):
+        """{key: rtt_stats()} over the probes sent after since."""
+        with self.lock:
+            windows = dict((key, ring.window(since)) for key, ring in self.rings.items())
+        return dict((key, rtt_stats(rtts)) for key, rtts in windows.items())
+
+class Prober(object):
+    """Probes all targets every INTERVAL seconds in a background thread.
+
+    The ping run and, every TCP_INTERVAL seconds, one thread per TCP target
+    go out at the same time, so a round takes as long as its slowest probe.
+    read_callback only picks up the last finished round and never waits for
+    one.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.result = None
+        self.thread = None
+        self.tcp_due = 0
+
+    def start(self):
+        self.wakeup.clear()
+        self.thread = threading.Thread(target=self.run, name=PLUGIN_NAME + '.prober')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        while not self.wakeup.is_set():
+            started = time.time()
+            try:
+                result = self.probe()
+                with self.lock:
+                    self.result = result
+            except Exception as e:
+                log_error("Probe round failed: {}".format(e), exc_info=True)
+            self.wakeup.wait(max(0, INTERVAL - (time.time() - started)))
+
+    def probe(self):
+        tcp = {}
+        def connect(key, host, port):
+            tcp[key] = get_latency_tcp(host, port)
+        threads = []
+        if TCP_TARGETS and time.time() >= self.tcp_due:
+            self.tcp_due = time.time() + TCP_INTERVAL
+            threads = [threading.Thread(target=connect, args=(key, host, port))
+                       for key, (host, port) in TCP_TARGETS.items()]
+        for thread in threads:
+            thread.start()
+        by_host = get_latency_fping(PING_TARGETS.values())
+        for thread in threads:
+            thread.join()
+        ping = dict((key, by_host.get(target)) for key, target in PING_TARGETS.items())
+        return time.time(), ping, tcp
+
+    def take(self):
+        """The last finished round, once, or None."""
+        with self.lock:
+            result, self.result = self.result, None
+        return result
+
+prober = Prober()
+rtt_prober = RttProber(PING_TARGETS)
+
+def ssid_status(state_data):
+    """The SSID_MAPPING value of the mode in the failover script's state."""
+    current_mode = state_data.get('current_mode')
+    ssid_from_mode = None
+    if current_mode == "MODE_ON_MISSHKAWIFI":
+        ssid_from_mode = "Tenda_Misshka"
+    elif current_mode == "MODE_ON_MISSKATEL":
+        ssid_from_mode = "MisshkaTel"
+    elif current_mode in ["MODE_ON_SEN147W_MASTER_OVERRIDE", "MODE_ON_SEN147W_ACTING_PRIMARY"]:
+        ssid_from_mode = "SEN147w"
+
+    if ssid_from_mode:
+        ssid_value = SSID_MAPPING.get(ssid_from_mode, SSID_MAPPING.get("UNKNOWN"))
+        log_info("Current SSID from state file: {} (Value: {})".format(ssid_from_mode, ssid_value))
+        return ssid_value
+    else:
+        log_warning("Could not determine SSID from current_mode: {} in {}".format(current_mode, SSID_STATE_FILE))
         return SSID_MAPPING.get("UNKNOWN")
 
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
 
-def read_callback():
-    log_verbose("Read callback triggered. Python version: {}.{}.{}".format(sys.version_info.major, sys.version_info.minor, sys.version_info.micro))
+def inotify_watch(directory, mask):
+    """A non-blocking inotify fd watching directory, None where inotify isn't available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, directory.encode('utf-8'), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
 
-    for key, target in PING_TARGETS.items():
-        avg_latency = get_latency_fping(target)
-        if avg_latency is not None:
-            val = collectd.Values()
-            val.plugin = PLUGIN_NAME              # 'network_monitor'
-            val.plugin_instance = key             # 'fr24' or 'fa'
-            val.type = 'gauge'
-            val.type_instance = 'latency_{}'.format(key)
-            val.host = 'localhost'
-            val.dispatch(values=[avg_latency])
-            log_info("Dispatched latency for {}: {:.1f}ms".format(key, avg_latency))
-        else:
-            log_warning("No latency value returned for {}".format(key))
+def inotify_names(fd):
+    """Names of the files the pending events are about."""
+    names = set()
+    while True:
+        try:
+            data = os.read(fd, 4096)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return names
+            raise
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.add(data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace'))
+            offset += length
+
+class SsidWatcher(object):
+    """Keeps the SSID value of SSID_STATE_FILE in memory.
+
+    The failover script replaces the file atomically, so it is only read
+    again when its inode, mtime or size changed.  inotify on its directory
+    says when to look; without it the file is checked every STATE_POLL
+    seconds.  A changed value is dispatched right away, timed when the
+    script entered the mode.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.signature = None
+        self.value = None
+        self.dispatched = 0
+        self.thread = None
+        self.stop_read, self.stop_write = os.pipe()
+
+    def start(self):
+        self.check()
+        self.thread = threading.Thread(target=self.run, name=PLUGIN_NAME + '.ssid')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        os.write(self.stop_write, b'x')
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        name = os.path.basename(self.path)
+        fd = None
+        while True:
+            if fd is None and os.path.isdir(os.path.dirname(self.path)):
+                fd = inotify_watch(os.path.dirname(self.path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+                # catch what changed before the watch was in place
+                self.check()
+            waiting = [self.stop_read] + ([fd] if fd is not None else [])
+            ready = select.select(waiting, [], [], STATE_POLL if fd is None else STATE_POLL_INOTIFY)[0]
+            if self.stop_read in ready:
+                break
+            if fd in ready and name not in inotify_names(fd):
+                continue
+            self.check()
+        if fd is not None:
+            os.close(fd)
+
+    def check(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if self.signature != 'missing':
+                log_warning("SSID state file not found: {}".format(self.path))
+                self.signature = 'missing'
+                self.changed(SSID_MAPPING.get("UNKNOWN"), time.time())
+            return
+        signature = (st.st_ino, st.st_mtime, st.st_size)
+        if signature == self.signature:
+            return
+        self.signature = signature
+        try:
+            with open(self.path, 'r') as f:
+                state_data = json.load(f)
+        except (ValueError, IOError) as e: # ValueError for json.JSONDecodeError in Python 2
+            # caught mid-write by something other than the failover script, the next write brings it back
+            log_error("Error reading or parsing SSID state file {}: {}".format(self.path, e))
+            return
+        entered = state_data.get('time_entered_current_mode_ts') or 0
+        self.changed(ssid_status(state_data), entered if 0 < entered <= time.time() else st.st_mtime)
 
-    ssid_status_value = get_current_ssid_status()
-    if ssid_status_value is not None:
+    def changed(self, value, when):
+        with self.lock:
+            if value == self.value:
+                return
+            self.value = value
+        if self.thread is not None:
+            self.dispatch(when)
+
+    def dispatch(self, when=None):
+        """Dispatch the current value, at when or now; never before the last dispatch."""
+        with self.lock:
+            if self.value is None:
+                return
+            # rrdtool only takes updates at least a second after the last one
+            when = max(when or time.time(), self.dispatched + 1)
+            self.dispatched = when
+            value = self.value
         val = collectd.Values()
         val.plugin = PLUGIN_NAME
         val.plugin_instance = 'ssid'
         val.type = 'gauge'
         val.type_instance = 'ssid_status'
         val.host = 'localhost'
-        val.dispatch(values=[ssid_status_value])
-        log_info("Dispatched SSID status: {}".format(ssid_status_value))
+        val.time = when
+        val.dispatch(values=[value])
+        log_info("Dispatched SSID status: {}".format(value))
+
+ssid_watcher = SsidWatcher(SSID_STATE_FILE)
+
+
+def read_callback():
+    log_verbose("Read callback triggered. Python version: {}.{}.{}".format(sys.version_info.major, sys.version_info.minor, sys.version_info.micro))
+
+    result = prober.take()
+    if result is not None:
+        probed, ping, tcp = result
+        for prefix, latencies in (('latency', ping), ('tcp_connect', tcp)):
+            for key, avg_latency in latencies.items():
+                if avg_latency is not None:
+                    val = collectd.Values()
+                    val.plugin = PLUGIN_NAME              # 'network_monitor'
+                    val.plugin_instance = key             # 'fr24' or 'fa'
+                    val.type = 'gauge'
+                    val.type_instance = '{}_{}'.format(prefix, key)
+                    val.host = 'localhost'
+                    val.time = probed
+                    val.dispatch(values=[avg_latency])
+                    log_info("Dispatched {} for {}: {:.1f}ms".format(prefix, key, avg_latency))
+                else:
+                    log_warning("No {} value returned for {}".format(prefix, key))
 
-#        val = collectd.Values(
-#            plugin=PLUGIN_NAME,
-#            type='gauge',
-#            type_instance='ssid_status'
-#        )
-#        val.dispatch(values=[ssid_status_value])
+    now = time.time()
+    for key, stats in sorted(rtt_prober.stats(now - INTERVAL).items()):
+        for name, value in sorted(stats.items()):
+            val = collectd.Values()
+            val.plugin = PLUGIN_NAME
+            val.plugin_instance = key
+            val.type = 'gauge'
+            val.type_instance = '{}_{}'.format(name, key)
+            val.host = 'localhost'
+            val.time = now
+            val.dispatch(values=[value])
+
+    # changes are dispatched when they happen, this keeps the series going in between
+    ssid_watcher.dispatch()
+
+def config_callback(root):
+    global TCP_INTERVAL
+    for child in root.children:
+        if child.key == 'TCP_TARGET':
+            key, host, port = child.values
+            TCP_TARGETS[key] = (host, int(port))
+        elif child.key == 'TCP_INTERVAL':
+            TCP_INTERVAL = float(child.values[0])
+        else:
+            log_warning("Unknown config key {}".format(child.key))
 
 def init_callback():
     log_info("{} plugin initialized. Python version: {}.{}.{}".format(PLUGIN_NAME, sys.version_info.major, sys.version_info.minor, sys.version_info.micro))
+    prober.start()
+    rtt_prober.start()
+    ssid_watcher.start()
+
+def shutdown_callback():
+    prober.stop()
+    rtt_prober.stop()
+    ssid_watcher.stop()
 
+collectd.register_config(config_callback)
 collectd.register_init(init_callback)
+collectd.register_shutdown(shutdown_callback)
 collectd.register_read(read_callback, INTERVAL)
-#collectd.register_config(None)
 
@@ -1,344 +1,927 @@
-#!/usr/bin/env python3
-# Advanced WiFi Failover Script for Raspberry Pi
-
-import subprocess
-import time
-import logging
-import logging.handlers
-import re
-import json
-import os
-import sys
-import tempfile
-
-# --- Configuration ---
-# SSIDs (Ensure these are exactly as in your wpa_supplicant.conf)
-PRIMARY_REPEATER_SSID = "Tenda_Misshka"
-SECONDARY_BACKUP_SSID = "MisshkaTel"
-MASTER_SOURCE_SSID = "SEN147w"
-
-# Connectivity Check
-PING_TARGETS = ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
-PING_TIMEOUT_SECONDS = 5
-
-# --- Intervals & Durations (in seconds) ---
-CHECK_INTERVAL_SECONDS = 5 * 60  # 5 minutes - The script's main heartbeat
-RESTORATION_CHECK_INTERVAL = 30 * 60 # 30 minutes
-TIME_ON_SECONDARY_TO_CHECK_MASTER_DURATION = 3 * 60 * 60  # 3 hours
-TIME_ON_MASTER_OVERRIDE_MODE_DURATION = 24 * 60 * 60  # 24 hours
-MASTER_SOURCE_COOLDOWN_DURATION = 24 * 60 * 60  # 24 hours
-CHECK_MISSHKAWIFI_FROM_ACTING_PRIMARY_INTERVAL = 3 * 60 * 60
-
-# --- Command & Settle Timings ---
-WPA_CLI_COMMAND_TIMEOUT = 30
-WIFI_CONNECTION_SETTLE_TIME = 25
-
-# --- Thresholds (Counts) ---
-PRIMARY_REPEATER_FAIL_THRESHOLD = 3
-MASTER_SOURCE_FAIL_THRESHOLD = 3
-PRIMARY_REPEATER_RESTORE_THRESHOLD = 2
-
-# --- File Paths ---
-LOG_FILE_PATH = "/var/log/wifi_failover.log"
-STATE_FILE_DIR = "/var/lib/wifi_failover"
-STATE_FILE_PATH = os.path.join(STATE_FILE_DIR, "script_state.json")
-
-# --- Wireless Interface ---
-WLAN_IFACE = "wlan0"
-
-# --- Mode Constants (Correctly defined) ---
-MODE_ON_MISSHKAWIFI = "MODE_ON_MISSHKAWIFI"
-MODE_ON_MISSKATEL = "MODE_ON_MISSKATEL"
-MODE_ON_SEN147W_MASTER_OVERRIDE = "MODE_ON_SEN147w_MASTER_OVERRIDE"
-MODE_ON_SEN147W_ACTING_PRIMARY = "MODE_ON_SEN147w_ACTING_PRIMARY"
-
-# --- Global State Dictionary ---
-DEFAULT_STATE = {
-    "current_mode": None,
-    "misshkawifi_fail_count": 0,
-    "misshkawifi_restore_count": 0,
-    "sen147w_master_fail_count": 0,
-    "time_entered_current_mode_ts": 0,
-    "sen147w_cooldown_until_ts": 0,
-    "last_check_ts": {
-        "check_sen147w_from_misshkatel": 0,
-        "check_misshkawifi_from_acting_primary": 0,
-        "check_misshkawifi_for_restoration": 0
-    }
-}
-state = {}
-
-# --- Network ID Cache ---
-network_ids = {
-    PRIMARY_REPEATER_SSID: None,
-    SECONDARY_BACKUP_SSID: None,
-    MASTER_SOURCE_SSID: None
-}
-
-# --- Helper Functions ---
-def initialize_logging():
-    logger = logging.getLogger()
-    if logger.handlers: return
-    logger.setLevel(logging.INFO)
-    console_handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-    try:
-        os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
-        file_handler = logging.handlers.TimedRotatingFileHandler(
-            LOG_FILE_PATH, when="midnight", interval=1, backupCount=7)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-    except Exception as e:
-        print(f"Error setting up file logger for {LOG_FILE_PATH}: {e}")
-
-def run_command(command_parts_list, use_sudo=True):
-    if use_sudo and os.geteuid() != 0:
-        command_parts_list = ['sudo'] + command_parts_list
-    try:
-        process = subprocess.run(
-            command_parts_list, capture_output=True, text=True, check=False, timeout=WPA_CLI_COMMAND_TIMEOUT)
-        if process.returncode != 0:
-            logging.error(f"Command '{' '.join(command_parts_list)}' failed with code {process.returncode}: {process.stderr.strip()}")
-            return None
-        return process.stdout.strip()
-    except Exception as e:
-        logging.error(f"Error running command '{' '.join(command_parts_list)}': {e}")
-        return None
-
-def check_internet(ping_targets=PING_TARGETS):
-    for target in ping_targets:
-        command = ['ping', '-c', '1', '-W', str(PING_TIMEOUT_SECONDS), target]
-        if run_command(command, use_sudo=False) is not None:
-            logging.info(f"Internet connectivity OK via {target}.")
-            return True
-    logging.warning("All ping targets failed. Internet is likely down.")
-    return False
-
-def get_current_ssid(interface=WLAN_IFACE):
-    output = run_command(['wpa_cli', '-i', interface, 'status'])
-    if output:
-        ssid_match = re.search(r'^ssid=([^\n]+)', output, re.MULTILINE)
-        state_match = re.search(r'^wpa_state=([^\n]+)', output, re.MULTILINE)
-        if ssid_match and state_match and state_match.group(1) == "COMPLETED":
-            return ssid_match.group(1)
-    return None
-
-def get_network_id_from_cli(interface, target_ssid):
-    output = run_command(['wpa_cli', '-i', interface, 'list_networks'])
-    if output:
-        for line in output.split('\n')[1:]:
-            parts = line.split('\t')
-            if len(parts) >= 2 and parts[1] == target_ssid:
-                return parts[0]
-    logging.error(f"SSID '{target_ssid}' not found in wpa_supplicant configuration.")
-    return None
-
-def switch_to_network(interface, network_id, friendly_ssid_name):
-    if not network_id: return False
-    run_command(['wpa_cli', '-i', interface, 'enable_network', network_id])
-    time.sleep(2)
-    select_output = run_command(['wpa_cli', '-i', interface, 'select_network', network_id])
-    if select_output and "OK" in select_output:
-        time.sleep(WIFI_CONNECTION_SETTLE_TIME)
-        if get_current_ssid(interface) == friendly_ssid_name:
-            logging.info(f"Successfully switched to and connected to {friendly_ssid_name}.")
-            return True
-    logging.error(f"Failed to switch to {friendly_ssid_name}.")
-    return False
-
-def retry_switch_to_network(ssid_name, max_attempts=3, retry_delay=10):
-    network_id = network_ids.get(ssid_name)
-    if not network_id: return False
-    for attempt in range(1, max_attempts + 1):
-        if switch_to_network(WLAN_IFACE, network_id, ssid_name):
-            return True
-        if attempt < max_attempts:
-            time.sleep(retry_delay)
-    logging.error(f"All {max_attempts} attempts to switch to {ssid_name} failed.")
-    return False
-
-def ensure_wpa_supplicant_responsive(interface=WLAN_IFACE):
-    output = run_command(['wpa_cli', '-i', interface, 'ping'])
-    if output and "PONG" in output:
-        return True
-    logging.error("wpa_supplicant is unresponsive.")
-    return False
-
-def load_state():
-    global state
-    if os.path.exists(STATE_FILE_PATH):
-        try:
-            with open(STATE_FILE_PATH, 'r') as f:
-                loaded_s = json.load(f)
-                state = DEFAULT_STATE.copy()
-                state.update(loaded_s)
-                logging.info("Successfully loaded state.")
-                return
-        except Exception as e:
-            logging.error(f"Error loading state: {e}. Using defaults.")
-    state = DEFAULT_STATE.copy()
-
-def save_state():
-    try:
-        os.makedirs(os.path.dirname(STATE_FILE_PATH), exist_ok=True)
-        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(STATE_FILE_PATH), delete=False) as tf:
-            json.dump(state, tf, indent=4)
-            tempname = tf.name
-        os.replace(tempname, STATE_FILE_PATH)
-    except Exception as e:
-        logging.error(f"Error saving state: {e}")
-
-def get_timestamp():
-    return time.time()
-
-def handle_mode_on_misshkawifi(current_ssid, internet_ok):
-    if current_ssid == PRIMARY_REPEATER_SSID and internet_ok:
-        state['misshkawifi_fail_count'] = 0
-    else:
-        state['misshkawifi_fail_count'] += 1
-        logging.warning(f"Primary Repeater Fail Count: {state['misshkawifi_fail_count']}/{PRIMARY_REPEATER_FAIL_THRESHOLD}.")
-        if state['misshkawifi_fail_count'] >= PRIMARY_REPEATER_FAIL_THRESHOLD:
-            logging.info("Primary Repeater failed threshold. Attempting to switch to Secondary Backup.")
-            if retry_switch_to_network(SECONDARY_BACKUP_SSID):
-                state['current_mode'] = MODE_ON_MISSKATEL
-                state['time_entered_current_mode_ts'] = get_timestamp()
-                state['last_check_ts']['check_misshkawifi_for_restoration'] = get_timestamp()
-            else:
-                logging.error("Failed to switch to Secondary Backup after retries.")
-
-def check_for_restoration(backup_ssid, primary_to_check, restoration_interval):
-    time_since_last_check = get_timestamp() - state['last_check_ts'].get("check_misshkawifi_for_restoration", 0)
-    if time_since_last_check < restoration_interval:
-        logging.info(f"Waiting for restoration check cooldown. {int((restoration_interval - time_since_last_check)/60)} minutes remaining.")
-        return
-    
-    logging.info(f"Restoration check interval passed. Checking {primary_to_check} for recovery...")
-    state['last_check_ts']['check_misshkawifi_for_restoration'] = get_timestamp()
-    if retry_switch_to_network(primary_to_check):
-        internet_restored = check_internet()
-        if internet_restored:
-            state['misshkawifi_restore_count'] += 1
-            if state['misshkawifi_restore_count'] >= PRIMARY_REPEATER_RESTORE_THRESHOLD:
-                state['current_mode'] = MODE_ON_MISSHKAWIFI
-                logging.info(f"{primary_to_check} successfully restored! Switching to primary mode.")
-                return
-        else:
-            state['misshkawifi_restore_count'] = 0
-        
-        logging.info(f"Switching back to {backup_ssid} after restoration check.")
-        if not retry_switch_to_network(backup_ssid):
-            logging.error(f"Failed to switch back to {backup_ssid}. Network state uncertain.")
-    else:
-        state['misshkawifi_restore_count'] = 0
-        if get_current_ssid() != backup_ssid:
-            retry_switch_to_network(backup_ssid)
-
-def handle_mode_on_misshkatel(current_ssid, internet_ok):
-    if current_ssid != SECONDARY_BACKUP_SSID and not retry_switch_to_network(SECONDARY_BACKUP_SSID):
-        return
-    if not internet_ok:
-        logging.critical("Secondary Backup has NO Internet!")
-    
-    check_for_restoration(SECONDARY_BACKUP_SSID, PRIMARY_REPEATER_SSID, RESTORATION_CHECK_INTERVAL)
-    if state['current_mode'] != MODE_ON_MISSKATEL: return
-
-    time_in_mode = get_timestamp() - state.get('time_entered_current_mode_ts', 0)
-    if time_in_mode >= TIME_ON_SECONDARY_TO_CHECK_MASTER_DURATION:
-        if state.get('sen147w_cooldown_until_ts', 0) > get_timestamp():
-            logging.info(f"Master Source is in cooldown. Skipping check.")
-        else:
-            if retry_switch_to_network(MASTER_SOURCE_SSID) and check_internet():
-                state['current_mode'] = MODE_ON_SEN147W_MASTER_OVERRIDE
-
-def handle_mode_on_sen147w(current_ssid, internet_ok, mode, check_interval):
-    if current_ssid != MASTER_SOURCE_SSID and not retry_switch_to_network(MASTER_SOURCE_SSID):
-        return
-    if not check_internet():
-        state['sen147w_master_fail_count'] += 1
-        if state['sen147w_master_fail_count'] >= MASTER_SOURCE_FAIL_THRESHOLD:
-            logging.warning(f"{MASTER_SOURCE_SSID} failed threshold. Switching to backup.")
-            if retry_switch_to_network(SECONDARY_BACKUP_SSID):
-                state['current_mode'] = MODE_ON_MISSKATEL
-                state['sen147w_cooldown_until_ts'] = get_timestamp() + MASTER_SOURCE_COOLDOWN_DURATION
-            return
-    else:
-        state['sen147w_master_fail_count'] = 0
-
-    time_in_mode = get_timestamp() - state.get('time_entered_current_mode_ts', 0)
-    if time_in_mode >= check_interval:
-        # This is the corrected restoration check logic for SEN147w modes
-        check_for_restoration(MASTER_SOURCE_SSID, PRIMARY_REPEATER_SSID, check_interval)
-        if state['current_mode'] == MODE_ON_MISSHKAWIFI:
-            return # Switch to primary was successful
-        
-        # If still in master override mode after the timer, transition to acting primary
-        if mode == MODE_ON_SEN147W_MASTER_OVERRIDE:
-             state['current_mode'] = MODE_ON_SEN147W_ACTING_PRIMARY
-             logging.info("24h Master Override finished. Tenda_Misshka not restored. Transitioning to Acting Primary mode.")
-
-def main():
-    initialize_logging()
-    logging.info("===== WiFi Failover Script Starting Up =====")
-    load_state()
-
-    for ssid in network_ids:
-        network_ids[ssid] = get_network_id_from_cli(WLAN_IFACE, ssid)
-        if not network_ids[ssid]:
-            logging.critical(f"CRITICAL FAILURE: Could not find required SSID '{ssid}'. Exiting.")
-            sys.exit(1)
-
-    if state.get('current_mode') is None:
-        for ssid in [PRIMARY_REPEATER_SSID, SECONDARY_BACKUP_SSID, MASTER_SOURCE_SSID]:
-            if retry_switch_to_network(ssid) and check_internet():
-                if ssid == PRIMARY_REPEATER_SSID: state['current_mode'] = MODE_ON_MISSHKAWIFI
-                elif ssid == SECONDARY_BACKUP_SSID: state['current_mode'] = MODE_ON_MISSKATEL
-                else: state['current_mode'] = MODE_ON_SEN147W_ACTING_PRIMARY
-                state['time_entered_current_mode_ts'] = get_timestamp()
-                break
-        else:
-            logging.warning("Failed to connect to any network. Defaulting to Primary mode.")
-            state['current_mode'] = MODE_ON_MISSHKAWIFI
-        save_state()
-
-    time.sleep(60)
-
-    while True:
-        logging.info(f"--- Main Loop Cycle Start (Mode: {state.get('current_mode')}) ---")
-        if not ensure_wpa_supplicant_responsive():
-            time.sleep(CHECK_INTERVAL_SECONDS)
-            continue
-        
-        current_ssid = get_current_ssid()
-        internet_ok = check_internet()
-        
-        mode_before = state.get('current_mode')
-        
-        if state['current_mode'] == MODE_ON_MISSHKAWIFI:
-            handle_mode_on_misshkawifi(current_ssid, internet_ok)
-        elif state['current_mode'] == MODE_ON_MISSKATEL:
-            handle_mode_on_misshkatel(current_ssid, internet_ok)
-        elif state['current_mode'] == MODE_ON_SEN147W_MASTER_OVERRIDE:
-            handle_mode_on_sen147w(current_ssid, internet_ok, MODE_ON_SEN147W_MASTER_OVERRIDE, TIME_ON_MASTER_OVERRIDE_MODE_DURATION)
-        elif state['current_mode'] == MODE_ON_SEN147W_ACTING_PRIMARY:
-            handle_mode_on_sen147w(current_ssid, internet_ok, MODE_ON_SEN147W_ACTING_PRIMARY, CHECK_MISSHKAWIFI_FROM_ACTING_PRIMARY_INTERVAL)
-        else:
-            logging.error(f"Unknown mode: '{state.get('current_mode')}'. Resetting.")
-            state['current_mode'] = MODE_ON_MISSHKAWIFI
-
-        if mode_before != state.get('current_mode'):
-            logging.info(f"Mode changed from '{mode_before}' to '{state.get('current_mode')}'")
-            state['time_entered_current_mode_ts'] = get_timestamp()
-            state['misshkawifi_restore_count'] = 0
-            state['sen147w_master_fail_count'] = 0
-
-        current_connected_ssid = get_current_ssid()
-        logging.info(f"✅ Post-check: Connected SSID: {current_connected_ssid} | Mode: {state.get('current_mode')}")
-
-        save_state()
-        logging.info(f"--- Cycle End. Sleeping for {CHECK_INTERVAL_SECONDS/60:.1f} mins ---")
-        time.sleep(CHECK_INTERVAL_SECONDS)
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+# Advanced WiFi Failover Script for Raspberry Pi
+
+import asyncio
+import atexit
+import copy
+import errno
+import itertools
+import socket
+import struct
+import threading
+import subprocess
+import time
+import logging
+import logging.handlers
+import json
+import os
+import re
+import select
+import sys
+import tempfile
+
+# --- Configuration ---
+# SSIDs (Ensure these are exactly as in your wpa_supplicant.conf)
+PRIMARY_REPEATER_SSID = "Tenda_Misshka"
+SECONDARY_BACKUP_SSID = "MisshkaTel"
+MASTER_SOURCE_SSID = "SEN147w"
+
+# Connectivity Check
+PING_TARGETS = ["8.8.8.8", "1.1.1.1", "9.9.9.9"]
+PING_TIMEOUT_SECONDS = 5
+PING_TCP_PORT = 53 # Where ICMP isn't allowed; the targets are DNS resolvers
+
+# --- Intervals & Durations (in seconds) ---
+CHECK_INTERVAL_SECONDS = 5 * 60  # 5 minutes - The script's main heartbeat
+FAILING_CHECK_INTERVAL_SECONDS = 30 # While the last check found no Internet
+RESTORATION_CHECK_INTERVAL = 30 * 60 # 30 minutes
+TIME_ON_SECONDARY_TO_CHECK_MASTER_DURATION = 3 * 60 * 60  # 3 hours
+TIME_ON_MASTER_OVERRIDE_MODE_DURATION = 24 * 60 * 60  # 24 hours
+MASTER_SOURCE_COOLDOWN_DURATION = 24 * 60 * 60  # 24 hours
+CHECK_MISSHKAWIFI_FROM_ACTING_PRIMARY_INTERVAL = 3 * 60 * 60
+
+# --- Command & Settle Timings ---
+WPA_CLI_COMMAND_TIMEOUT = 30
+WPA_REQUEST_TIMEOUT = 10
+WIFI_CONNECTION_SETTLE_TIME = 25 # Longest wait for a connection after select_network
+ADDRESS_SETTLE_TIME = 5 # Longest wait for DHCP after connecting
+EVENT_SETTLE_TIME = 5 # Grace after a disconnect before checking, for roaming
+MONITOR_PING_INTERVAL = 60
+
+# --- Link Quality ---
+# Where the upload probe sends to: a (host, port) that reads until EOF, for example
+# socat -u TCP-LISTEN:5001,fork,reuseaddr OPEN:/dev/null.  None leaves throughput out of the scores.
+THROUGHPUT_SINK = None
+THROUGHPUT_PROBE_BYTES = 256 * 1024
+THROUGHPUT_PROBE_TIMEOUT = 20
+THROUGHPUT_PROBE_INTERVAL = 30 * 60 # Per network, while connected to it
+THROUGHPUT_TARGET_KBPS = 2000 # Upload rate that scores full marks
+LINK_SAMPLE_MAX_AGE = 3 * CHECK_INTERVAL_SECONDS # Older samples say nothing about a network
+THROUGHPUT_MAX_AGE = 2 * THROUGHPUT_PROBE_INTERVAL # Older upload rates are left out of the scores
+SCORE_SMOOTHING = 0.5 # Weight of the newest sample while connected
+SCORE_SWITCH_BELOW = 0.4 # With an upload rate, a network scoring less is a bad sample
+SCORE_SWITCH_AFTER = 3 # Bad samples in a row before the network we're on is left
+SCORE_MARGIN = 0.1 # How much better another network must rank to leave a working one
+NEUTRAL_SCORE = 0.5 # For networks without a recent sample
+# Added to the scores when ranking, so the repeater wins a tie
+SSID_PREFERENCE = {
+    PRIMARY_REPEATER_SSID: 0.2,
+    SECONDARY_BACKUP_SSID: 0.1,
+    MASTER_SOURCE_SSID: 0.0
+}
+
+# --- File Paths ---
+LOG_FILE_PATH = "/var/log/wifi_failover.log"
+STATE_FILE_DIR = "/var/lib/wifi_failover"
+STATE_FILE_PATH = os.path.join(STATE_FILE_DIR, "script_state.json")
+
+# --- Wireless Interface ---
+WLAN_IFACE = "wlan0"
+WPA_CTRL_DIR = "/var/run/wpa_supplicant"
+
+# --- Mode Constants (Correctly defined) ---
+MODE_ON_MISSHKAWIFI = "MODE_ON_MISSHKAWIFI"
+MODE_ON_MISSKATEL = "MODE_ON_MISSKATEL"
+MODE_ON_SEN147W_MASTER_OVERRIDE = "MODE_ON_SEN147w_MASTER_OVERRIDE"
+MODE_ON_SEN147W_ACTING_PRIMARY = "MODE_ON_SEN147w_ACTING_PRIMARY"
+
+# --- Global State Dictionary ---
+DEFAULT_STATE = {
+    "current_mode": None,
+    "time_entered_current_mode_ts": 0,
+    "sen147w_cooldown_until_ts": 0,
+    "last_check_ts": {
+        "check_sen147w_from_misshkatel": 0,
+        "check_misshkawifi_from_acting_primary": 0,
+        "check_misshkawifi_for_restoration": 0
+    },
+    "link_quality": {}
+}
+state = {}
+
+# --- Network ID Cache ---
+network_ids = {
+    PRIMARY_REPEATER_SSID: None,
+    SECONDARY_BACKUP_SSID: None,
+    MASTER_SOURCE_SSID: None
+}
+
+# --- Helper Functions ---
+def initialize_logging():
+    logger = logging.getLogger()
+    if logger.handlers: return
+    logger.setLevel(logging.INFO)
+    console_handler = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    console_handler.setFormatter(formatter)
+    logger.addHandler(console_handler)
+    try:
+        os.makedirs(os.path.dirname(LOG_FILE_PATH), exist_ok=True)
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE_PATH, when="midnight", interval=1, backupCount=7)
+        file_handler.setFormatter(formatter)
+        logger.addHandler(file_handler)
+    except Exception as e:
+        print(f"Error setting up file logger for {LOG_FILE_PATH}: {e}")
+
+def run_command(command_parts_list, use_sudo=True):
+    if use_sudo and os.geteuid() != 0:
+        command_parts_list = ['sudo'] + command_parts_list
+    try:
+        process = subprocess.run(
+            command_parts_list, capture_output=True, text=True, check=False, timeout=WPA_CLI_COMMAND_TIMEOUT)
+        if process.returncode != 0:
+            logging.error(f"Command '{' '.join(command_parts_list)}' failed with code {process.returncode}: {process.stderr.strip()}")
+            return None
+        return process.stdout.strip()
+    except Exception as e:
+        logging.error(f"Error running command '{' '.join(command_parts_list)}': {e}")
+        return None
+
+class WpaControlUnavailable(OSError):
+    """The control socket could not be opened, the command was not sent."""
+
+class WpaControl:
+    """Client for wpa_supplicant's control interface, one datagram socket kept open.
+
+    Replies carry no request id; they come back in order.  Anything left from
+    an earlier request that timed out is drained before the next one is sent,
+    and unsolicited "<level>EVENT" messages are skipped.
+    """
+    counter = itertools.count()
+
+    def __init__(self, interface, ctrl_dir=WPA_CTRL_DIR):
+        self.path = os.path.join(ctrl_dir, interface)
+        self.local = None
+        self.sock = None
+
+    def open(self):
+        # wpa_supplicant answers to the sender's address, so bind one like wpa_cli does
+        self.local = f"/tmp/wpa_ctrl_{os.getpid()}-{next(self.counter)}"
+        if os.path.exists(self.local):
+            os.unlink(self.local)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind(self.local)
+            self.sock.connect(self.path)
+        except OSError as e:
+            self.close()
+            raise WpaControlUnavailable(e.errno, f"{self.path}: {e.strerror or e}") from e
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.local is not None:
+            try:
+                os.unlink(self.local)
+            except OSError:
+                pass
+            self.local = None
+
+    def drain(self):
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recv(65536)
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.setblocking(True)
+
+    def request(self, command, timeout=WPA_REQUEST_TIMEOUT):
+        """The reply to command.
+
+        A send to a wpa_supplicant that restarted fails without delivering
+        anything, so it is retried once on a new socket.  Once the command
+        is sent it is never sent again: socket.timeout and other errors
+        while waiting for the reply are raised.
+        """
+        for attempt in (1, 2):
+            if self.sock is None:
+                self.open()
+            try:
+                self.drain()
+                self.sock.send(command.encode())
+            except OSError:
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            deadline = time.monotonic() + timeout
+            try:
+                while True:
+                    self.sock.settimeout(max(0.001, deadline - time.monotonic()))
+                    reply = self.sock.recv(65536)
+                    if not reply.startswith(b'<'):
+                        return reply.decode('utf-8', 'replace')
+            except socket.timeout:
+                # a late reply is drained before the next request
+                raise
+            except OSError:
+                self.close()
+                raise
+
+wpa_controls = {}
+
+@atexit.register
+def close_wpa_controls():
+    for control in wpa_controls.values():
+        control.close()
+
+def wpa_request(command, interface=WLAN_IFACE):
+    """wpa_supplicant's reply to a control interface command, None if it failed.
+
+    Falls back to wpa_cli only when the control socket can't be opened; a
+    command that may have reached wpa_supplicant is not sent a second time.
+    """
+    control = wpa_controls.get(interface)
+    if control is None:
+        control = wpa_controls[interface] = WpaControl(interface)
+    try:
+        return control.request(command).strip()
+    except WpaControlUnavailable as e:
+        logging.warning(f"Control socket unavailable for '{command}': {e}. Using wpa_cli.")
+        return run_command(['wpa_cli', '-i', interface] + command.lower().split())
+    except socket.timeout:
+        logging.error(f"No reply from {control.path} to '{command}' within {WPA_REQUEST_TIMEOUT}s")
+        return None
+    except OSError as e:
+        logging.error(f"Control socket {control.path} failed for '{command}': {e}")
+        return None
+
+def parse_status(output):
+    """STATUS reply as a dict of its key=value lines."""
+    status = {}
+    for line in (output or '').split('\n'):
+        key, sep, value = line.partition('=')
+        if sep:
+            status[key] = value
+    return status
+
+# Round trip in seconds of the target that answered the last check first, None when none did
+internet_rtt = None
+# {target: round trip in seconds} of the replies that arrived in the last check.
+# It returns on the first answer, so targets that were slower are missing.
+target_rtts = {}
+
+def icmp_socket():
+    """An unprivileged ping socket where the kernel allows one, else a raw one; None without either."""
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            return socket.socket(socket.AF_INET, kind, socket.IPPROTO_ICMP)
+        except OSError:
+            pass
+    return None
+
+def icmp_echo_request(ident, seq):
+    header = struct.pack('!BBHHH', 8, 0, 0, ident, seq)
+    payload = b'wifi-failover'
+    data = header + payload + b'\0' * (len(payload) % 2)
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return struct.pack('!BBHHH', 8, 0, ~total & 0xffff, ident, seq) + payload
+
+def is_echo_reply(sock, data, ident, seq):
+    if sock.type == socket.SOCK_RAW:
+        # raw sockets get the IP header and every ICMP message for the host
+        data = data[(data[0] & 0x0f) * 4:]
+    if len(data) < 8:
+        return False
+    kind, _, _, reply_ident, reply_seq = struct.unpack_from('!BBHHH', data)
+    # ping sockets replace the identifier with their own
+    return kind == 0 and reply_seq == seq and (sock.type != socket.SOCK_RAW or reply_ident == ident)
+
+def check_internet(ping_targets=PING_TARGETS):
+    """Probe all targets at once; True as soon as one answers, the others are dropped."""
+    global internet_rtt
+    internet_rtt = None
+    target_rtts.clear()
+    ident = os.getpid() & 0xffff
+    probes = {}
+    start = time.monotonic()
+    try:
+        for seq, target in enumerate(ping_targets):
+            sock = icmp_socket()
+            if sock is not None:
+                sock.setblocking(False)
+                try:
+                    sock.sendto(icmp_echo_request(ident, seq), (target, 0))
+                    probes[sock] = (target, seq)
+                    continue
+                except OSError:
+                    sock.close()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            if sock.connect_ex((target, PING_TCP_PORT)) in (0, errno.EINPROGRESS):
+                probes[sock] = (target, None)
+            else:
+                sock.close()
+
+        deadline = start + PING_TIMEOUT_SECONDS
+        while probes:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            icmp = [sock for sock, (_, seq) in probes.items() if seq is not None]
+            tcp = [sock for sock, (_, seq) in probes.items() if seq is None]
+            readable, writable, _ = select.select(icmp, tcp, [], remaining)
+            # every answer of this round is recorded before returning
+            for sock in readable + writable:
+                target, seq = probes[sock]
+                if seq is not None:
+                    try:
+                        data, address = sock.recvfrom(2048)
+                    except OSError:
+                        continue
+                    if address[0] != target or not is_echo_reply(sock, data, ident, seq):
+                        continue
+                elif sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+                    del probes[sock]
+                    sock.close()
+                    continue
+                target_rtts[target] = rtt = time.monotonic() - start
+                if internet_rtt is None:
+                    internet_rtt = rtt
+                    logging.info(f"Internet connectivity OK via {target} ({'ICMP' if seq is not None else 'TCP'}, {rtt * 1000:.0f} ms).")
+            if target_rtts:
+                return True
+    finally:
+        for sock in probes:
+            sock.close()
+    logging.warning("All ping targets failed. Internet is likely down.")
+    return False
+
+def get_current_ssid(interface=WLAN_IFACE):
+    status = parse_status(wpa_request('STATUS', interface))
+    if status.get('wpa_state') == "COMPLETED":
+        return status.get('ssid')
+    return None
+
+def get_network_id_from_cli(interface, target_ssid):
+    output = wpa_request('LIST_NETWORKS', interface)
+    if output:
+        for line in output.split('\n')[1:]:
+            parts = line.split('\t')
+            if len(parts) >= 2 and parts[1] == target_ssid:
+                return parts[0]
+    logging.error(f"SSID '{target_ssid}' not found in wpa_supplicant configuration.")
+    return None
+
+def switch_to_network(interface, network_id, friendly_ssid_name):
+    if not network_id: return False
+    wpa_request(f'ENABLE_NETWORK {network_id}', interface)
+    if events is None:
+        time.sleep(2)
+    else:
+        connected = events.connection_count()
+    select_output = wpa_request(f'SELECT_NETWORK {network_id}', interface)
+    if select_output and "OK" in select_output:
+        if events is None:
+            time.sleep(WIFI_CONNECTION_SETTLE_TIME)
+        elif events.wait_connected(connected, network_id, WIFI_CONNECTION_SETTLE_TIME):
+            events.wait_address(ADDRESS_SETTLE_TIME)
+        if get_current_ssid(interface) == friendly_ssid_name:
+            logging.info(f"Successfully switched to and connected to {friendly_ssid_name}.")
+            return True
+    logging.error(f"Failed to switch to {friendly_ssid_name}.")
+    return False
+
+def retry_switch_to_network(ssid_name, max_attempts=3, retry_delay=10):
+    network_id = network_ids.get(ssid_name)
+    if not network_id: return False
+    for attempt in range(1, max_attempts + 1):
+        if switch_to_network(WLAN_IFACE, network_id, ssid_name):
+            return True
+        if attempt < max_attempts:
+            time.sleep(retry_delay)
+    logging.error(f"All {max_attempts} attempts to switch to {ssid_name} failed.")
+    return False
+
+def ensure_wpa_supplicant_responsive(interface=WLAN_IFACE):
+    output = wpa_request('PING', interface)
+    if output and "PONG" in output:
+        return True
+    logging.error("wpa_supplicant is unresponsive.")
+    return False
+
+def load_state():
+    global state
+    if os.path.exists(STATE_FILE_PATH):
+        try:
+            with open(STATE_FILE_PATH, 'r') as f:
+                loaded_s = json.load(f)
+                state = copy.deepcopy(DEFAULT_STATE)
+                state.update((key, value) for key, value in loaded_s.items() if key in DEFAULT_STATE)
+                logging.info("Successfully loaded state.")
+                return
+        except Exception as e:
+            logging.error(f"Error loading state: {e}. Using defaults.")
+    state = copy.deepcopy(DEFAULT_STATE)
+
+def save_state():
+    try:
+        os.makedirs(os.path.dirname(STATE_FILE_PATH), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(STATE_FILE_PATH), delete=False) as tf:
+            json.dump(state, tf, indent=4)
+            tempname = tf.name
+        os.replace(tempname, STATE_FILE_PATH)
+    except Exception as e:
+        logging.error(f"Error saving state: {e}")
+
+def get_timestamp():
+    return time.time()
+
+# --- Link Quality ---
+# Each cycle the network we're on is sampled: signal, noise and link speed
+# from SIGNAL_POLL and /proc/net/wireless, the round trip of the connectivity
+# check and, every THROUGHPUT_PROBE_INTERVAL, the upload rate to
+# THROUGHPUT_SINK.  The samples and a score from 0 to 1 are kept per SSID in
+# the state file under link_quality.  A sample is bad when the Internet
+# check failed or, only when it has an upload rate, when the score is under
+# SCORE_SWITCH_BELOW; without an upload rate the score only ranks networks.
+# The network we're on is left after SCORE_SWITCH_AFTER bad samples in a
+# row, one we switch to must have a good latest sample.
+
+def read_proc_wireless(interface=WLAN_IFACE):
+    """Link quality, signal level and noise from /proc/net/wireless, {} if it has no line for interface."""
+    try:
+        with open('/proc/net/wireless') as f:
+            lines = f.read().split('\n')[2:]
+    except OSError:
+        return {}
+    for line in lines:
+        name, sep, rest = line.partition(':')
+        fields = rest.split()
+        if not sep or name.strip() != interface or len(fields) < 4:
+            continue
+        # " wlan0: 0000   70.  -40.  -256 ..." the dots mark values updated since the last read
+        try:
+            quality, level, noise = (float(value.rstrip('.')) for value in fields[1:4])
+        except ValueError:
+            return {}
+        # drivers that don't know the noise report -256
+        return {'quality': quality, 'level': level if level < 0 else None, 'noise': noise if -256 < noise < 0 else None}
+    return {}
+
+def probe_upload(sink=THROUGHPUT_SINK):
+    """Upload rate to sink in kbit/s, None if it couldn't be measured."""
+    payload = bytes(THROUGHPUT_PROBE_BYTES)
+    try:
+        with socket.create_connection(sink, THROUGHPUT_PROBE_TIMEOUT) as sock:
+            start = time.monotonic()
+            sock.sendall(payload)
+            sock.shutdown(socket.SHUT_WR)
+            # the sink closing means everything arrived
+            while sock.recv(4096):
+                pass
+    except OSError as e:
+        logging.warning(f"Upload probe to {sink[0]}:{sink[1]} failed: {e}")
+        return None
+    elapsed = max(time.monotonic() - start, 0.001)
+    return len(payload) * 8 / 1000 / elapsed
+
+def clamp(value):
+    return min(max(value, 0.0), 1.0)
+
+def has_throughput(sample):
+    return sample.get('upload_kbps') is not None and sample['ts'] - sample.get('upload_ts', 0) < THROUGHPUT_MAX_AGE
+
+def sample_score(sample):
+    """0 to 1 for a sample: no Internet is 0, otherwise a weighted mean of what was measured."""
+    if not sample['internet_ok']:
+        return 0.0
+    parts = []
+    if has_throughput(sample):
+        parts.append((0.5, clamp(sample['upload_kbps'] / THROUGHPUT_TARGET_KBPS)))
+    if sample.get('rssi') is not None and sample.get('noise') is not None:
+        parts.append((0.2, clamp((sample['rssi'] - sample['noise'] - 10) / 30)))
+    elif sample.get('rssi') is not None:
+        parts.append((0.2, clamp((sample['rssi'] + 90) / 40)))
+    if sample.get('rtt_ms') is not None:
+        parts.append((0.2, clamp(1 - (sample['rtt_ms'] - 20) / 480)))
+    if sample.get('linkspeed') is not None:
+        parts.append((0.1, clamp(sample['linkspeed'] / 65)))
+    if not parts:
+        return 1.0
+    return sum(weight * value for weight, value in parts) / sum(weight for weight, _ in parts)
+
+def sample_link(ssid, internet_ok, connected=True, force_throughput=False):
+    """Sample the network we're on after a check_internet(), or record that ssid couldn't be reached."""
+    now = get_timestamp()
+    previous = state['link_quality'].get(ssid, {})
+    sample = {'ts': now, 'internet_ok': internet_ok}
+    if connected:
+        signal = parse_status(wpa_request('SIGNAL_POLL'))
+        wireless = read_proc_wireless()
+        def number(key):
+            try:
+                return int(signal[key])
+            except (KeyError, ValueError):
+                return None
+        sample['rssi'] = number('RSSI') or wireless.get('level')
+        sample['noise'] = number('NOISE') if number('NOISE') not in (None, 9999) else wireless.get('noise')
+        sample['linkspeed'] = number('LINKSPEED')
+        sample['frequency'] = number('FREQUENCY')
+        sample['quality'] = wireless.get('quality')
+        sample['rtt_ms'] = round(internet_rtt * 1000, 1) if internet_ok and internet_rtt is not None else None
+        sample['target_rtt_ms'] = {target: round(rtt * 1000, 1) for target, rtt in target_rtts.items()} if internet_ok else {}
+
+    upload_kbps, upload_ts = previous.get('upload_kbps'), previous.get('upload_ts', 0)
+    if (connected and internet_ok and THROUGHPUT_SINK is not None
+            and (force_throughput or now - upload_ts >= THROUGHPUT_PROBE_INTERVAL)):
+        upload_kbps = probe_upload(THROUGHPUT_SINK)
+        if upload_kbps is not None:
+            upload_kbps = round(upload_kbps)
+        upload_ts = now
+    sample['upload_kbps'], sample['upload_ts'] = upload_kbps, upload_ts
+
+    sample['sample_score'] = round(sample_score(sample), 3)
+    # scores and bad sample counts only carry over between consecutive cycles on the same network
+    consecutive = now - previous.get('ts', 0) <= 2 * CHECK_INTERVAL_SECONDS
+    if consecutive and 'score' in previous:
+        sample['score'] = round(previous['score'] + SCORE_SMOOTHING * (sample['sample_score'] - previous['score']), 3)
+    else:
+        sample['score'] = sample['sample_score']
+    bad = not internet_ok or (has_throughput(sample) and sample['score'] < SCORE_SWITCH_BELOW)
+    sample['bad_samples'] = (previous.get('bad_samples', 0) if consecutive else 0) + 1 if bad else 0
+    state['link_quality'][ssid] = sample
+    logging.info(f"Link {ssid}: score {sample['score']:.2f} (sample {sample['sample_score']:.2f}, "
+                 f"RSSI {sample.get('rssi')} dBm, noise {sample.get('noise')} dBm, {sample.get('linkspeed')} Mbit/s, "
+                 f"RTT {sample.get('rtt_ms')} ms, upload {upload_kbps} kbit/s, {sample['bad_samples']} bad in a row).")
+    return sample['score']
+
+def link_sample(ssid):
+    """ssid's latest sample, None if there is none in LINK_SAMPLE_MAX_AGE."""
+    sample = state['link_quality'].get(ssid)
+    if sample is None or get_timestamp() - sample.get('ts', 0) > LINK_SAMPLE_MAX_AGE:
+        return None
+    return sample
+
+def link_score(ssid):
+    sample = link_sample(ssid)
+    return None if sample is None else sample.get('score')
+
+def link_rank(ssid):
+    score = link_score(ssid)
+    return (NEUTRAL_SCORE if score is None else score) + SSID_PREFERENCE.get(ssid, 0.0)
+
+def link_usable(ssid):
+    """Whether ssid is worth switching to: its latest sample is recent and good."""
+    sample = link_sample(ssid)
+    return sample is not None and sample.get('bad_samples', 0) == 0
+
+def link_failing(ssid):
+    """Whether the network we're on should be left: SCORE_SWITCH_AFTER bad samples in a row."""
+    sample = link_sample(ssid)
+    return sample is not None and sample.get('bad_samples', 0) >= SCORE_SWITCH_AFTER
+
+def link_measured(ssid):
+    """Whether ssid's score includes an upload rate, so that it may outrank a working network."""
+    sample = link_sample(ssid)
+    return sample is not None and has_throughput(sample)
+
+def handle_mode_on_misshkawifi(current_ssid, internet_ok):
+    if current_ssid != PRIMARY_REPEATER_SSID:
+        sample_link(PRIMARY_REPEATER_SSID, False, connected=False)
+    if not link_failing(PRIMARY_REPEATER_SSID):
+        # a working Primary is only left for a Backup that measures better
+        if not (link_measured(PRIMARY_REPEATER_SSID) and link_measured(SECONDARY_BACKUP_SSID)
+                and link_usable(SECONDARY_BACKUP_SSID)
+                and link_rank(SECONDARY_BACKUP_SSID) >= link_rank(PRIMARY_REPEATER_SSID) + SCORE_MARGIN):
+            return
+        logging.info(f"Secondary Backup ranks {link_rank(SECONDARY_BACKUP_SSID):.2f} against the Primary Repeater's "
+                     f"{link_rank(PRIMARY_REPEATER_SSID):.2f}. Attempting to switch to Secondary Backup.")
+    else:
+        logging.info(f"Primary Repeater had {SCORE_SWITCH_AFTER} bad samples in a row "
+                     f"(score {link_score(PRIMARY_REPEATER_SSID):.2f}). Attempting to switch to Secondary Backup.")
+    if retry_switch_to_network(SECONDARY_BACKUP_SSID):
+        state['current_mode'] = MODE_ON_MISSKATEL
+        state['time_entered_current_mode_ts'] = get_timestamp()
+        state['last_check_ts']['check_misshkawifi_for_restoration'] = get_timestamp()
+    else:
+        logging.error("Failed to switch to Secondary Backup after retries.")
+
+def check_for_restoration(backup_ssid, primary_to_check, restoration_interval):
+    time_since_last_check = get_timestamp() - state['last_check_ts'].get("check_misshkawifi_for_restoration", 0)
+    if time_since_last_check < restoration_interval:
+        logging.info(f"Waiting for restoration check cooldown. {int((restoration_interval - time_since_last_check)/60)} minutes remaining.")
+        return
+    
+    logging.info(f"Restoration check interval passed. Checking {primary_to_check} for recovery...")
+    state['last_check_ts']['check_misshkawifi_for_restoration'] = get_timestamp()
+    if retry_switch_to_network(primary_to_check):
+        sample_link(primary_to_check, check_internet(), force_throughput=True)
+        if link_usable(primary_to_check) and link_rank(primary_to_check) >= link_rank(backup_ssid):
+            state['current_mode'] = MODE_ON_MISSHKAWIFI
+            logging.info(f"{primary_to_check} successfully restored (rank {link_rank(primary_to_check):.2f} against "
+                         f"{link_rank(backup_ssid):.2f})! Switching to primary mode.")
+            return
+        
+        logging.info(f"Switching back to {backup_ssid} after restoration check.")
+        if not retry_switch_to_network(backup_ssid):
+            logging.error(f"Failed to switch back to {backup_ssid}. Network state uncertain.")
+    else:
+        sample_link(primary_to_check, False, connected=False)
+        if get_current_ssid() != backup_ssid:
+            retry_switch_to_network(backup_ssid)
+
+def handle_mode_on_misshkatel(current_ssid, internet_ok):
+    if current_ssid != SECONDARY_BACKUP_SSID:
+        if not retry_switch_to_network(SECONDARY_BACKUP_SSID):
+            return
+        internet_ok = check_internet()
+        sample_link(SECONDARY_BACKUP_SSID, internet_ok)
+    if not internet_ok:
+        logging.critical("Secondary Backup has NO Internet!")
+    
+    check_for_restoration(SECONDARY_BACKUP_SSID, PRIMARY_REPEATER_SSID, RESTORATION_CHECK_INTERVAL)
+    if state['current_mode'] != MODE_ON_MISSKATEL: return
+
+    time_in_mode = get_timestamp() - state.get('time_entered_current_mode_ts', 0)
+    if time_in_mode >= TIME_ON_SECONDARY_TO_CHECK_MASTER_DURATION:
+        if state.get('sen147w_cooldown_until_ts', 0) > get_timestamp():
+            logging.info(f"Master Source is in cooldown. Skipping check.")
+        elif retry_switch_to_network(MASTER_SOURCE_SSID):
+            sample_link(MASTER_SOURCE_SSID, check_internet(), force_throughput=True)
+            # the override is the point of the check, so the Master only has to come close
+            if link_usable(MASTER_SOURCE_SSID) and \
+                    link_rank(MASTER_SOURCE_SSID) + SCORE_MARGIN >= link_rank(SECONDARY_BACKUP_SSID):
+                state['current_mode'] = MODE_ON_SEN147W_MASTER_OVERRIDE
+            else:
+                logging.info(f"{MASTER_SOURCE_SSID} ranks {link_rank(MASTER_SOURCE_SSID):.2f}. Staying on {SECONDARY_BACKUP_SSID}.")
+                retry_switch_to_network(SECONDARY_BACKUP_SSID)
+        else:
+            sample_link(MASTER_SOURCE_SSID, False, connected=False)
+
+def handle_mode_on_sen147w(current_ssid, internet_ok, mode, check_interval):
+    if current_ssid != MASTER_SOURCE_SSID:
+        if not retry_switch_to_network(MASTER_SOURCE_SSID):
+            return
+        sample_link(MASTER_SOURCE_SSID, check_internet())
+    if link_failing(MASTER_SOURCE_SSID):
+        logging.warning(f"{MASTER_SOURCE_SSID} had {SCORE_SWITCH_AFTER} bad samples in a row "
+                        f"(score {link_score(MASTER_SOURCE_SSID):.2f}). Switching to backup.")
+        if retry_switch_to_network(SECONDARY_BACKUP_SSID):
+            state['current_mode'] = MODE_ON_MISSKATEL
+            state['sen147w_cooldown_until_ts'] = get_timestamp() + MASTER_SOURCE_COOLDOWN_DURATION
+        return
+
+    time_in_mode = get_timestamp() - state.get('time_entered_current_mode_ts', 0)
+    if time_in_mode >= check_interval:
+        # This is the corrected restoration check logic for SEN147w modes
+        check_for_restoration(MASTER_SOURCE_SSID, PRIMARY_REPEATER_SSID, check_interval)
+        if state['current_mode'] == MODE_ON_MISSHKAWIFI:
+            return # Switch to primary was successful
+        
+        # If still in master override mode after the timer, transition to acting primary
+        if mode == MODE_ON_SEN147W_MASTER_OVERRIDE:
+             state['current_mode'] = MODE_ON_SEN147W_ACTING_PRIMARY
+             logging.info("24h Master Override finished. Tenda_Misshka not restored. Transitioning to Acting Primary mode.")
+
+# --- Event Engine ---
+# wpa_supplicant events on an ATTACHed control socket and rtnetlink link and
+# address changes wake the main loop as soon as the connection drops, and end
+# the waits after select_network as soon as the connection is up.  The
+# handle_mode_on_* policy runs in a worker thread meanwhile.
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+IFF_LOWER_UP = 0x10000
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+CONNECTED_ID = re.compile(r'\[id=(\d+)')
+
+class FailoverEvents:
+    def __init__(self, loop, interface=WLAN_IFACE):
+        self.loop = loop
+        self.interface = interface
+        self.trigger = asyncio.Event()
+        self.condition = threading.Condition()
+        self.connections = 0
+        self.connected_id = None
+        self.addresses = 0
+        self.monitor = None
+        self.ponged = True
+        self.netlink = None
+        self.index = None
+
+    def start(self):
+        self.attach()
+        try:
+            self.netlink = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            self.netlink.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+            self.netlink.setblocking(False)
+            self.loop.add_reader(self.netlink.fileno(), self.read_netlink)
+        except OSError as e:
+            logging.warning(f"No rtnetlink events: {e}")
+            self.netlink = None
+        return self.loop.create_task(self.keepalive())
+
+    def attach(self):
+        self.detach()
+        monitor = WpaControl(self.interface)
+        try:
+            if monitor.request('ATTACH') != "OK\n":
+                raise OSError("ATTACH refused")
+        except OSError as e:
+            logging.warning(f"No wpa_supplicant events: {e}")
+            monitor.close()
+            return
+        monitor.sock.setblocking(False)
+        self.loop.add_reader(monitor.sock.fileno(), self.read_monitor)
+        self.monitor = monitor
+        self.ponged = True
+
+    def detach(self):
+        if self.monitor is not None:
+            self.loop.remove_reader(self.monitor.sock.fileno())
+            self.monitor.close()
+            self.monitor = None
+
+    async def keepalive(self):
+        # a wpa_supplicant that died without saying so doesn't answer
+        while True:
+            await asyncio.sleep(MONITOR_PING_INTERVAL)
+            if self.monitor is None or not self.ponged:
+                if self.monitor is not None:
+                    logging.warning("wpa_supplicant event socket went quiet, attaching again.")
+                self.attach()
+                continue
+            self.ponged = False
+            try:
+                self.monitor.sock.send(b'PING')
+            except OSError:
+                self.attach()
+
+    def read_monitor(self):
+        while True:
+            try:
+                message = self.monitor.sock.recv(65536).decode('utf-8', 'replace')
+            except BlockingIOError:
+                return
+            except OSError:
+                self.detach()
+                self.wake("wpa_supplicant event socket closed")
+                return
+            if message.startswith("PONG"):
+                self.ponged = True
+            elif "CTRL-EVENT-CONNECTED" in message:
+                match = CONNECTED_ID.search(message)
+                with self.condition:
+                    self.connections += 1
+                    self.connected_id = match.group(1) if match else None
+                    self.condition.notify_all()
+            elif "CTRL-EVENT-DISCONNECTED" in message:
+                self.wake("disconnected")
+            elif "CTRL-EVENT-TERMINATING" in message:
+                self.detach()
+                self.wake("wpa_supplicant terminating")
+                return
+
+    def read_netlink(self):
+        if self.index is None:
+            try:
+                self.index = socket.if_nametoindex(self.interface)
+            except OSError:
+                pass
+        while True:
+            try:
+                data = self.netlink.recv(65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind = NLMSGHDR.unpack_from(data, offset)[:2]
+                body = offset + NLMSGHDR.size
+                if kind in (RTM_NEWLINK, RTM_DELLINK) and body + IFINFOMSG.size <= len(data):
+                    index, flags = IFINFOMSG.unpack_from(data, body)[2:4]
+                    if index == self.index and (kind == RTM_DELLINK or not flags & IFF_LOWER_UP):
+                        self.wake("link down")
+                elif kind in (RTM_NEWADDR, RTM_DELADDR) and body + IFADDRMSG.size <= len(data):
+                    if IFADDRMSG.unpack_from(data, body)[4] == self.index:
+                        if kind == RTM_NEWADDR:
+                            with self.condition:
+                                self.addresses += 1
+                                self.condition.notify_all()
+                        else:
+                            self.wake("address removed")
+                offset += max(NLMSGHDR.size, (length + 3) & ~3)
+
+    def wake(self, reason):
+        if not self.trigger.is_set():
+            logging.info(f"Event: {reason}. Checking soon.")
+            self.trigger.set()
+
+    def connection_count(self):
+        with self.condition:
+            return self.connections
+
+    def wait_connected(self, since, network_id, timeout):
+        """Wait, from a worker thread, for a connection to network_id after the since'th one."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.connections > since and self.connected_id in (network_id, None), timeout)
+
+    def wait_address(self, timeout):
+        with self.condition:
+            since = self.addresses
+            return self.condition.wait_for(lambda: self.addresses > since, timeout)
+
+    async def wait(self, timeout):
+        """Until the next event, or timeout.  An event is given EVENT_SETTLE_TIME to settle."""
+        try:
+            await asyncio.wait_for(self.trigger.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+        await asyncio.sleep(EVENT_SETTLE_TIME)
+
+events = None
+
+def run_cycle():
+    """One pass of the policy; whether the Internet was reachable, None if wpa_supplicant wasn't."""
+    logging.info(f"--- Main Loop Cycle Start (Mode: {state.get('current_mode')}) ---")
+    if not ensure_wpa_supplicant_responsive():
+        return None
+
+    current_ssid = get_current_ssid()
+    internet_ok = check_internet()
+    if current_ssid in SSID_PREFERENCE:
+        sample_link(current_ssid, internet_ok)
+
+    mode_before = state.get('current_mode')
+
+    if state['current_mode'] == MODE_ON_MISSHKAWIFI:
+        handle_mode_on_misshkawifi(current_ssid, internet_ok)
+    elif state['current_mode'] == MODE_ON_MISSKATEL:
+        handle_mode_on_misshkatel(current_ssid, internet_ok)
+    elif state['current_mode'] == MODE_ON_SEN147W_MASTER_OVERRIDE:
+        handle_mode_on_sen147w(current_ssid, internet_ok, MODE_ON_SEN147W_MASTER_OVERRIDE, TIME_ON_MASTER_OVERRIDE_MODE_DURATION)
+    elif state['current_mode'] == MODE_ON_SEN147W_ACTING_PRIMARY:
+        handle_mode_on_sen147w(current_ssid, internet_ok, MODE_ON_SEN147W_ACTING_PRIMARY, CHECK_MISSHKAWIFI_FROM_ACTING_PRIMARY_INTERVAL)
+    else:
+        logging.error(f"Unknown mode: '{state.get('current_mode')}'. Resetting.")
+        state['current_mode'] = MODE_ON_MISSHKAWIFI
+
+    if mode_before != state.get('current_mode'):
+        logging.info(f"Mode changed from '{mode_before}' to '{state.get('current_mode')}'")
+        state['time_entered_current_mode_ts'] = get_timestamp()
+
+    current_connected_ssid = get_current_ssid()
+    logging.info(f"✅ Post-check: Connected SSID: {current_connected_ssid} | Mode: {state.get('current_mode')}")
+
+    save_state()
+    return internet_ok
+
+async def run_engine():
+    global events
+    loop = asyncio.get_running_loop()
+    events = FailoverEvents(loop)
+    keepalive = events.start()
+    try:
+        while True:
+            internet_ok = await loop.run_in_executor(None, run_cycle)
+            # events during the cycle were mostly of its own making
+            events.trigger.clear()
+            interval = CHECK_INTERVAL_SECONDS if internet_ok else FAILING_CHECK_INTERVAL_SECONDS
+            logging.info(f"--- Cycle End. Waiting up to {interval/60:.1f} mins for an event ---")
+            await events.wait(interval)
+    finally:
+        keepalive.cancel()
+
+def main():
+    initialize_logging()
+    logging.info("===== WiFi Failover Script Starting Up =====")
+    load_state()
+
+    for ssid in network_ids:
+        network_ids[ssid] = get_network_id_from_cli(WLAN_IFACE, ssid)
+        if not network_ids[ssid]:
+            logging.critical(f"CRITICAL FAILURE: Could not find required SSID '{ssid}'. Exiting.")
+            sys.exit(1)
+
+    if state.get('current_mode') is None:
+        for ssid in [PRIMARY_REPEATER_SSID, SECONDARY_BACKUP_SSID, MASTER_SOURCE_SSID]:
+            if retry_switch_to_network(ssid) and check_internet():
+                if ssid == PRIMARY_REPEATER_SSID: state['current_mode'] = MODE_ON_MISSHKAWIFI
+                elif ssid == SECONDARY_BACKUP_SSID: state['current_mode'] = MODE_ON_MISSKATEL
+                else: state['current_mode'] = MODE_ON_SEN147W_ACTING_PRIMARY
+                state['time_entered_current_mode_ts'] = get_timestamp()
+                break
+        else:
+            logging.warning("Failed to connect to any network. Defaulting to Primary mode.")
+            state['current_mode'] = MODE_ON_MISSHKAWIFI
+        save_state()
+
+    time.sleep(60)
+
+    asyncio.run(run_engine())
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,171 @@
 import collectd
-import math
+import glob
+import os
 import time
-import subprocess
+
+# Every file is opened once and re-read from the start with pread each
+# cycle.  Of each file only the lines we need are parsed: the line number a
+# key was found on is remembered and only searched for again if the key
+# moved.  Files that don't exist here (no PSI before Linux 4.20, no thermal
+# zones in a VM, no firmware throttle flags off a Raspberry Pi) are skipped.
+
+MEMINFO_KEYS = (b'MemTotal:', b'MemFree:', b'Buffers:', b'Cached:', b'SReclaimable:', b'Shmem:')
+STAT_KEYS = (b'ctxt ', b'procs_running ', b'procs_blocked ', b'softirq ')
+SOFTIRQS = ('hi', 'timer', 'net_tx', 'net_rx', 'block', 'irq_poll', 'tasklet', 'sched', 'hrtimer', 'rcu')
+PSI_RESOURCES = ('cpu', 'memory', 'io')
+PI_THROTTLED = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+X86_THROTTLE = '/sys/devices/system/cpu/cpu0/thermal_throttle/package_throttle_count'
+
+if hasattr(os, 'pread'):
+    pread = os.pread
+else:
+    def pread(fd, size, offset):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+class ProcFile(object):
+    def __init__(self, path, keys=()):
+        self.path = path
+        self.keys = keys
+        self.lines = {}
+        self.size = 4096
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        while True:
+            contents = pread(self.fd, self.size, 0)
+            # procfs hands out what fits, read again with room to spare
+            if len(contents) < self.size:
+                return contents
+            self.size *= 2
+
+    def fields(self):
+        """{key: [words after the key]} for each of self.keys found in the file."""
+        lines = self.read().split(b'\n')
+        result = {}
+        for key in self.keys:
+            i = self.lines.get(key)
+            if i is None or i >= len(lines) or not lines[i].startswith(key):
+                i = self.lines[key] = next((n for n, line in enumerate(lines) if line.startswith(key)), None)
+                if i is None:
+                    del self.lines[key]
+                    continue
+            result[key] = lines[i][len(key):].split()
+        return result
+
+def open_optional(path, keys=()):
+    try:
+        return ProcFile(path, keys)
+    except (IOError, OSError):
+        return None
+
+class Sampler(object):
+    def __init__(self, root=''):
+        # root is prefixed to every path, the tests use a fake /proc and /sys
+        self.meminfo = ProcFile(root + '/proc/meminfo', MEMINFO_KEYS)
+        self.stat = ProcFile(root + '/proc/stat', STAT_KEYS)
+        self.pressure = [(name, f) for name, f in
+                         ((name, open_optional(root + '/proc/pressure/' + name)) for name in PSI_RESOURCES)
+                         if f is not None]
+        self.thermal = []
+        names = set()
+        for zone in sorted(glob.glob(root + '/sys/class/thermal/thermal_zone*')):
+            f = open_optional(zone + '/temp')
+            if f is None:
+                continue
+            try:
+                with open(zone + '/type') as t:
+                    name = t.read().strip()
+            except (IOError, OSError):
+                name = os.path.basename(zone)
+            if name in names:
+                name += '-' + os.path.basename(zone)[len('thermal_zone'):]
+            names.add(name)
+            self.thermal.append((name, f))
+        self.pi_throttled = open_optional(root + PI_THROTTLED)
+        self.x86_throttle = open_optional(root + X86_THROTTLE)
+
+    def sample(self):
+        """Everything as a list of (type, type_instance, values)."""
+        values = []
+
+        data = dict((key, int(words[0])) for key, words in self.meminfo.fields().items())
+        # getting some useful figures as described here https://stackoverflow.com/a/41251290
+        # calculation like htop
+        total = 1024 * data[b'MemTotal:']
+        free = 1024 * data[b'MemFree:']
+        buffers = 1024 * data[b'Buffers:']
+        cached = 1024 * (data[b'Cached:'] + data[b'SReclaimable:'] - data[b'Shmem:'])
+        used = total - free - buffers - cached
+        values += [('memory', 'used', [used]),
+                   ('memory', 'buffers', [buffers]),
+                   ('memory', 'cached', [cached]),
+                   ('memory', 'free', [free])]
+
+        data = self.stat.fields()
+        if b'ctxt ' in data:
+            values.append(('contextswitch', '', [int(data[b'ctxt '][0])]))
+        for key, state in ((b'procs_running ', 'running'), (b'procs_blocked ', 'blocked')):
+            if key in data:
+                values.append(('ps_state', state, [int(data[key][0])]))
+        if b'softirq ' in data:
+            # the first number is the sum of the others
+            for name, count in zip(SOFTIRQS, data[b'softirq '][1:]):
+                values.append(('irq', 'softirq-' + name, [int(count)]))
+
+        for name, f in self.pressure:
+            # "some avg10=0.00 avg60=0.00 avg300=0.00 total=123", "full ..." since Linux 5.13 for cpu
+            totals = [int(line.rsplit(b'total=', 1)[1]) for line in f.read().split(b'\n') if b'total=' in line]
+            values.append(('system_psi', name, (totals + [0, 0])[:2]))
+
+        for name, f in self.thermal:
+            try:
+                values.append(('temperature', name, [int(f.read()) / 1000.0]))
+            except (IOError, OSError, ValueError):
+                # zones of sleeping devices refuse to be read
+                pass
+
+        # like the thermal zones, a failed read only loses its own value
+        if self.pi_throttled is not None:
+            try:
+                flags = int(self.pi_throttled.read(), 16)
+            except (IOError, OSError, ValueError):
+                pass
+            else:
+                values.append(('system_throttled', '', [flags & 1, flags >> 1 & 1, flags >> 2 & 1, flags >> 3 & 1]))
+        if self.x86_throttle is not None:
+            try:
+                values.append(('derive', 'thermal_throttle', [int(self.x86_throttle.read())]))
+            except (IOError, OSError, ValueError):
+                pass
+
+        return values
 
 def handle_config(root):
+    try:
+        sampler = Sampler()
+    except (IOError, OSError) as error:
+        collectd.warning('system_stats: %s' % error)
+        return
 
-    collectd.register_read(callback=handle_read, name='system_stats')
+    collectd.register_read(callback=handle_read, data=sampler, name='system_stats')
 
 V=collectd.Values(plugin='system_stats', time=0)
 
 
-def handle_read():
-
+def handle_read(sampler):
     try:
-        f=open("/proc/meminfo", "r")
-        contents=f.read()
-    except:
-        collectd.warning(sys.exc_info()[0])
+        values = sampler.sample()
+    except (IOError, OSError, KeyError, ValueError) as error:
+        collectd.warning('system_stats: %s' % error)
         return
 
-    data = {}
-    for line in contents.split('\n'):
-        words = line.split()
-        if len(words) > 1 :
-            data[words[0].split(':')[0]] =  words[1]
-
-    # getting some useful figures as described here https://stackoverflow.com/a/41251290
-    # calculation like htop
-
-    total = 1024 * int(data['MemTotal'])
-    free = 1024 * int(data['MemFree'])
-    buffers = 1024 * int(data['Buffers'])
-    cached = 1024 * (int(data['Cached']) + int(data['SReclaimable']) - int(data['Shmem']))
-    used = total - free - buffers - cached
-
-    V.dispatch(type='memory',
-               type_instance='used',
-               time=time.time(),
-               values = [used])
-    V.dispatch(type='memory',
-               type_instance='buffers',
-               time=time.time(),
-               values = [buffers])
-    V.dispatch(type='memory',
-               type_instance='cached',
-               time=time.time(),
-               values = [cached])
-    V.dispatch(type='memory',
-               type_instance='free',
-               time=time.time(),
-               values = [free])
+    now = time.time()
+    for type, type_instance, v in values:
+        V.dispatch(type=type,
+                   type_instance=type_instance,
+                   time=now,
+                   values=v)
 
     return
 
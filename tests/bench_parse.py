@@ -0,0 +1,54 @@
+"""Time and peak Python heap of parsing aircraft.json files.
+
+    python tests/bench_parse.py
+
+json.load followed by aircraft_table() is what the file:// path did before
+parse_aircraft_file(); both end with the same AircraftTable.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dump1090
+from fixtures import aircraft_json
+
+SIZES = (100, 1000, 5000)
+
+def json_load(path):
+    with open(path) as f:
+        aircraft_data = json.load(f)
+    aircraft_data['table'] = dump1090.aircraft_table(aircraft_data.pop('aircraft'))
+    return aircraft_data
+
+def measure(parse, path):
+    elapsed = min(timeit.repeat(lambda: parse(path), number=5, repeat=5)) / 5 * 1e3
+    tracemalloc.start()
+    parse(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1024.0
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        print('%8s %10s %22s %22s' % ('aircraft', 'file KiB', 'json.load ms / KiB', 'projecting ms / KiB'))
+        for n in SIZES:
+            path = os.path.join(directory, 'aircraft.json')
+            with open(path, 'w') as f:
+                json.dump(aircraft_json(n), f)
+            old = measure(json_load, path)
+            new = measure(dump1090.parse_aircraft_file, path)
+            print('%8d %10.0f %10.2f / %9.0f %10.2f / %9.0f' % (n, os.path.getsize(path) / 1024.0,
+                  old[0], old[1], new[0], new[1]))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Time the ways quantiles() can get at its order statistics.
+
+    python tests/bench_quantiles.py
+
+For Python lists (what the reducer loop produces) and numpy arrays (what
+the numpy reducer produces): sorted(), numpy.sort and select_ranks, the
+partitioning selection.  SORT_NUMPY_MIN sits where numpy.sort overtakes
+sorted() on lists, SELECT_MIN where select_ranks overtakes numpy.sort.
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dump1090
+
+numpy = dump1090.numpy
+
+SIZES = (10, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000)
+
+def ranks(n):
+    wanted = set()
+    for p in dump1090.QUARTILES:
+        x = int(p * (n - 1))
+        wanted.add(x)
+        if x + 1 < n:
+            wanted.add(x + 1)
+    return sorted(wanted)
+
+def best(f, number):
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+def main():
+    if numpy is None:
+        print('numpy is not installed, quantiles() always uses sorted()')
+        return
+    print('%8s %12s %12s %12s %12s %12s' % ('values', 'list sorted', 'list sort', 'list select',
+                                           'array sort', 'array select'))
+    for n in SIZES:
+        values = [random.random() for _ in range(n)]
+        arr = numpy.array(values)
+        wanted = ranks(n)
+        number = max(3, 300000 // n)
+        print('%8d %12.1f %12.1f %12.1f %12.1f %12.1f' % (n,
+              best(lambda: sorted(values), number),
+              best(lambda: numpy.sort(numpy.asarray(values, dtype=numpy.float64)), number),
+              best(lambda: dump1090.select_ranks(numpy.array(values, dtype=numpy.float64), wanted), number),
+              best(lambda: numpy.sort(arr), number),
+              best(lambda: dump1090.select_ranks(numpy.array(arr, dtype=numpy.float64), wanted), number)))
+    print('microseconds, best of 5')
+
+if __name__ == '__main__':
+    main()
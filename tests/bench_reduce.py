@@ -0,0 +1,76 @@
+"""Time the aircraft reducer against the loops it replaced.
+
+    python tests/bench_reduce.py
+
+Per snapshot size: the two loops read_1090 ran over the aircraft.json dicts
+before the shared reducer, building the AircraftTable, and reduce_aircraft
+over the table with the plain loop and with numpy.  REDUCE_NUMPY_MIN should
+sit where the numpy column overtakes the loop one.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dump1090
+from fixtures import RECEIVER, aircraft_json
+
+SIZES = (10, 30, 100, 300, 1000, 5000, 10000)
+
+def baseline(aircraft, rlat, rlon):
+    """The signal and range loops of read_1090 before the reducer, sorting included."""
+    signals = []
+    for a in aircraft:
+        if 'rssi' in a and a['messages'] > 4 and a['seen'] < 30:
+            rssi = a['rssi']
+            source = a.get('type', "")
+            if rssi > -49.4 and not source.startswith('tisb') and not source.startswith('adsr'):
+                signals.append(rssi)
+    signals.sort()
+    total = with_pos = mlat = tisb = gps = 0
+    ranges = []
+    for a in aircraft:
+        if a['seen'] < 60: total += 1
+        if 'seen_pos' in a and a['seen_pos'] < 60:
+            with_pos += 1
+            distance = dump1090.greatcircle(rlat, rlon, a['lat'], a['lon'])
+            if 'lat' in a.get('mlat', ()):
+                mlat += 1
+            elif 'lat' in a.get('tisb', ()):
+                tisb += 1
+            else:
+                gps += 1
+                ranges.append(distance)
+    ranges.sort()
+    return [dump1090.perc(p, values) for values in (ranges, signals) if values for p in dump1090.QUARTILES]
+
+def best(f, number):
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e3
+
+def main():
+    rlat, rlon = RECEIVER['lat'], RECEIVER['lon']
+    numpy = dump1090.numpy
+    print('%8s %12s %12s %12s %12s' % ('aircraft', 'baseline ms', 'table ms', 'loop ms', 'numpy ms'))
+    for n in SIZES:
+        aircraft = aircraft_json(n)['aircraft']
+        table = dump1090.aircraft_table(aircraft)
+        number = max(5, 20000 // n)
+        saved = dump1090.REDUCE_NUMPY_MIN
+        dump1090.REDUCE_NUMPY_MIN = float('inf')
+        try:
+            loop = best(lambda: dump1090.reduce_aircraft(table, rlat, rlon), number)
+        finally:
+            dump1090.REDUCE_NUMPY_MIN = saved
+        if numpy is not None:
+            vectorized = '%12.3f' % best(lambda: dump1090.reduce_aircraft_numpy(table, rlat, rlon, False), number)
+        else:
+            vectorized = '%12s' % '-'
+        print('%8d %12.3f %12.3f %12.3f %s' % (n,
+              best(lambda: baseline(aircraft, rlat, rlon), number),
+              best(lambda: dump1090.aircraft_table(aircraft), number),
+              loop, vectorized))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Stand-in for the module collectd's python plugin provides, recording what is dispatched."""
+
+dispatched = []
+logged = []
+configs = []
+reads = []
+inits = []
+shutdowns = []
+
+class Values(object):
+    def __init__(self, **kwargs):
+        self.host = ''
+        self.plugin = ''
+        self.plugin_instance = ''
+        self.type = ''
+        self.type_instance = ''
+        self.time = 0
+        self.interval = 0
+        self.values = []
+        self.meta = {}
+        self.__dict__.update(kwargs)
+
+    def dispatch(self, **kwargs):
+        value = Values(**self.__dict__)
+        value.__dict__.update(kwargs)
+        dispatched.append(value)
+
+class Config(object):
+    def __init__(self, key, values=(), children=()):
+        self.key = key
+        self.values = tuple(values)
+        self.children = tuple(children)
+
+def _log(level):
+    def log(message):
+        logged.append((level, message))
+    return log
+
+debug = _log('debug')
+info = _log('info')
+notice = _log('notice')
+warning = _log('warning')
+error = _log('error')
+
+def register_config(callback, data=None, name=None):
+    configs.append((callback, data, name))
+
+def register_read(callback, interval=None, data=None, name=None):
+    reads.append((callback, interval, data, name))
+
+def register_init(callback, data=None, name=None):
+    inits.append(callback)
+
+def register_shutdown(callback, data=None, name=None):
+    shutdowns.append(callback)
+
+def reset():
+    for registry in (dispatched, logged, reads, inits, shutdowns):
+        del registry[:]
+
+def values(type=None, type_instance=None):
+    """The dispatched values, optionally only those of one type / type_instance."""
+    return [v for v in dispatched
+            if (type is None or v.type == type) and (type_instance is None or v.type_instance == type_instance)]
@@ -0,0 +1,111 @@
+"""Write the aircraft.json / aircraft.binCraft / aircraft.binCraft.zst set.
+
+This is not a readsb capture: the records are laid out by hand after readsb's
+struct binCraft as tar1090 reads it, and every byte the decoder should not
+look at is filled with FILL so that a wrong offset reads garbage.
+The .zst file is a zstd frame of raw, uncompressed blocks.  Replace the set
+with a capture of a live readsb when one is at hand, aircraft.json and
+aircraft.binCraft written in the same second.
+
+    python tests/data/make_bincraft.py
+"""
+import json
+import math
+import os
+import random
+import struct
+
+NOW = 1700000000.4
+MESSAGES = 123456789
+RECEIVER = (52.1, 13.2)
+VERSION = 20240218
+STRIDE = 112
+FILL = 0xa5
+
+# readsb's addrtype enum
+TYPES = ('adsb_icao', 'adsb_icao_nt', 'adsr_icao', 'tisb_icao', 'adsc', 'mlat', 'other', 'mode_s',
+         'adsb_other', 'adsr_other', 'tisb_trackfile', 'tisb_other', 'mode_ac', 'unknown')
+# address types that readsb writes with a '~' address
+NON_ICAO = ('adsb_other', 'adsr_other', 'tisb_trackfile', 'tisb_other')
+
+
+def aircraft(n, seed=13):
+    rng = random.Random(seed)
+    result = []
+    for i in range(n):
+        t = TYPES[i % len(TYPES)]
+        a = {'hex': ('~%06x' if t in NON_ICAO else '%06x') % (0x3c0000 + 37 * i), 'type': t}
+        if i % 3:
+            a['alt_baro'] = rng.choice(['ground', rng.randrange(0, 40000, 25)])
+        # readsb prints seen and seen_pos with one decimal, positions with six
+        # mean signal level, aircraft.json has it in dBFS and binCraft its root in a byte
+        level = rng.uniform(10 ** -3, 0.5)
+        signal = int(round(level ** 0.5 * 255))
+        if i % 7:
+            a['mlat'] = ['lat', 'lon', 'track', 'gs'] if t == 'mlat' else []
+            a['tisb'] = ['lat', 'lon'] if t.startswith('tisb') else []
+            a['seen_pos'] = round(rng.uniform(0, 60), 1)
+            a['lat'] = round(RECEIVER[0] + rng.uniform(-3, 3), 6)
+            a['lon'] = round(RECEIVER[1] + rng.uniform(-5, 5), 6)
+        else:
+            a['mlat'] = []
+            a['tisb'] = []
+        a['messages'] = rng.randrange(0, 65536)
+        a['seen'] = round(rng.uniform(0, 60), 1)
+        a['rssi'] = round(10 * math.log10(level), 1)
+        a['_signal'] = signal
+        result.append(a)
+    return result
+
+
+def record(a):
+    body = bytearray([FILL]) * STRIDE
+    addr = int(a['hex'].lstrip('~'), 16) | (1 << 24 if a['hex'][0] == '~' else 0)
+    struct.pack_into('<I', body, 0, addr)
+    struct.pack_into('<i', body, 4, int(round(a.get('seen_pos', 0) * 10)))
+    struct.pack_into('<i', body, 8, int(round(a['seen'] * 10)))
+    struct.pack_into('<i', body, 12, int(round(a.get('lon', 0) * 1e6)))
+    struct.pack_into('<i', body, 16, int(round(a.get('lat', 0) * 1e6)))
+    alt = a.get('alt_baro', 0)
+    struct.pack_into('<h', body, 24, 0 if alt == 'ground' else alt // 25)
+    struct.pack_into('<H', body, 66, a['messages'])
+    # emergency in the low nibble, left at FILL's
+    body[71] = TYPES.index(a['type']) << 4 | FILL & 0x0f
+    body[105] = a['_signal']
+    return bytes(body)
+
+
+def header(count_with_pos):
+    now_ms = int(round(NOW * 1000))
+    head = struct.pack('<IIIIIIIIiiI', now_ms & 0xffffffff, now_ms >> 32, STRIDE, count_with_pos, 0, 0, 0,
+                       MESSAGES, int(RECEIVER[0] * 1e6), int(RECEIVER[1] * 1e6), VERSION)
+    return head + b'\0' * (STRIDE - len(head))
+
+
+def zstd_raw(data):
+    # magic, single segment with a 4 byte content size, raw blocks of at most 128 KiB
+    frame = struct.pack('<IBI', 0xfd2fb528, 0xa0, len(data))
+    blocks = [data[i:i + 131072] for i in range(0, len(data), 131072)] or [b'']
+    for i, block in enumerate(blocks):
+        frame += struct.pack('<I', len(block) << 3 | (i == len(blocks) - 1))[:3] + block
+    return frame
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    planes = aircraft(40)
+    binary = header(sum('lat' in a for a in planes)) + b''.join(record(a) for a in planes)
+    for a in planes:
+        del a['_signal']
+    with open(os.path.join(here, 'aircraft.json'), 'w') as f:
+        f.write('{ "now" : %.1f,\n  "messages" : %d,\n  "aircraft" : [\n' % (NOW, MESSAGES))
+        f.write(',\n'.join(json.dumps(a) for a in planes))
+        f.write('\n  ]\n}\n')
+    with open(os.path.join(here, 'aircraft.binCraft'), 'wb') as f:
+        f.write(binary)
+    with open(os.path.join(here, 'aircraft.binCraft.zst'), 'wb') as f:
+        f.write(zstd_raw(binary))
+
+
+if __name__ == '__main__':
+    main()
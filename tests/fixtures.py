@@ -0,0 +1,40 @@
+"""Synthetic decoder documents for the tests and benchmarks."""
+import random
+
+NOW = 1700000000.0
+RECEIVER = {'lat': 52.1, 'lon': 13.2, 'version': 'test', 'refresh': 1000}
+
+def aircraft_json(n, seed=1):
+    """An aircraft.json document with n aircraft around RECEIVER."""
+    rng = random.Random(seed)
+    aircraft = []
+    for i in range(n):
+        a = {'hex': '%06x' % (0x3c0000 + i), 'seen': rng.uniform(0, 90), 'messages': rng.randint(0, 3000),
+             'alt_baro': rng.choice(['ground', rng.randint(0, 40000)]), 'flight': 'TEST%d' % i,
+             'category': 'A3', 'nav_qnh': 1013.2, 'mlat': [], 'tisb': []}
+        # the fields readsb writes besides those graphs1090 reads
+        a.update({'alt_geom': rng.randint(0, 40000), 'gs': round(rng.uniform(0, 500), 1),
+                  'track': round(rng.uniform(0, 360), 2), 'baro_rate': rng.randint(-3000, 3000),
+                  'squawk': '%04o' % rng.randint(0, 4095), 'emergency': 'none', 'nav_altitude_mcp': 36000,
+                  'nav_heading': 90.0, 'nic': 8, 'rc': 186, 'version': 2, 'nic_baro': 1, 'nac_p': 9, 'nac_v': 1,
+                  'sil': 3, 'sil_type': 'perhour', 'gva': 2, 'sda': 2, 'alert': 0, 'spi': 0,
+                  'r_dst': round(rng.uniform(0, 300), 3), 'r_dir': round(rng.uniform(0, 360), 1)})
+        if i % 97 == 0:
+            a['hex'] = '~%06x' % i
+        if rng.random() < 0.9:
+            a['rssi'] = rng.uniform(-50, 1)
+        a['type'] = rng.choice(['adsb_icao', 'adsb_icao', 'mlat', 'tisb_icao', 'adsr_icao', 'mode_s'])
+        if rng.random() < 0.8:
+            a['seen_pos'] = rng.uniform(0, 90)
+            a['lat'] = RECEIVER['lat'] + rng.uniform(-3, 3)
+            a['lon'] = RECEIVER['lon'] + rng.uniform(-5, 5)
+            r = rng.random()
+            if r < 0.15:
+                a['mlat'] = ['lat', 'lon']
+            elif r < 0.25:
+                a['tisb'] = ['lat', 'lon']
+        elif rng.random() < 0.5:
+            a['lastPosition'] = {'lat': RECEIVER['lat'] + 1, 'lon': RECEIVER['lon'] + 1, 'nic': 8, 'rc': 186,
+                                 'seen_pos': rng.uniform(60, 300)}
+        aircraft.append(a)
+    return {'now': NOW, 'messages': 123456, 'aircraft': aircraft}
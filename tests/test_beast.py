@@ -0,0 +1,135 @@
+import random
+import socket
+import threading
+import time
+
+import collectd
+import dump1090
+
+
+def escape(data):
+    return bytes(data).replace(b'\x1a', b'\x1a\x1a')
+
+
+def frame(kind, payload, signal, timestamp=0x1a00001a1a00):
+    header = timestamp.to_bytes(6, 'big') + bytes([signal])
+    return b'\x1a' + bytes([kind]) + escape(header + bytes(payload))
+
+
+def df17(icao):
+    return [17 << 3 | 5] + list(icao.to_bytes(3, 'big')) + [0x1a] * 10
+
+
+def df11(icao):
+    return [11 << 3] + list(icao.to_bytes(3, 'big')) + [0x1a, 0, 0]
+
+
+def df4():
+    return [4 << 3, 0x1a, 0x1a, 0, 0, 0, 0]
+
+
+# a status frame of a type the collector does not know, with an escaped 0x1a
+# right before 0x32: the pair must not start a Mode S short frame
+STATUS = b'\x1a\x34' + escape(b'\x00\x1a\x32\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# a recorded-like stream: DF17 and DF11 from two aircraft, one of them
+# 0x1a1a1a, a DF4, a Mode A/C reply, status frames and leading garbage
+STREAM = (b'\x00\x1a\x1a\x1a\x1a' + STATUS
+          + frame(0x33, df17(0x1a1a1a), 0x1a) * 3
+          + frame(0x33, df17(0x3c6586), 200)
+          + STATUS
+          + frame(0x32, df11(0x3c6586), 100) * 2
+          + frame(0x32, df4(), 26)
+          + frame(0x31, [0x1a, 0x00], 50)
+          + STATUS)
+
+
+def expected_counts(repeat):
+    df_counts = [0] * 25
+    df_counts[17] = 4 * repeat
+    df_counts[11] = 2 * repeat
+    df_counts[4] = 1 * repeat
+    signals = [0] * 256
+    signals[0x1a] = 4 * repeat
+    signals[200] = repeat
+    signals[100] = 2 * repeat
+    signals[50] = repeat
+    return df_counts, {0x1a1a1a: 3 * repeat, 0x3c6586: 3 * repeat}, signals
+
+
+def parse(data):
+    collector = dump1090.BeastCollector('test.beast', 'localhost', 0)
+    collector.buf[:len(data)] = data
+    return collector, collector.parse(len(data))
+
+
+def test_parse():
+    collector, done = parse(STREAM)
+    assert done == len(STREAM)
+    df_counts, icao_counts, signals = expected_counts(1)
+    assert collector.messages == 8
+    assert collector.df_counts == df_counts
+    assert collector.icao_counts == icao_counts
+    assert collector.signal_counts == signals
+
+
+def test_parse_stops_at_partial_frame():
+    for cut in range(1, len(STREAM)):
+        collector, done = parse(STREAM[:cut])
+        rest, end = parse(STREAM[done:])
+        assert end == len(STREAM) - done
+        assert collector.messages + rest.messages == 8, cut
+
+
+class Replay(object):
+    """Serves data to one client in random sized pieces."""
+
+    def __init__(self, data, seed=5):
+        self.data = data
+        self.rng = random.Random(seed)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        conn, _ = self.server.accept()
+        with conn:
+            pos = 0
+            while pos < len(self.data):
+                n = self.rng.randint(1, 64)
+                conn.sendall(self.data[pos:pos + n])
+                pos += n
+                # let each piece arrive as a read of its own
+                time.sleep(0.0005)
+            # keep the connection open until the collector stops
+            conn.recv(1)
+
+    def close(self):
+        self.server.close()
+
+
+def test_replay():
+    repeat = 50
+    replay = Replay(STREAM * repeat)
+    collector = dump1090.BeastCollector('test.beast', '127.0.0.1', replay.port)
+    collectd.reset()
+    collector.start()
+    try:
+        deadline = time.time() + 10
+        while collector.messages < 8 * repeat and time.time() < deadline:
+            time.sleep(0.01)
+        doc = collector.collect()
+    finally:
+        collector.stop()
+        replay.close()
+
+    df_counts, icao_counts, signals = expected_counts(repeat)
+    assert doc['messages'] == 8 * repeat
+    assert doc['df_counts'] == df_counts
+    assert doc['icao_counts'] == icao_counts
+    assert doc['aircraft'] == 2
+    assert doc['signals'] == dump1090.histogram_quartiles(signals, dump1090.BEAST_DBFS)
@@ -0,0 +1,70 @@
+"""binCraft against the aircraft.json of the same aircraft, see data/make_bincraft.py."""
+import math
+import os
+
+import pytest
+
+import dump1090
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def read(name):
+    with open(os.path.join(DATA, name), 'rb') as f:
+        return f.read()
+
+
+@pytest.fixture(params=['numpy', 'struct'])
+def decode(request, monkeypatch):
+    if request.param == 'numpy':
+        if dump1090.numpy is None:
+            pytest.skip('no numpy')
+    else:
+        monkeypatch.setattr(dump1090, 'numpy', None)
+    return dump1090.decode_bincraft
+
+
+def check(table, expected):
+    assert len(table) == len(expected) == 40
+    for column in ('seen', 'seen_pos', 'lat', 'lon', 'messages', 'source', 'flags', 'addr'):
+        assert list(getattr(table, column)) == pytest.approx(list(getattr(expected, column)), abs=1e-9), column
+    for got, want in zip(table.rssi, expected.rssi):
+        # binCraft keeps the root of the level in a byte, 0.5 dB at -30 dBFS
+        assert abs(got - want) < 0.6
+
+
+def test_bincraft_matches_json(decode):
+    expected = dump1090.parse_aircraft_file(os.path.join(DATA, 'aircraft.json'))
+    doc = decode(read('aircraft.binCraft'))
+    assert doc['now'] == pytest.approx(expected['now'])
+    assert doc['messages'] == expected['messages']
+    check(doc['table'], expected['table'])
+
+
+def test_reduced_bincraft_matches_json(decode):
+    expected = dump1090.reduce_aircraft(dump1090.parse_aircraft_file(os.path.join(DATA, 'aircraft.json'))['table'],
+                                        52.1, 13.2)
+    reduced = dump1090.reduce_aircraft(decode(read('aircraft.binCraft'))['table'], 52.1, 13.2)
+    for key, value in expected.items():
+        if key.startswith('signal') or key == 'peak_signal':
+            continue
+        assert reduced[key] == pytest.approx(value), key
+
+
+def test_zstd():
+    if dump1090.zstd_decompress is None:
+        pytest.skip('no zstd module')
+    doc = dump1090.load_bincraft('file://' + os.path.join(DATA, 'aircraft.binCraft.zst'), 5)
+    check(doc['table'], dump1090.decode_bincraft(read('aircraft.binCraft'))['table'])
+
+
+def test_load_aircraft_reads_bincraft():
+    doc = dump1090.load_aircraft('file://' + os.path.join(DATA, 'aircraft.binCraft'), 5)
+    assert 'table' in doc and len(doc['table']) == 40
+
+
+def test_old_version_is_rejected():
+    body = bytearray(read('aircraft.binCraft'))
+    body[40:44] = b'\0\0\0\0'
+    with pytest.raises(ValueError):
+        dump1090.decode_bincraft(bytes(body))
@@ -0,0 +1,92 @@
+import functools
+import json
+import threading
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+import collectd
+import dump1090
+from fixtures import RECEIVER, aircraft_json
+
+
+class Quiet(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    data = tmp_path / 'data'
+    data.mkdir()
+    (data / 'receiver.json').write_text(json.dumps(RECEIVER))
+    (data / 'stats.json').write_text(json.dumps({'last1min': {}}))
+    (data / 'aircraft.json').write_text(json.dumps(aircraft_json(10)))
+
+    httpd = HTTPServer(('127.0.0.1', 0), functools.partial(Quiet, directory=str(tmp_path)))
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    collectd.reset()
+    dump1090.breakers.clear()
+    dump1090.json_cache.evict()
+    url = 'http://127.0.0.1:%d' % httpd.server_address[1]
+    yield httpd, url
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def fetch(url):
+    sources = {
+        'stats': url + '/data/stats.json',
+        'receiver': url + '/data/receiver.json',
+        'aircraft': url + '/data/aircraft.json',
+    }
+    return dump1090.fetch_sources(sources, cached=('receiver',), aircraft=('aircraft',))
+
+
+def source_up(url):
+    collectd.reset()
+    dump1090.dispatch_source_up(('test', '', url), url + '/data/aircraft.json', 'source_up')
+    return collectd.values(type_instance='source_up')[-1].values[0]
+
+
+def test_breaker_opens_while_receiver_json_is_cached(server):
+    httpd, url = server
+    results, errors, timings = fetch(url)
+    assert sorted(results) == ['aircraft', 'receiver', 'stats']
+    assert source_up(url) == 1
+
+    httpd.shutdown()
+    httpd.server_close()
+    for i in range(dump1090.BREAKER_FAILURES):
+        results, errors, timings = fetch(url)
+        # receiver.json still comes from the cache
+        assert list(results) == ['receiver']
+        assert 'stats' in errors
+
+    assert dump1090.breaker(url + '/data/stats.json').state == dump1090.OPEN
+    assert source_up(url) == 0
+
+    results, errors, timings = fetch(url)
+    assert all(isinstance(error, dump1090.CircuitOpen) for error in errors.values())
+
+
+def test_half_open_probes_with_a_real_request(server):
+    httpd, url = server
+    fetch(url)
+    httpd.shutdown()
+    httpd.server_close()
+    for i in range(dump1090.BREAKER_FAILURES):
+        fetch(url)
+
+    b = dump1090.breaker(url + '/data/stats.json')
+    b.retry_at = 0
+    results, errors, timings = fetch(url)
+    # the probe is stats.json, not the cached receiver.json
+    assert sorted(errors) == ['aircraft', 'receiver', 'stats']
+    assert [name for name, error in errors.items()
+            if not isinstance(error, dump1090.CircuitOpen)] == ['stats']
+    assert b.state == dump1090.OPEN
+    assert source_up(url) == 0
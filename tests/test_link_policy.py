@@ -0,0 +1,123 @@
+import copy
+import socket
+
+import pytest
+
+NOW = 1700000000.0
+
+
+@pytest.fixture
+def policy(wifi, monkeypatch):
+    """wifi-failover on the Primary Repeater with a fake clock, radio and switch."""
+    clock = [NOW]
+    switches = []
+    radio = {'signal_poll': 'RSSI=-85\nLINKSPEED=6\nNOISE=9999\nFREQUENCY=2412'}
+    monkeypatch.setattr(wifi, 'state', copy.deepcopy(wifi.DEFAULT_STATE))
+    wifi.state['current_mode'] = wifi.MODE_ON_MISSHKAWIFI
+    monkeypatch.setattr(wifi, 'get_timestamp', lambda: clock[0])
+    monkeypatch.setattr(wifi, 'wpa_request', lambda command, interface=None: radio['signal_poll'])
+    monkeypatch.setattr(wifi, 'read_proc_wireless', lambda interface=None: {})
+    monkeypatch.setattr(wifi, 'internet_rtt', 0.2)
+    monkeypatch.setattr(wifi, 'retry_switch_to_network', lambda ssid: switches.append(ssid) or True)
+    monkeypatch.setattr(wifi, 'THROUGHPUT_SINK', None)
+    return clock, switches, radio
+
+
+def cycle(wifi, clock, internet_ok, ssid=None):
+    """run_cycle's sampling and the Primary mode policy, then the wait until the next cycle."""
+    ssid = ssid or wifi.PRIMARY_REPEATER_SSID
+    wifi.sample_link(ssid, internet_ok)
+    wifi.handle_mode_on_misshkawifi(ssid, internet_ok)
+    clock[0] += wifi.CHECK_INTERVAL_SECONDS if internet_ok else wifi.FAILING_CHECK_INTERVAL_SECONDS
+
+
+def test_weak_but_working_primary_is_kept(wifi, policy):
+    clock, switches, radio = policy
+    # a backup sample from hours ago that scored well
+    wifi.state['link_quality'][wifi.SECONDARY_BACKUP_SSID] = {
+        'ts': NOW - 5 * 3600, 'internet_ok': True, 'score': 1.0, 'bad_samples': 0,
+        'upload_kbps': 5000, 'upload_ts': NOW - 5 * 3600}
+    for i in range(10):
+        cycle(wifi, clock, True)
+    assert wifi.link_score(wifi.PRIMARY_REPEATER_SSID) < wifi.SCORE_SWITCH_BELOW
+    assert wifi.link_sample(wifi.SECONDARY_BACKUP_SSID) is None
+    assert switches == []
+
+
+def test_single_failed_check_does_not_switch(wifi, policy):
+    clock, switches, radio = policy
+    cycle(wifi, clock, True)
+    for i in range(wifi.SCORE_SWITCH_AFTER - 1):
+        cycle(wifi, clock, False)
+    cycle(wifi, clock, True)
+    cycle(wifi, clock, False)
+    assert switches == []
+    for i in range(wifi.SCORE_SWITCH_AFTER - 1):
+        cycle(wifi, clock, False)
+    assert switches == [wifi.SECONDARY_BACKUP_SSID]
+
+
+def test_measured_low_score_switches_after_hysteresis(wifi, policy, monkeypatch):
+    clock, switches, radio = policy
+    monkeypatch.setattr(wifi, 'THROUGHPUT_SINK', ('127.0.0.1', 9))
+    monkeypatch.setattr(wifi, 'probe_upload', lambda sink: 50.0)
+    for i in range(wifi.SCORE_SWITCH_AFTER - 1):
+        cycle(wifi, clock, True)
+    assert switches == []
+    cycle(wifi, clock, True)
+    assert switches == [wifi.SECONDARY_BACKUP_SSID]
+
+
+def test_better_measured_backup_is_preferred(wifi, policy, monkeypatch):
+    clock, switches, radio = policy
+    monkeypatch.setattr(wifi, 'THROUGHPUT_SINK', ('127.0.0.1', 9))
+    monkeypatch.setattr(wifi, 'probe_upload', lambda sink: 1500.0)
+    cycle(wifi, clock, True)
+    assert switches == []
+
+    # the backup was just measured at full marks on a strong signal
+    radio['signal_poll'] = 'RSSI=-45\nLINKSPEED=65\nNOISE=9999\nFREQUENCY=2412'
+    monkeypatch.setattr(wifi, 'probe_upload', lambda sink: 5000.0)
+    wifi.sample_link(wifi.SECONDARY_BACKUP_SSID, True, force_throughput=True)
+    radio['signal_poll'] = 'RSSI=-85\nLINKSPEED=6\nNOISE=9999\nFREQUENCY=2412'
+    cycle(wifi, clock, True)
+    assert switches == [wifi.SECONDARY_BACKUP_SSID]
+
+
+def test_backup_without_throughput_never_outranks_working_primary(wifi, policy):
+    clock, switches, radio = policy
+    cycle(wifi, clock, True)
+    radio['signal_poll'] = 'RSSI=-45\nLINKSPEED=65\nNOISE=9999\nFREQUENCY=2412'
+    wifi.sample_link(wifi.SECONDARY_BACKUP_SSID, True)
+    radio['signal_poll'] = 'RSSI=-85\nLINKSPEED=6\nNOISE=9999\nFREQUENCY=2412'
+    assert wifi.link_rank(wifi.SECONDARY_BACKUP_SSID) > wifi.link_rank(wifi.PRIMARY_REPEATER_SSID) + wifi.SCORE_MARGIN
+    cycle(wifi, clock, True)
+    assert switches == []
+
+
+def test_sample_keeps_each_target_rtt(wifi, policy, monkeypatch):
+    clock, switches, radio = policy
+    # two replies arrived in the same round, the third target was dropped
+    monkeypatch.setattr(wifi, 'target_rtts', {'1.1.1.1': 0.2, '8.8.8.8': 0.21049})
+    cycle(wifi, clock, True)
+    sample = wifi.link_sample(wifi.PRIMARY_REPEATER_SSID)
+    assert sample['rtt_ms'] == 200.0
+    assert sample['target_rtt_ms'] == {'1.1.1.1': 200.0, '8.8.8.8': 210.5}
+
+    cycle(wifi, clock, False)
+    assert wifi.state['link_quality'][wifi.PRIMARY_REPEATER_SSID]['target_rtt_ms'] == {}
+
+
+def test_check_internet_records_answers(wifi, monkeypatch):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    # no ICMP, a TCP connect to the listener
+    monkeypatch.setattr(wifi, 'icmp_socket', lambda: None)
+    monkeypatch.setattr(wifi, 'PING_TCP_PORT', listener.getsockname()[1])
+    monkeypatch.setattr(wifi, 'target_rtts', {'192.0.2.1': 1.0})
+    try:
+        assert wifi.check_internet(('127.0.0.1',))
+    finally:
+        listener.close()
+    assert wifi.target_rtts == {'127.0.0.1': wifi.internet_rtt}
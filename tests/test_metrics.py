@@ -0,0 +1,33 @@
+import pytest
+
+import collectd
+import dump1090
+
+GAIN = [row for row in dump1090.METRICS_1090 if row[2] == 'gain_db']
+
+
+def dispatch_gain(stats):
+    collectd.reset()
+    dump1090.MetricSet(GAIN, 'test', 'localhost').dispatch({'signal_stats': stats})
+    return [(v.time, v.values) for v in collectd.values('dump1090_misc', 'gain_db')]
+
+
+@pytest.mark.parametrize('stats, expected', [
+    ({'now': 200, 'gain_db': 1, 'last1min': {'end': 180, 'adaptive': {'gain_db': 49.6}, 'gain_db': 2}}, [(180, [49.6])]),
+    ({'now': 200, 'gain_db': 1, 'last1min': {'end': 180, 'gain_db': 43.9}}, [(180, [43.9])]),
+    # the top-level gain is stamped with the document's time, not the bucket's end
+    ({'now': 200, 'gain_db': 42.1, 'last1min': {'end': 180, 'local': {'gain_db': 3}}}, [(200, [42.1])]),
+    ({'now': 200, 'last1min': {'end': 180, 'local': {'gain_db': 38.6}}}, [(180, [38.6])]),
+    ({'now': 200, 'last1min': {'end': 180}}, []),
+    # a gain without its time is skipped, not stamped with another path's time
+    ({'gain_db': 42.1, 'last1min': {'end': 180}}, []),
+])
+def test_gain_db_time(stats, expected):
+    assert dispatch_gain(stats) == expected
+
+
+def test_adaptive_without_gain_falls_through():
+    # before the metric schema an adaptive block without gain_db dispatched
+    # nothing, now the next path present is used
+    stats = {'now': 200, 'last1min': {'end': 180, 'adaptive': {'gain_changes': 0}, 'local': {'gain_db': 38.6}}}
+    assert dispatch_gain(stats) == [(180, [38.6])]
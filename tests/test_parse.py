@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import dump1090
+from fixtures import aircraft_json
+
+COLUMNS = dump1090.AircraftTable.__slots__
+
+def write(tmp_path, doc):
+    path = tmp_path / 'aircraft.json'
+    path.write_text(json.dumps(doc))
+    return str(path)
+
+@pytest.mark.parametrize('n', [0, 1, 1000])
+def test_file_matches_json_load(tmp_path, n):
+    doc = aircraft_json(n)
+    parsed = dump1090.parse_aircraft_file(write(tmp_path, doc))
+    expected = dump1090.aircraft_table(doc['aircraft'])
+    for column in COLUMNS:
+        # tobytes, so NaN rssi compares equal
+        assert getattr(parsed['table'], column).tobytes() == getattr(expected, column).tobytes(), column
+    assert parsed['now'] == doc['now']
+    assert parsed['messages'] == doc['messages']
+    assert 'aircraft' not in parsed
+
+def test_nested_position_is_not_an_aircraft(tmp_path):
+    doc = {'now': 1, 'aircraft': [{'hex': 'abcdef', 'seen': 1.0,
+                                   'lastPosition': {'lat': 1.0, 'lon': 2.0, 'seen_pos': 100.0}}]}
+    table = dump1090.parse_aircraft_file(write(tmp_path, doc))['table']
+    assert len(table) == 1
+    assert table.seen_pos[0] == dump1090.NO_POS
+
+def test_body_matches_file(tmp_path):
+    doc = aircraft_json(50)
+    body = json.dumps(doc).encode('utf-8')
+    from_body = dump1090.decode_aircraft_body(body)
+    from_file = dump1090.parse_aircraft_file(write(tmp_path, doc))
+    for column in COLUMNS:
+        assert getattr(from_body['table'], column).tobytes() == getattr(from_file['table'], column).tobytes()
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'aircraft.json'
+    path.write_text('')
+    with pytest.raises(ValueError):
+        dump1090.parse_aircraft_file(str(path))
+
+def test_no_aircraft_list(tmp_path):
+    with pytest.raises(ValueError):
+        dump1090.parse_aircraft_file(write(tmp_path, {'now': 1}))
@@ -0,0 +1,60 @@
+import time
+
+import collectd
+import dump1090
+
+
+class Counter(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, data):
+        self.calls += 1
+        return {'cycle': self.calls}
+
+
+def prefetcher(interval, lead, max_age):
+    collect = Counter()
+    prefetch = dump1090.Prefetcher('test.prefetch', collect, None, interval, lead, max_age)
+    prefetch.start()
+    return prefetch, collect
+
+
+def test_first_tick_collects_itself():
+    collectd.reset()
+    prefetch, collect = prefetcher(60, 5, 0.01)
+    try:
+        time.sleep(0.1)
+        # nothing prefetched before the first tick, so nothing can be stale
+        assert collect.calls == 0
+        assert prefetch.take() == {'cycle': 1}
+        assert not [m for level, m in collectd.logged if level == 'warning']
+    finally:
+        prefetch.stop()
+
+
+def test_later_ticks_take_the_prefetched_cycle():
+    collectd.reset()
+    prefetch, collect = prefetcher(0.3, 0.2, 5)
+    try:
+        assert prefetch.take() == {'cycle': 1}
+        # the next cycle is due 0.1 s after the tick, ahead of the next one
+        time.sleep(0.3)
+        assert collect.calls == 2
+        assert prefetch.take() == {'cycle': 2}
+        # taken already
+        assert prefetch.take() is None
+    finally:
+        prefetch.stop()
+
+
+def test_stale_cycle_is_dropped():
+    collectd.reset()
+    prefetch, collect = prefetcher(0.3, 0.2, 0.05)
+    try:
+        prefetch.take()
+        time.sleep(0.4)
+        assert prefetch.take() is None
+        assert [m for level, m in collectd.logged if level == 'warning']
+    finally:
+        prefetch.stop()
@@ -0,0 +1,64 @@
+import io
+
+import dump1090
+
+class FakeProc(object):
+    """/proc with the given {pid: (cgroup, stat)} entries, counting the directory scans."""
+    def __init__(self, processes):
+        self.processes = processes
+        self.scans = 0
+
+    def listdir(self, path):
+        assert path == '/proc'
+        self.scans += 1
+        return [str(pid) for pid in self.processes]
+
+    def open(self, path, *args):
+        pid, name = path.split('/')[2:4]
+        return io.StringIO(self.processes[int(pid)][0 if name == 'cgroup' else 1])
+
+def stat(pid, ppid, start):
+    return '%d (fake) S %d ' % (pid, ppid) + ' '.join(['0'] * 17) + ' %d 0 0' % start
+
+def install(monkeypatch, proc, clock):
+    monkeypatch.setattr(dump1090.os, 'listdir', proc.listdir)
+    monkeypatch.setattr(dump1090, 'open', proc.open, raising=False)
+    monkeypatch.setattr(dump1090.time, 'time', lambda: clock[0])
+
+def test_missing_services_back_off(monkeypatch):
+    proc = FakeProc({})
+    clock = [1000.0]
+    install(monkeypatch, proc, clock)
+    sampler = dump1090.ProcessSampler(('readsb',))
+
+    searches = []
+    for minute in range(24 * 60):
+        clock[0] = 1000.0 + 60 * minute
+        before = proc.scans
+        sampler.resolve()
+        if proc.scans > before:
+            searches.append(minute)
+    # 5 minutes apart, then doubling up to 6 hours
+    assert searches[:8] == [0, 5, 15, 35, 75, 155, 315, 635]
+    assert [b - a for a, b in zip(searches[7:], searches[8:])] == [360] * (len(searches) - 8)
+
+def test_found_service_is_not_searched_again(monkeypatch):
+    proc = FakeProc({})
+    clock = [1000.0]
+    install(monkeypatch, proc, clock)
+    sampler = dump1090.ProcessSampler(('readsb', 'fr24feed'))
+    sampler.resolve()
+    assert proc.scans == 1
+
+    # readsb starts, fr24feed stays missing
+    proc.processes[42] = ('0::/system.slice/readsb.service\n', stat(42, 1, 777))
+    clock[0] += dump1090.RESOLVE_INTERVAL
+    sampler.resolve()
+    assert sampler.pids == {'readsb': (42, '777')}
+    assert 'readsb' not in sampler.retry
+    assert sampler.retry['fr24feed'][1] == 4 * dump1090.RESOLVE_INTERVAL
+
+    # nothing is due until fr24feed's next search
+    clock[0] += dump1090.RESOLVE_INTERVAL
+    sampler.resolve()
+    assert proc.scans == 2
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import dump1090
+
+PS = (0, 0.05, 0.25, 0.5, 0.75, 0.9, 0.95, 1)
+SIZES = (1, 2, 3, 4, 5, 7, 10, 33, 100, 257, 1000)
+
+def inputs(seed):
+    rng = random.Random(seed)
+    for n in SIZES:
+        yield [rng.uniform(-50, 1) for _ in range(n)]
+        # duplicate heavy, as signal levels rounded to 0.1 dB are
+        yield [rng.choice((-20.0, -20.0, -10.5, 0.0)) for _ in range(n)]
+        yield [float(rng.randint(0, 3)) for _ in range(n)]
+        yield [5.0] * n
+
+def expected(values, ps):
+    values = sorted(values)
+    return tuple(dump1090.perc(p, values) for p in ps)
+
+# (SORT_NUMPY_MIN, SELECT_MIN) sending every input down one path
+PATHS = {
+    'sorted': (float('inf'), float('inf')),
+    'numpy sort': (0, float('inf')),
+    'select': (0, 0),
+}
+
+@pytest.fixture(params=sorted(PATHS))
+def path(request, monkeypatch):
+    if dump1090.numpy is None and request.param != 'sorted':
+        pytest.skip('numpy not installed')
+    sort_min, select_min = PATHS[request.param]
+    monkeypatch.setattr(dump1090, 'SORT_NUMPY_MIN', sort_min)
+    monkeypatch.setattr(dump1090, 'SELECT_MIN', select_min)
+    return request.param
+
+def test_matches_perc(path):
+    for values in inputs(1):
+        assert dump1090.quantiles(values, PS) == expected(values, PS)
+        assert dump1090.quartiles(values) == expected(values, dump1090.QUARTILES)
+
+def test_numpy_input_matches_perc(path):
+    if dump1090.numpy is None:
+        pytest.skip('numpy not installed')
+    for values in inputs(2):
+        assert dump1090.quantiles(dump1090.numpy.array(values), PS) == expected(values, PS)
+
+def test_input_left_alone(path):
+    values = [3.0, 1.0, 2.0]
+    dump1090.quantiles(values, PS)
+    assert values == [3.0, 1.0, 2.0]
+
+def test_empty(path):
+    assert dump1090.quantiles([], PS) is None
+    assert dump1090.quartiles([]) is None
+
+def test_without_numpy(monkeypatch):
+    monkeypatch.setattr(dump1090, 'numpy', None)
+    for values in inputs(3):
+        assert dump1090.quantiles(values, PS) == expected(values, PS)
+
+@pytest.mark.skipif(dump1090.numpy is None, reason='numpy not installed')
+def test_select_ranks():
+    rng = random.Random(4)
+    for n in SIZES:
+        values = [float(rng.randint(0, n // 3)) for _ in range(n)]
+        ranks = sorted(set(rng.randrange(n) for _ in range(5)))
+        selected = dump1090.select_ranks(dump1090.numpy.array(values), ranks)
+        assert selected == dict((k, sorted(values)[k]) for k in ranks)
@@ -0,0 +1,48 @@
+import math
+
+import pytest
+
+import dump1090
+from bench_reduce import baseline
+from fixtures import RECEIVER, aircraft_json
+
+def reduce_loop(table, rlat, rlon, uat=False):
+    saved = dump1090.REDUCE_NUMPY_MIN
+    dump1090.REDUCE_NUMPY_MIN = float('inf')
+    try:
+        return dump1090.reduce_aircraft(table, rlat, rlon, uat)
+    finally:
+        dump1090.REDUCE_NUMPY_MIN = saved
+
+def assert_close(a, b):
+    assert (a is None) == (b is None)
+    if a is not None:
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-6)
+
+@pytest.mark.parametrize('n', [0, 1, 50, 900])
+def test_loop_matches_baseline(n):
+    aircraft = aircraft_json(n)['aircraft']
+    reduced = reduce_loop(dump1090.aircraft_table(aircraft), RECEIVER['lat'], RECEIVER['lon'])
+    expected = baseline(aircraft, RECEIVER['lat'], RECEIVER['lon'])
+    got = list(reduced['ranges'] or ()) + list(reduced['signals'] or ())
+    assert_close(got, expected)
+
+@pytest.mark.skipif(dump1090.numpy is None, reason='numpy not installed')
+@pytest.mark.parametrize('uat', [False, True])
+@pytest.mark.parametrize('n', [0, 1, 63, 64, 900])
+def test_numpy_matches_loop(n, uat):
+    table = dump1090.aircraft_table(aircraft_json(n, seed=n)['aircraft'])
+    for rlat, rlon in ((RECEIVER['lat'], RECEIVER['lon']), (None, None)):
+        loop = reduce_loop(table, rlat, rlon, uat)
+        vectorized = dump1090.reduce_aircraft_numpy(table, rlat, rlon, uat)
+        for key in ('total', 'with_pos', 'mlat', 'tisb', 'gps'):
+            assert loop[key] == vectorized[key]
+        for key in ('ranges', 'signals'):
+            assert_close(loop[key], vectorized[key])
+        assert_close(loop['range_values'], vectorized['range_values'])
+        assert_close(loop['signal_values'], vectorized['signal_values'])
+
+def test_greatcircle_same_point():
+    assert dump1090.greatcircle(52.1, 13.2, 52.1, 13.2) == 0
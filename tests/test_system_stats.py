@@ -0,0 +1,157 @@
+import os
+
+import pytest
+
+import system_stats
+
+MEMINFO = '''MemTotal:        3884360 kB
+MemFree:          181396 kB
+MemAvailable:    2987600 kB
+Buffers:          158828 kB
+Cached:          2525844 kB
+SwapCached:          524 kB
+Active:          1306928 kB
+Inactive:        1978692 kB
+Shmem:             36148 kB
+KReclaimable:     247632 kB
+Slab:             357424 kB
+SReclaimable:     247632 kB
+SUnreclaim:       109792 kB
+'''
+
+STAT = '''cpu  1058 0 771 184468 93 0 36 0 0 0
+cpu0 530 0 390 92228 47 0 20 0 0 0
+intr 214497 0 9 0 0 0
+ctxt 389620
+btime 1700000000
+processes 5331
+procs_running 2
+procs_blocked 1
+softirq 118221 1 40163 3 1855 2612 0 14 38052 0 35521
+'''
+
+
+def write(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def root(tmp_path):
+    """A /proc and /sys with meminfo, stat, cpu PSI and two thermal zones of the same type."""
+    root = str(tmp_path)
+    write(root + '/proc/meminfo', MEMINFO)
+    write(root + '/proc/stat', STAT)
+    # before Linux 5.13 the cpu file has no "full" line
+    write(root + '/proc/pressure/cpu', 'some avg10=0.00 avg60=0.10 avg300=0.05 total=123456\n')
+    for zone, temp in ((0, '47236\n'), (1, '39000\n')):
+        write(root + '/sys/class/thermal/thermal_zone%d/type' % zone, 'cpu-thermal\n')
+        write(root + '/sys/class/thermal/thermal_zone%d/temp' % zone, temp)
+    return root
+
+
+def old_memory(contents):
+    """The memory values as handle_read computed them before the files were kept open."""
+    data = {}
+    for line in contents.split('\n'):
+        words = line.split()
+        if len(words) > 1:
+            data[words[0].split(':')[0]] = words[1]
+    total = 1024 * int(data['MemTotal'])
+    free = 1024 * int(data['MemFree'])
+    buffers = 1024 * int(data['Buffers'])
+    cached = 1024 * (int(data['Cached']) + int(data['SReclaimable']) - int(data['Shmem']))
+    used = total - free - buffers - cached
+    return [('memory', 'used', [used]),
+            ('memory', 'buffers', [buffers]),
+            ('memory', 'cached', [cached]),
+            ('memory', 'free', [free])]
+
+
+def sample(sampler, type):
+    return dict((type_instance, v) for t, type_instance, v in sampler.sample() if t == type)
+
+
+def test_memory_matches_old_calculation(root):
+    sampler = system_stats.Sampler(root)
+    assert sampler.sample()[:4] == old_memory(MEMINFO)
+
+
+def test_moved_key_is_searched_again(root):
+    sampler = system_stats.Sampler(root)
+    sampler.sample()
+    assert sampler.meminfo.lines[b'Shmem:'] == 8
+
+    # a kernel that prints more lines ahead of Shmem
+    moved = MEMINFO.replace('Shmem:', 'Unevictable:           0 kB\nMlocked:               0 kB\nShmem:')
+    moved = moved.replace('36148', '40000')
+    write(root + '/proc/meminfo', moved)
+    assert sampler.sample()[:4] == old_memory(moved)
+    assert sampler.meminfo.lines[b'Shmem:'] == 10
+    assert sampler.meminfo.lines[b'MemTotal:'] == 0
+
+
+def test_read_grows_buffer(root):
+    # /proc/stat of a machine with many interrupts is larger than the first read
+    big = STAT.replace('intr 214497', 'intr 214497' + ' 0' * 5000)
+    write(root + '/proc/stat', big)
+    sampler = system_stats.Sampler(root)
+    assert sampler.stat.read() == big.encode()
+    assert sampler.stat.size > len(big)
+
+    values = sample(sampler, 'ps_state')
+    assert values == {'running': [2], 'blocked': [1]}
+
+
+def test_stat(root):
+    sampler = system_stats.Sampler(root)
+    assert sample(sampler, 'contextswitch') == {'': [389620]}
+    irqs = sample(sampler, 'irq')
+    assert irqs['softirq-hi'] == [1]
+    assert irqs['softirq-net_rx'] == [1855]
+    assert irqs['softirq-rcu'] == [35521]
+    assert len(irqs) == len(system_stats.SOFTIRQS)
+
+
+def test_psi(root):
+    write(root + '/proc/pressure/io', 'some avg10=0.00 avg60=0.00 avg300=0.00 total=700\n'
+                                      'full avg10=0.00 avg60=0.00 avg300=0.00 total=500\n')
+    sampler = system_stats.Sampler(root)
+    # no memory file, no "full" line for cpu
+    assert sample(sampler, 'system_psi') == {'cpu': [123456, 0], 'io': [700, 500]}
+
+
+def test_thermal_zones(root):
+    sampler = system_stats.Sampler(root)
+    assert sample(sampler, 'temperature') == {'cpu-thermal': [47.236], 'cpu-thermal-1': [39.0]}
+
+
+def test_missing_optional_files_are_skipped(tmp_path):
+    root = str(tmp_path)
+    write(root + '/proc/meminfo', MEMINFO)
+    write(root + '/proc/stat', STAT)
+    sampler = system_stats.Sampler(root)
+    assert sampler.pressure == [] and sampler.thermal == []
+    assert sampler.pi_throttled is None and sampler.x86_throttle is None
+    assert set(t for t, type_instance, v in sampler.sample()) == set(['memory', 'contextswitch', 'ps_state', 'irq'])
+
+
+def test_unreadable_files_lose_only_their_value(root):
+    write(root + system_stats.PI_THROTTLED, '0x50005\n')
+    write(root + system_stats.X86_THROTTLE, '17\n')
+    # a zone that opens but refuses to be read
+    write(root + '/sys/class/thermal/thermal_zone2/type', 'gpu-thermal\n')
+    os.mkdir(root + '/sys/class/thermal/thermal_zone2/temp')
+    sampler = system_stats.Sampler(root)
+    assert len(sampler.thermal) == 3
+    assert sample(sampler, 'temperature') == {'cpu-thermal': [47.236], 'cpu-thermal-1': [39.0]}
+    assert sample(sampler, 'system_throttled') == {'': [1, 0, 1, 0]}
+    assert sample(sampler, 'derive') == {'thermal_throttle': [17]}
+
+    # a busy firmware mailbox, a bad count
+    write(root + system_stats.PI_THROTTLED, '')
+    write(root + system_stats.X86_THROTTLE, 'error\n')
+    types = set(t for t, type_instance, v in sampler.sample())
+    assert types == set(['memory', 'contextswitch', 'ps_state', 'irq', 'system_psi', 'temperature'])
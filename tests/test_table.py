@@ -0,0 +1,58 @@
+import math
+
+import dump1090
+from fixtures import aircraft_json
+
+AIRCRAFT = [
+    {'hex': '3c6586', 'seen': 0.4, 'seen_pos': 1.5, 'lat': 52.3, 'lon': 13.1,
+     'rssi': -12.5, 'messages': 8123, 'type': 'adsb_icao', 'alt_baro': 36000},
+    {'hex': '~2a01f3', 'seen': 12.0, 'messages': 5, 'type': 'tisb_trackfile',
+     'alt_baro': 'ground', 'seen_pos': 3.0, 'lat': 51.9, 'lon': 12.7, 'tisb': ['lat', 'lon']},
+    {'hex': 'a1b2c3', 'seen': 2.0, 'rssi': -30.1, 'messages': 40, 'type': 'mlat',
+     'altitude': 2500, 'seen_pos': 2.5, 'lat': 52.0, 'lon': 13.0, 'mlat': ['lat', 'lon']},
+    {'hex': '4b1802', 'seen': 30.0, 'type': 'adsr_icao'},
+]
+
+
+def test_columns():
+    table = dump1090.aircraft_table(AIRCRAFT)
+    assert len(table) == 4
+    assert list(table.seen) == [0.4, 12.0, 2.0, 30.0]
+    assert list(table.seen_pos)[:3] == [1.5, 3.0, 2.5]
+    assert table.seen_pos[3] == dump1090.NO_POS
+    assert list(table.lat) == [52.3, 51.9, 52.0, 0.0]
+    assert list(table.lon) == [13.1, 12.7, 13.0, 0.0]
+    assert table.rssi[0] == -12.5 and table.rssi[2] == -30.1
+    assert math.isnan(table.rssi[1]) and math.isnan(table.rssi[3])
+    assert list(table.messages) == [8123, 5, 40, 0]
+    assert list(table.source) == [dump1090.SOURCE_OTHER, dump1090.SOURCE_TISB,
+                                  dump1090.SOURCE_OTHER, dump1090.SOURCE_ADSR]
+    assert list(table.flags) == [0, dump1090.FLAG_TISB, dump1090.FLAG_MLAT, 0]
+    assert list(table.addr) == [0x3c6586, 0x2a01f3 | dump1090.NON_ICAO, 0xa1b2c3, 0x4b1802]
+    assert list(table.alt)[:3] == [36000.0, 0.0, 2500.0]
+    assert math.isnan(table.alt[3])
+
+
+def test_rows_match_columns():
+    table = dump1090.aircraft_table(aircraft_json(200)['aircraft'])
+    rows = list(table.rows())
+    assert len(rows) == len(table) == 200
+    for i, row in enumerate(rows):
+        # repr, rssi may be nan
+        assert repr(row) == repr((table.seen[i], table.seen_pos[i], table.lat[i], table.lon[i],
+                                  table.rssi[i], table.messages[i], table.source[i], table.flags[i]))
+
+
+def test_append_matches_constructor():
+    built = dump1090.aircraft_table(AIRCRAFT)
+    appended = dump1090.AircraftTable()
+    for i in range(len(built)):
+        appended.append(*[getattr(built, column)[i] for column in dump1090.AircraftTable.__slots__])
+    for column in dump1090.AircraftTable.__slots__:
+        assert getattr(appended, column).tobytes() == getattr(built, column).tobytes()
+
+
+def test_empty():
+    table = dump1090.aircraft_table([])
+    assert len(table) == 0
+    assert list(table.rows()) == []
@@ -0,0 +1,122 @@
+import socket
+
+import pytest
+
+
+class FakeSocket:
+    """Answers each send with the next of replies: bytes, an exception to raise, or None for silence.
+
+    events are unsolicited messages that arrive ahead of every reply.
+    """
+
+    def __init__(self, replies, send_error=None, events=()):
+        self.replies = list(replies)
+        self.send_error = send_error
+        self.events = list(events)
+        self.sent = []
+        self.pending = []
+        self.blocking = True
+        self.closed = False
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def settimeout(self, timeout):
+        self.blocking = True
+
+    def send(self, data):
+        if self.send_error is not None:
+            raise self.send_error
+        self.sent.append(data)
+        self.pending.extend(self.events)
+        reply = self.replies.pop(0)
+        if reply is not None:
+            self.pending.append(reply)
+        return len(data)
+
+    def recv(self, size):
+        if self.pending:
+            reply = self.pending.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+        if not self.blocking:
+            raise BlockingIOError()
+        raise socket.timeout('timed out')
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def control(wifi, monkeypatch):
+    """wpa_request's control for wlan-test, its sockets come from the sockets list."""
+    sockets = []
+    opened = []
+
+    def fake_open(self):
+        self.sock = sockets.pop(0)
+        opened.append(self.sock)
+
+    monkeypatch.setattr(wifi.WpaControl, 'open', fake_open)
+    monkeypatch.setitem(wifi.wpa_controls, 'wlan-test', wifi.WpaControl('wlan-test'))
+    cli = []
+    monkeypatch.setattr(wifi, 'run_command', lambda command, use_sudo=True: cli.append(command) or 'CLI')
+    return sockets, opened, cli
+
+
+def test_good_reply(wifi, control):
+    sockets, opened, cli = control
+    sockets.append(FakeSocket([b'OK\n'], events=[b'<3>CTRL-EVENT-SCAN-STARTED ']))
+    assert wifi.wpa_request('SELECT_NETWORK 1', 'wlan-test') == 'OK'
+    assert opened[0].sent == [b'SELECT_NETWORK 1']
+    assert cli == []
+
+
+def test_error_reply(wifi, control):
+    sockets, opened, cli = control
+    sockets.append(FakeSocket([b'FAIL\n']))
+    assert wifi.wpa_request('SELECT_NETWORK 99', 'wlan-test') == 'FAIL'
+    assert opened[0].sent == [b'SELECT_NETWORK 99']
+    assert cli == []
+
+
+def test_timeout_is_not_retried(wifi, control):
+    sockets, opened, cli = control
+    sockets.append(FakeSocket([None, b'wpa_state=COMPLETED\n']))
+    assert wifi.wpa_request('SELECT_NETWORK 1', 'wlan-test') is None
+    # sent once, not again on a new socket and not through wpa_cli
+    assert len(opened) == 1
+    assert opened[0].sent == [b'SELECT_NETWORK 1']
+    assert cli == []
+
+    # a late reply is drained, the next request gets its own
+    opened[0].pending.append(b'OK\n')
+    assert wifi.wpa_request('STATUS', 'wlan-test') == 'wpa_state=COMPLETED'
+
+
+def test_receive_error_is_not_retried(wifi, control):
+    sockets, opened, cli = control
+    sockets.append(FakeSocket([ConnectionResetError()]))
+    assert wifi.wpa_request('SELECT_NETWORK 1', 'wlan-test') is None
+    assert len(opened) == 1 and opened[0].closed
+    assert cli == []
+
+
+def test_failed_send_is_retried_on_a_new_socket(wifi, control):
+    sockets, opened, cli = control
+    # wpa_supplicant restarted, the old socket is gone
+    sockets.append(FakeSocket([], send_error=ConnectionRefusedError()))
+    sockets.append(FakeSocket([b'OK\n']))
+    assert wifi.wpa_request('SELECT_NETWORK 1', 'wlan-test') == 'OK'
+    assert opened[0].closed and opened[0].sent == []
+    assert opened[1].sent == [b'SELECT_NETWORK 1']
+    assert cli == []
+
+
+def test_missing_socket_falls_back_to_wpa_cli(wifi, monkeypatch, tmp_path):
+    monkeypatch.setitem(wifi.wpa_controls, 'wlan-test', wifi.WpaControl('wlan-test', str(tmp_path)))
+    cli = []
+    monkeypatch.setattr(wifi, 'run_command', lambda command, use_sudo=True: cli.append(command) or 'OK')
+    assert wifi.wpa_request('SELECT_NETWORK 1', 'wlan-test') == 'OK'
+    assert cli == [['wpa_cli', '-i', 'wlan-test', 'select_network', '1']]